@@ -0,0 +1,117 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+"""
+Cold start benchmark for the pyx command line tool.
+
+Runs `pyx --help` and `pyx run` on a trivial project in fresh interpreters
+and reports median / p90 wall time, and checks that heavy modules are not
+imported by commands that don't need them:
+
+    $ python benchmarks/startup.py --repeat 20 --max-ms 300
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+
+__HEAVY_MODULES__ = ['requests', 'inquirer', 'numpy', 'urllib3']
+
+__PYX_ENDPOINTS__ = '''
+def get_weight_paths():
+    return {}
+
+
+def predict(input_directory, output_directory, weight_paths, device):
+    return True
+'''
+
+# Runs the CLI and reports which heavy modules ended up imported
+__LAUNCHER__ = '''
+import sys, json, atexit
+atexit.register(lambda: sys.stderr.write('PYX_MODULES ' + json.dumps(
+    [m for m in {heavy} if m in sys.modules]) + '\\n'))
+sys.argv = ['pyx'] + {argv}
+from pyx_cli.cli import main
+main()
+'''
+
+
+def _measure(argv, cwd, repeat):
+    timings = []
+    imported = []
+    for _ in range(repeat):
+        code = __LAUNCHER__.format(heavy=repr(__HEAVY_MODULES__), argv=repr(argv))
+        start = time.perf_counter()
+        p = subprocess.run([sys.executable, '-c', code], cwd=cwd, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.PIPE, universal_newlines=True,
+                           env={**os.environ, 'PYTHONPATH': os.path.dirname(os.path.dirname(os.path.abspath(__file__)))})
+        timings.append((time.perf_counter() - start) * 1e3)
+
+        for line in p.stderr.splitlines():
+            if line.startswith('PYX_MODULES '):
+                imported = json.loads(line[len('PYX_MODULES '):])
+
+    timings.sort()
+    return {
+        'median_ms': timings[len(timings) // 2],
+        'p90_ms': timings[min(len(timings) - 1, int(len(timings) * 0.9))],
+        'min_ms': timings[0],
+        'imported': imported,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='startup')
+    parser.add_argument('--repeat', type=int, default=10, help='runs per command')
+    parser.add_argument('--max-ms', type=float, default=None, help='fail if a median is above this')
+    parser.add_argument('--output', type=str, default=None, help='write results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as project_dir:
+        os.makedirs(os.path.join(project_dir, 'in'))
+        with open(os.path.join(project_dir, 'pyx.json'), 'w') as f:
+            f.write(json.dumps({'framework': 'pytorch'}))
+        with open(os.path.join(project_dir, 'pyx_endpoints.py'), 'w') as f:
+            f.write(__PYX_ENDPOINTS__)
+
+        results = {
+            'pyx --help': _measure(['--help'], project_dir, args.repeat),
+            'pyx run': _measure(['run', 'in', 'out'], project_dir, args.repeat),
+        }
+
+    # Interpreter start alone, to tell CLI overhead apart
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        subprocess.run([sys.executable, '-c', 'pass'])
+    results['python'] = {'median_ms': (time.perf_counter() - start) * 1e3 / args.repeat}
+
+    failed = False
+    for name, result in results.items():
+        line = '{0:<16} median {1:7.1f} ms'.format(name, result['median_ms'])
+        if 'p90_ms' in result:
+            line += '   p90 {0:7.1f} ms   heavy imports: {1}'.format(
+                result['p90_ms'], ', '.join(result['imported']) or '-')
+        print(line)
+
+        if args.max_ms is not None and name.startswith('pyx') and result['median_ms'] > args.max_ms:
+            print('  regression: median above {0} ms'.format(args.max_ms))
+            failed = True
+        if result.get('imported'):
+            print('  regression: heavy modules imported at startup')
+            failed = True
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent=4))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
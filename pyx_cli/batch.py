@@ -0,0 +1,175 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+import os
+import glob
+import json
+import time
+
+from pyx_cli.tasks import TaskWaiter, enqueue, unpack_result, is_finished, is_retryable
+
+
+def collect_jobs(inputs, output_dir, manifest=None):
+    """
+    Map input directories to output directories.
+
+    Inputs may be directories or glob patterns, results go to
+    output_dir/<input directory name>. A manifest file lists one input
+    directory per line, optionally followed by a tab and its output directory.
+    Two inputs sharing an output directory raise ValueError.
+    """
+    jobs = {}
+    for pattern in inputs:
+        for input_dir in sorted(glob.glob(pattern)) or [pattern]:
+            if os.path.isdir(input_dir):
+                jobs[input_dir] = os.path.join(output_dir, os.path.basename(os.path.normpath(input_dir)))
+
+    if manifest is not None:
+        with open(manifest, 'r') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if not line.strip() or line.startswith('#'):
+                    continue
+                input_dir, _, job_output_dir = line.partition('\t')
+                jobs[input_dir] = job_output_dir or os.path.join(
+                    output_dir, os.path.basename(os.path.normpath(input_dir)))
+
+    owners = {}
+    for input_dir, job_output_dir in jobs.items():
+        other = owners.setdefault(os.path.normpath(job_output_dir), input_dir)
+        if other != input_dir:
+            raise ValueError('Inputs {} and {} would both write to {}, list them in a --manifest with '
+                             'their own output directories'.format(other, input_dir, job_output_dir))
+
+    return jobs
+
+
+class BatchRun(object):
+    """
+    Run one model over many input directories.
+
+    Up to max_in_flight tasks are uploaded and processed at once. Uploads
+    happen on a thread pool, all submitted tasks are polled from a single
+    loop with per-task backoff. Progress is kept in a state file, so an
+    interrupted batch resumes polling submitted tasks and only enqueues the
+    rest.
+    """
+    def __init__(self, client, model_name, jobs, state_path,
+                 max_in_flight=8, waiter=None, codec=None):
+        self.client = client
+        self.model_name = model_name
+        self.codec = codec
+        self.max_in_flight = max_in_flight
+        self.waiter = waiter or TaskWaiter(client)
+        self.state_path = state_path
+
+        self.state = {}
+        if os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                self.state = json.load(f)
+
+        for input_dir, output_dir in jobs.items():
+            if input_dir not in self.state:
+                self.state[input_dir] = {'output_dir': output_dir, 'status': 'pending', 'task_id': None}
+
+    def _save_state(self):
+        with open(self.state_path + '.tmp', 'w') as f:
+            f.write(json.dumps(self.state, indent=4))
+            f.close()
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def remaining_quota(self):
+        r = self.client.get('quotas/')
+        if r.status_code != 200:
+            return None
+        return r.json()['requests']
+
+    def _count(self, status):
+        return sum(1 for job in self.state.values() if job['status'] == status)
+
+    def run(self):
+        from pyx_cli.compression import BlockCompressor, negotiate_codec
+
+        # One compressor, so concurrent uploads share a single pool of cpu_count threads
+        compressor = BlockCompressor(negotiate_codec(self.client, self.codec))
+        try:
+            return self._run(compressor)
+        finally:
+            compressor.close()
+
+    def _run(self, compressor):
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        pending = [k for k, job in self.state.items() if job['status'] == 'pending']
+        budget = self.remaining_quota()
+        if budget is not None and budget < len(pending):
+            print('Only {0} of {1} pending inputs fit into the remaining quota.'.format(budget, len(pending)))
+            pending = pending[:budget]
+
+        # Submitted tasks: input_dir -> [next poll time, current delay]
+        polling = {k: [0.0, self.waiter.initial_delay]
+                   for k, job in self.state.items() if job['status'] == 'submitted'}
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            uploads = {}
+            while pending or uploads or polling:
+                while pending and len(uploads) + len(polling) < self.max_in_flight:
+                    input_dir = pending.pop(0)
+                    uploads[executor.submit(enqueue, self.client, self.model_name, input_dir, False,
+                                            compressor=compressor)] = input_dir
+
+                now = time.monotonic()
+                next_poll = min([p[0] for p in polling.values()], default=now + 0.5)
+                if uploads:
+                    done, _ = wait(list(uploads), timeout=max(0.0, next_poll - now), return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(max(0.0, next_poll - now))
+                    done = []
+
+                for future in done:
+                    input_dir = uploads.pop(future)
+                    job = self.state[input_dir]
+                    try:
+                        r = future.result()
+                        r.raise_for_status()
+                        job['task_id'], job['status'] = r.json()['task_id'], 'submitted'
+                        polling[input_dir] = [time.monotonic() + self.waiter.initial_delay,
+                                              self.waiter.initial_delay]
+                        print('{0}: task {1}'.format(input_dir, job['task_id']))
+                    except Exception as e:
+                        job['status'], job['error'] = 'failed', str(e)
+                        print('{0}: enqueue failed: {1}'.format(input_dir, e))
+                    self._save_state()
+
+                for input_dir in [k for k, p in polling.items() if p[0] <= time.monotonic()]:
+                    self._poll(input_dir, polling)
+
+        print('Done: {0}, failed: {1}, pending: {2}'.format(
+            self._count('done'), self._count('failed'), self._count('pending')))
+        return self._count('failed') == 0 and self._count('pending') == 0
+
+    def _poll(self, input_dir, polling):
+        job = self.state[input_dir]
+        r, res = self.waiter.poll(job['task_id'])
+        if r is None:
+            # Network hiccup: try again later
+            print('{0}: {1}'.format(input_dir, res['status_msg']))
+
+        if r is not None and r.status_code == 200 and is_finished(res):
+            del polling[input_dir]
+            try:
+                unpack_result(res, job['output_dir'], self.client)
+                job['status'] = 'done'
+                print('{0}: done after {1} polls'.format(input_dir, self.waiter.polls[job['task_id']]))
+            except Exception as e:
+                job['status'], job['error'] = 'failed', str(e)
+                print('{0}: failed: {1}'.format(input_dir, e))
+            self._save_state()
+        elif r is not None and r.status_code != 200 and not is_retryable(r):
+            del polling[input_dir]
+            job['status'], job['error'] = 'failed', res.get('status_msg')
+            print('{0}: failed: {1}'.format(input_dir, job['error']))
+            self._save_state()
+        else:
+            sleep, polling[input_dir][1] = self.waiter.next_delay(polling[input_dir][1], r)
+            polling[input_dir][0] = time.monotonic() + sleep
@@ -0,0 +1,218 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+import os
+import sys
+import json
+import time
+import math
+import platform
+
+
+__BENCHMARK_DEFAULTS__ = {
+    'warmup': 1,
+    'iterations': 10,
+    'regression_threshold': 10.0,
+}
+
+
+def percentile(values, q):
+    """
+    Linear interpolation between closest ranks, like numpy's default
+    """
+    values = sorted(values)
+    if not values:
+        return float('nan')
+
+    position = (len(values) - 1) * q / 100.0
+    lower, upper = int(math.floor(position)), int(math.ceil(position))
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(samples_ns):
+    samples_ms = [s / 1e6 for s in samples_ns]
+    mean = sum(samples_ms) / len(samples_ms)
+    variance = sum((s - mean) ** 2 for s in samples_ms) / max(1, len(samples_ms) - 1)
+
+    return {
+        'mean': mean,
+        'stddev': math.sqrt(variance),
+        'min': min(samples_ms),
+        'max': max(samples_ms),
+        'p50': percentile(samples_ms, 50),
+        'p90': percentile(samples_ms, 90),
+        'p99': percentile(samples_ms, 99),
+    }
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def memory_mb():
+    """
+    Current memory of this process split by whether other processes can share it:
+    anonymous pages (heap, copied weights) are private, file-backed pages
+    (code, memory-mapped weights) come from the page cache and are shared by
+    every process mapping the same file. pss charges shared pages to each of
+    their users proportionally. None where /proc/self/smaps_rollup is missing.
+    """
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    except OSError:
+        return None
+
+    return {
+        'rss': fields.get('Rss', 0.0),
+        'pss': fields.get('Pss', 0.0),
+        'anonymous': fields.get('Anonymous', 0.0),
+        'file_backed': fields.get('Rss', 0.0) - fields.get('Anonymous', 0.0),
+        'shared': fields.get('Shared_Clean', 0.0) + fields.get('Shared_Dirty', 0.0),
+    }
+
+
+class Benchmark(object):
+    """
+    Measure model load time and per-call predict latency.
+
+    Warmup calls are not recorded. Every call gets a fresh output directory
+    created outside of the timed region. Python allocations are traced with
+    tracemalloc in one extra call after the timed ones, so tracing overhead
+    does not leak into the latencies.
+    """
+    def __init__(self, input_dir, device, warmup=None, iterations=None):
+        self.input_dir = input_dir
+        self.device = device
+        self.warmup = warmup if warmup is not None else __BENCHMARK_DEFAULTS__['warmup']
+        self.iterations = iterations or __BENCHMARK_DEFAULTS__['iterations']
+
+        self.load_ns = None
+        self.load_memory = None
+        self.samples_ns = []
+        self.tracemalloc_peak_mb = None
+
+    def load(self, load_fn):
+        start = time.perf_counter_ns()
+        result = load_fn()
+        self.load_ns = time.perf_counter_ns() - start
+        self.load_memory = memory_mb()
+        return result
+
+    def _call(self, predict_fn, on_output=None):
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            start = time.perf_counter_ns()
+            completed = predict_fn(self.input_dir, output_dir, self.device)
+            elapsed = time.perf_counter_ns() - start
+            if on_output is not None and completed is not False:
+                on_output(output_dir)
+
+        if completed is False:
+            raise AssertionError('predict returned False')
+        return elapsed
+
+    def run(self, predict_fn, on_sample=None, on_output=None):
+        """
+        on_output(output_dir) is called with the outputs of the first timed call
+        """
+        import tracemalloc
+
+        for _ in range(self.warmup):
+            self._call(predict_fn)
+
+        for i in range(self.iterations):
+            elapsed = self._call(predict_fn, on_output if i == 0 else None)
+            self.samples_ns.append(elapsed)
+            if on_sample is not None:
+                on_sample(elapsed)
+
+        tracemalloc.start()
+        try:
+            self._call(predict_fn)
+            self.tracemalloc_peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        finally:
+            tracemalloc.stop()
+
+    def report(self):
+        return {
+            'created_at': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'device': self.device,
+            'warmup': self.warmup,
+            'iterations': self.iterations,
+            'load_ms': self.load_ns / 1e6 if self.load_ns is not None else None,
+            'latency_ms': summarize(self.samples_ns),
+            'peak_rss_mb': peak_rss_mb(),
+            'tracemalloc_peak_mb': self.tracemalloc_peak_mb,
+            'memory_after_load_mb': self.load_memory,
+            'memory_mb': memory_mb(),
+        }
+
+
+def print_report(report):
+    latency = report['latency_ms']
+    if report['load_ms'] is not None:
+        print('Load time: {0:.1f} ms'.format(report['load_ms']))
+    print('Inference time ({0} runs, {1} warmup): mean {2:.1f} ms, stddev {3:.1f} ms'.format(
+        report['iterations'], report['warmup'], latency['mean'], latency['stddev']))
+    print('  p50 {0:.1f} ms, p90 {1:.1f} ms, p99 {2:.1f} ms, min {3:.1f} ms, max {4:.1f} ms'.format(
+        latency['p50'], latency['p90'], latency['p99'], latency['min'], latency['max']))
+    if report['peak_rss_mb'] is not None:
+        print('Peak RSS: {0:.1f} MB'.format(report['peak_rss_mb']))
+    if report['tracemalloc_peak_mb'] is not None:
+        print('Peak Python allocations: {0:.1f} MB'.format(report['tracemalloc_peak_mb']))
+    for name in ['memory_after_load_mb', 'memory_mb']:
+        memory = report.get(name)
+        if memory is not None:
+            print('{0}: resident {1:.1f} MB = private {2:.1f} MB + file-backed {3:.1f} MB '
+                  '(shared with other processes now {4:.1f} MB, proportional {5:.1f} MB)'.format(
+                      'Memory after load' if name == 'memory_after_load_mb' else 'Memory after runs',
+                      memory['rss'], memory['anonymous'], memory['file_backed'], memory['shared'], memory['pss']))
+
+
+def save_report(report, path):
+    with open(path, 'w') as f:
+        f.write(json.dumps(report, indent=4))
+        f.close()
+
+
+def compare_reports(report, baseline_path, threshold=None):
+    """
+    Print latency changes against a baseline report.
+    Returns False when any of them got slower by more than threshold percent.
+    """
+    threshold = threshold if threshold is not None else __BENCHMARK_DEFAULTS__['regression_threshold']
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+
+    passed = True
+    rows = [('load', report['load_ms'], baseline.get('load_ms'))]
+    rows += [(k, report['latency_ms'][k], baseline['latency_ms'].get(k)) for k in ['mean', 'p50', 'p90', 'p99']]
+
+    print('Compared with {0}:'.format(os.path.basename(baseline_path)))
+    for name, current, previous in rows:
+        if current is None or not previous:
+            continue
+
+        change = (current - previous) * 100.0 / previous
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            passed = False
+        print('  {0:<5} {1:9.1f} ms -> {2:9.1f} ms ({3:+.1f}%){4}'.format(name, previous, current, change, flag))
+
+    return passed
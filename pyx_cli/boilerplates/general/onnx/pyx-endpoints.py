@@ -1,17 +1,171 @@
-from typing import Dict
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+
+
+# Graph optimization level: 'disable', 'basic', 'extended' or 'all'
+__OPTIMIZATION_LEVEL__ = os.environ.get('PYX_ORT_OPTIMIZATION_LEVEL', 'all')
+# 'sequential' runs one operator at a time, 'parallel' also runs independent branches concurrently
+__EXECUTION_MODE__ = os.environ.get('PYX_ORT_EXECUTION_MODE', 'sequential')
+
+__ORT_TYPES__ = {
+    'tensor(float)': np.float32,
+    'tensor(float16)': np.float16,
+    'tensor(double)': np.float64,
+    'tensor(int64)': np.int64,
+    'tensor(int32)': np.int32,
+    'tensor(int8)': np.int8,
+    'tensor(uint8)': np.uint8,
+    'tensor(bool)': np.bool_,
+}
 
 
 def get_weight_paths() -> Dict[str, str]:
     """
     Return model weights relative to the project directory
     """
-    return {}
+    return {'model': 'model.onnx'}
+
+
+def _providers(device: str) -> List[Any]:
+    import onnxruntime as ort
+
+    available = ort.get_available_providers()
+    providers = []
+    if device.startswith('cuda') and 'CUDAExecutionProvider' in available:
+        device_id = int(device.split(':')[1]) if ':' in device else 0
+        providers.append(('CUDAExecutionProvider', {'device_id': device_id}))
+    providers.append('CPUExecutionProvider')
+    return providers
+
+
+def _optimized_path(model_path: str, device: str) -> str:
+    """
+    Cache file next to the weights. The name changes with the source model,
+    the optimization level and the device, so a stale cache is never picked up.
+    """
+    import hashlib
+    import onnxruntime as ort
+
+    st = os.stat(model_path)
+    key = '{0}:{1}:{2}:{3}:{4}'.format(st.st_size, st.st_mtime_ns, __OPTIMIZATION_LEVEL__, device, ort.__version__)
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(os.path.dirname(model_path),
+                        '.{0}.{1}.optimized.onnx'.format(stem, hashlib.sha256(key.encode()).hexdigest()[:16]))
+
+
+def _session_options(optimization_level: str, optimized_model_path: str = None) -> Any:
+    import onnxruntime as ort
 
+    options = ort.SessionOptions()
+    options.graph_optimization_level = {
+        'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }[optimization_level]
+    options.execution_mode = (ort.ExecutionMode.ORT_PARALLEL if __EXECUTION_MODE__ == 'parallel'
+                              else ort.ExecutionMode.ORT_SEQUENTIAL)
 
-def predict(input_directory: str, output_directory: str, weight_paths: Dict[str, str], device: str) -> bool:
+    # Set by `pyx run/test/serve --profile`, 0 lets onnxruntime decide
+    options.intra_op_num_threads = int(os.environ.get('PYX_INTRA_OP_THREADS', 0))
+    options.inter_op_num_threads = int(os.environ.get('PYX_INTER_OP_THREADS', 0))
+
+    if optimized_model_path is not None:
+        options.optimized_model_filepath = optimized_model_path
+    return options
+
+
+class Model(object):
+    """
+    An onnxruntime session with outputs bound once. Outputs with a static
+    shape are preallocated and reused by every run; run() returns them as
+    numpy arrays that are overwritten by the next call.
+    """
+    def __init__(self, session: Any, device: str):
+        import onnxruntime as ort
+
+        self.session = session
+        self.device_type = 'cuda' if session.get_providers()[0] == 'CUDAExecutionProvider' else 'cpu'
+        self.device_id = int(device.split(':')[1]) if self.device_type == 'cuda' and ':' in device else 0
+        self.binding = session.io_binding()
+
+        self.outputs = {}
+        for output in session.get_outputs():
+            shape = output.shape
+            if all(isinstance(d, int) for d in shape) and output.type in __ORT_TYPES__:
+                value = ort.OrtValue.ortvalue_from_shape_and_type(
+                    shape, __ORT_TYPES__[output.type], self.device_type, self.device_id)
+                self.binding.bind_ortvalue_output(output.name, value)
+                self.outputs[output.name] = value
+            else:
+                # Dynamic shape: allocated by onnxruntime on every run
+                self.binding.bind_output(output.name, self.device_type, self.device_id)
+
+    @property
+    def input_names(self) -> List[str]:
+        return [i.name for i in self.session.get_inputs()]
+
+    def run(self, feeds: Dict[str, np.ndarray]) -> List[np.ndarray]:
+        for name, array in feeds.items():
+            self.binding.bind_cpu_input(name, np.ascontiguousarray(array))
+        self.session.run_with_iobinding(self.binding)
+
+        if self.device_type == 'cpu':
+            return [value.numpy() for value in self.binding.get_outputs()]
+        return self.binding.copy_outputs_to_cpu()
+
+
+def load(weight_paths: Dict[str, str], device: str) -> Any:
+    """
+    Build the session once. The first load saves the optimized graph next to the
+    weights; later loads read it with graph optimization turned off.
+    """
+    import onnxruntime as ort
+
+    model_path = weight_paths['model']
+    optimized_path = _optimized_path(model_path, device)
+
+    if os.path.exists(optimized_path):
+        try:
+            session = ort.InferenceSession(optimized_path, _session_options('disable'),
+                                           providers=_providers(device))
+            return Model(session, device)
+        except Exception:
+            # Interrupted write or an incompatible file, optimize again
+            os.remove(optimized_path)
+
+    try:
+        session = ort.InferenceSession(model_path, _session_options(__OPTIMIZATION_LEVEL__, optimized_path),
+                                       providers=_providers(device))
+    except Exception:
+        # Read-only project directory: optimize in memory only
+        session = ort.InferenceSession(model_path, _session_options(__OPTIMIZATION_LEVEL__),
+                                       providers=_providers(device))
+    return Model(session, device)
+
+
+def predict(input_directory: str, output_directory: str, model: Any, device: str) -> bool:
     """
     Perform inference.
-    Further information: Further information: https://github.com/P-Y-X/pyx#publish-your-own-model
+    Further information: https://github.com/P-Y-X/pyx#publish-your-own-model
 
+    This template feeds every .npy file of input_directory to the first model
+    input and saves the outputs as <name>_<output index>.npy. Replace it with
+    the pre- and post-processing your model needs.
     """
+    if isinstance(model, dict):
+        # Runners that don't call load() pass the weight paths instead
+        model = load(model, device)
+
+    input_name = model.input_names[0]
+    for filename in sorted(os.listdir(input_directory)):
+        if not filename.endswith('.npy'):
+            continue
+
+        outputs = model.run({input_name: np.load(os.path.join(input_directory, filename))})
+        stem = os.path.splitext(filename)[0]
+        for i, output in enumerate(outputs):
+            np.save(os.path.join(output_directory, '{0}_{1}.npy'.format(stem, i)), output)
     return True
@@ -1,17 +1,177 @@
-from typing import Dict
+import os
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+
+# Samples per forward pass
+__BATCH_SIZE__ = 16
+# Processes reading and preprocessing input files ahead of the model
+__LOADER_WORKERS__ = min(4, os.cpu_count() or 1)
+# Shape of one sample, used to trace models that can't be scripted
+__SAMPLE_SHAPE__ = (4,)
 
 
 def get_weight_paths() -> Dict[str, str]:
     """
     Return model weights relative to the project directory
     """
-    return {}
+    return {'weights': 'weights.pth'}
+
+
+def build_model() -> Any:
+    """
+    Construct the model architecture. Replace with your own torch.nn.Module.
+    Only called when no TorchScript cache matches the weights.
+    """
+    import torch
+
+    return torch.nn.Sequential(torch.nn.Linear(4, 3), torch.nn.ReLU())
+
+
+def _weights_sha256(path: str) -> str:
+    """
+    Hash of the weights file, remembered in a small file next to it while size and mtime stay the same
+    """
+    import json
+    import hashlib
+
+    st = os.stat(path)
+    memo_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.sha256')
+    try:
+        with open(memo_path, 'r') as f:
+            memo = json.load(f)
+        if memo['size'] == st.st_size and memo['mtime'] == st.st_mtime_ns:
+            return memo['sha256']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    try:
+        with open(memo_path, 'w') as f:
+            json.dump({'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha256': digest.hexdigest()}, f)
+    except OSError:
+        pass
+    return digest.hexdigest()
+
+
+def _source_sha256() -> str:
+    """
+    Hash of this file, so editing build_model or the model code invalidates the TorchScript cache
+    """
+    import hashlib
+
+    with open(__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _compile(model: Any) -> Any:
+    import torch
+
+    try:
+        return torch.jit.script(model)
+    except Exception:
+        # Data dependent Python control flow can't be scripted, record one pass instead
+        return torch.jit.trace(model, torch.zeros((1,) + __SAMPLE_SHAPE__))
+
+
+def _jit_load(path: str, device: str) -> Any:
+    import torch
+    import warnings
+
+    with warnings.catch_warnings():
+        # Newer releases flag TorchScript as deprecated, it still loads fastest without model code
+        warnings.simplefilter('ignore', FutureWarning)
+        return torch.jit.load(path, map_location=device).eval()
+
+
+def load(weight_paths: Dict[str, str], device: str) -> Any:
+    """
+    Build the model once. The first load saves a TorchScript version next to
+    the weights, named after their hash and the hash of this file, so later
+    loads skip model construction.
+    """
+    import torch
+    import warnings
+
+    weights = weight_paths['weights']
+    key = '{0}-{1}-{2}'.format(_weights_sha256(weights)[:16], _source_sha256()[:8], torch.__version__.split('+')[0])
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    cache_path = os.path.join(os.path.dirname(weights), '.{0}.{1}.torchscript.pt'.format(stem, key))
+
+    if os.path.exists(cache_path):
+        try:
+            return _jit_load(cache_path, device)
+        except Exception:
+            # Interrupted write or an incompatible file, build it again
+            os.remove(cache_path)
+
+    model = build_model()
+    model.load_state_dict(torch.load(weights, map_location='cpu', weights_only=True))
+    model.eval()
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            compiled = _compile(model)
+        tmp_path = cache_path + '.tmp'
+        compiled.save(tmp_path)
+        os.replace(tmp_path, cache_path)
+        return _jit_load(cache_path, device)
+    except Exception as e:
+        print('TorchScript cache not available, running the eager model: {0}'.format(e))
+        return model.to(device)
+
+
+class Samples(object):
+    """
+    Input files as tensors. Runs in DataLoader worker processes, so file
+    reading and preprocessing overlap with the model.
+    """
+    def __init__(self, input_directory: str):
+        self.input_directory = input_directory
+        self.files = sorted(f for f in os.listdir(input_directory) if f.endswith('.npy'))
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __getitem__(self, i: int) -> Tuple[str, Any]:
+        import torch
+
+        return self.files[i], torch.from_numpy(np.load(os.path.join(self.input_directory, self.files[i])))
+
 
+def _loader(samples: Samples, device: str) -> Any:
+    from torch.utils.data import DataLoader
 
-def predict(input_directory: str, output_directory: str, weight_paths: Dict[str, str], device: str) -> bool:
+    # Starting worker processes costs more than it saves on a handful of files
+    workers = __LOADER_WORKERS__ if len(samples) > 2 * __BATCH_SIZE__ else 0
+    return DataLoader(samples, batch_size=__BATCH_SIZE__, num_workers=workers,
+                      prefetch_factor=2 if workers else None, pin_memory=device.startswith('cuda'))
+
+
+def predict(input_directory: str, output_directory: str, model: Any, device: str) -> bool:
     """
     Perform inference.
     Further information: https://github.com/P-Y-X/pyx#publish-your-own-model
+
+    This template runs every .npy file of input_directory through the model in
+    batches and saves the results as .npy files with the same names. Replace
+    Samples and the saving below with the processing your model needs.
     """
-    return True
+    import torch
+
+    if isinstance(model, dict):
+        # Runners that don't call load() pass the weight paths instead
+        model = load(model, device)
 
+    with torch.inference_mode():
+        for names, batch in _loader(Samples(input_directory), device):
+            outputs = model(batch.to(device, non_blocking=True)).cpu().numpy()
+            for name, output in zip(names, outputs):
+                np.save(os.path.join(output_directory, name), output)
+    return True
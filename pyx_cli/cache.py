@@ -0,0 +1,322 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+import os
+import re
+import json
+import time
+import shutil
+import contextlib
+
+
+__CACHE_DIR__ = os.path.join(os.path.expanduser('~'), '.pyx', 'cache')
+
+
+@contextlib.contextmanager
+def _locked(cache_dir):
+    """
+    Serialize index updates between pyx processes sharing the cache
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, '.lock'), 'w') as lock_file:
+        try:
+            import fcntl
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except ImportError:
+            pass
+        yield
+
+
+def _load_index(cache_dir):
+    path = os.path.join(cache_dir, 'index.json')
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, 'r') as f:
+        try:
+            return json.load(f)
+        except ValueError:
+            return {}
+
+
+def _save_index(cache_dir, index):
+    path = os.path.join(cache_dir, 'index.json')
+    with open(path + '.tmp', 'w') as f:
+        f.write(json.dumps(index, indent=4))
+        f.close()
+    os.replace(path + '.tmp', path)
+
+
+def _dir_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            size += os.lstat(os.path.join(root, f)).st_size
+    return size
+
+
+def _reflink(src, dst):
+    """
+    Copy-on-write clone (btrfs, xfs, ...). Raises OSError when unsupported.
+    """
+    import fcntl
+
+    __FICLONE__ = 0x40049409
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), __FICLONE__, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _clone_file(src, dst):
+    """
+    Copy src to dst, as a reflink where the filesystem supports it. Never a
+    hardlink: writing to dst in place must not change the cache entry.
+    """
+    try:
+        return _reflink(src, dst)
+    except (OSError, ImportError):
+        pass
+
+    shutil.copy2(src, dst)
+
+
+class ArtifactCache(object):
+    """
+    Downloaded projects shared by all pyx invocations on the host.
+
+    Entries are keyed by model id and version and tagged with the server ETag,
+    so they can be revalidated with a conditional request. The least recently
+    used entries are evicted to keep the cache under max_size bytes.
+    """
+    def __init__(self, cache_dir=None, max_size=None):
+        self.cache_dir = cache_dir or __CACHE_DIR__
+        self.max_size = max_size
+
+    @staticmethod
+    def key(model_id, version):
+        return '{0}:{1}'.format(model_id, version)
+
+    def lookup(self, key):
+        with _locked(self.cache_dir):
+            entry = _load_index(self.cache_dir).get(key)
+
+        if entry is None or not os.path.isdir(os.path.join(self.cache_dir, entry['path'])):
+            return None
+        return entry
+
+    def staging_dir(self):
+        """
+        Temporary directory inside the cache, so a finished entry can be renamed into place
+        """
+        import tempfile
+
+        os.makedirs(os.path.join(self.cache_dir, 'projects'), exist_ok=True)
+        return tempfile.mkdtemp(prefix='.staging-', dir=os.path.join(self.cache_dir, 'projects'))
+
+    def store(self, key, staging_dir, etag):
+        name = re.sub(r'[^\w.-]', '_', key) + '-' + re.sub(r'[^\w]', '', etag or '')[:16]
+
+        with _locked(self.cache_dir):
+            index = _load_index(self.cache_dir)
+            path = os.path.join('projects', name)
+
+            old = index.get(key)
+            if old is not None:
+                shutil.rmtree(os.path.join(self.cache_dir, old['path']), ignore_errors=True)
+            shutil.rmtree(os.path.join(self.cache_dir, path), ignore_errors=True)
+            os.rename(staging_dir, os.path.join(self.cache_dir, path))
+
+            index[key] = {
+                'path': path,
+                'etag': etag,
+                'size': _dir_size(os.path.join(self.cache_dir, path)),
+                'last_used': time.time(),
+            }
+            _save_index(self.cache_dir, index)
+
+        self.prune(keep=key)
+        return index[key]
+
+    def materialize(self, key, destination):
+        """
+        Recreate the cached project in destination using reflinks where possible
+        """
+        with _locked(self.cache_dir):
+            index = _load_index(self.cache_dir)
+            entry = index[key]
+            entry['last_used'] = time.time()
+            _save_index(self.cache_dir, index)
+
+        source = os.path.join(self.cache_dir, entry['path'])
+        for root, dirs, files in os.walk(source):
+            target_root = os.path.join(destination, os.path.relpath(root, source))
+            os.makedirs(target_root, exist_ok=True)
+            # os.walk lists symlinks to directories with dirs and does not follow them
+            links = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+            for f in files + links:
+                src, dst = os.path.join(root, f), os.path.join(target_root, f)
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                if os.path.islink(src):
+                    os.symlink(os.readlink(src), dst)
+                else:
+                    _clone_file(src, dst)
+
+    def entries(self):
+        with _locked(self.cache_dir):
+            return _load_index(self.cache_dir)
+
+    def prune(self, max_size=None, keep=None):
+        """
+        Evict least recently used entries until the cache fits into max_size bytes.
+        Returns the evicted keys.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        if max_size is None:
+            return []
+
+        evicted = []
+        with _locked(self.cache_dir):
+            index = _load_index(self.cache_dir)
+            total = sum(e['size'] for e in index.values())
+
+            for key in sorted(index, key=lambda k: index[k]['last_used']):
+                if total <= max_size:
+                    break
+                if key == keep:
+                    continue
+
+                shutil.rmtree(os.path.join(self.cache_dir, index[key]['path']), ignore_errors=True)
+                total -= index[key]['size']
+                del index[key]
+                evicted.append(key)
+
+            _save_index(self.cache_dir, index)
+
+        return evicted
+
+
+__RESULTS_DIR__ = os.path.join(os.path.expanduser('~'), '.pyx', 'results')
+
+
+class ResultCache(object):
+    """
+    Outputs of predict for single input files, shared by all projects on the host.
+
+    Entries are keyed by the content hash of the input together with the model
+    fingerprint (pyx_endpoints.py, weights, device), so editing any of them
+    misses the cache. Lookups are counted and recency updates are written in
+    one go by flush(). The least recently used entries are evicted to keep
+    the cache under max_size bytes.
+    """
+    def __init__(self, cache_dir=None, max_size=None):
+        from pyx_cli.manifest import FileHashes
+
+        self.cache_dir = cache_dir or __RESULTS_DIR__
+        self.max_size = max_size
+        self.stats = {'hits': 0, 'misses': 0, 'stored': 0}
+        self._flushed = dict(self.stats)
+        self._used = {}
+        self._stored = set()
+
+        with _locked(self.cache_dir):
+            self.index = _load_index(self.cache_dir)
+        self.hashes = FileHashes(self.index.pop('.hashes', {}))
+        self.totals = self.index.pop('.stats', {'hits': 0, 'misses': 0})
+
+    @staticmethod
+    def key(input_sha256, fingerprint):
+        import hashlib
+        return hashlib.sha256((fingerprint + ':' + input_sha256).encode()).hexdigest()
+
+    def lookup(self, key):
+        entry = self.index.get(key)
+        if entry is not None and not os.path.isdir(os.path.join(self.cache_dir, entry['path'])):
+            entry = None
+
+        self.stats['hits' if entry is not None else 'misses'] += 1
+        if entry is not None:
+            self._used[key] = time.time()
+        return entry
+
+    def restore(self, key, destination):
+        source = os.path.join(self.cache_dir, self.index[key]['path'])
+        for f in self.index[key]['files']:
+            dst = os.path.join(destination, f)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if os.path.lexists(dst):
+                os.remove(dst)
+            _clone_file(os.path.join(source, f), dst)
+
+    def store(self, key, source, files):
+        """
+        Copy files (relative to source) into the cache as the result for key
+        """
+        import tempfile
+
+        os.makedirs(os.path.join(self.cache_dir, 'entries'), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=os.path.join(self.cache_dir, 'entries'))
+        for f in files:
+            os.makedirs(os.path.dirname(os.path.join(staging, f)), exist_ok=True)
+            shutil.copy2(os.path.join(source, f), os.path.join(staging, f))
+
+        path = os.path.join('entries', key[:2], key)
+        os.makedirs(os.path.join(self.cache_dir, 'entries', key[:2]), exist_ok=True)
+        shutil.rmtree(os.path.join(self.cache_dir, path), ignore_errors=True)
+        os.rename(staging, os.path.join(self.cache_dir, path))
+
+        self.index[key] = {'path': path, 'files': sorted(files), 'size': _dir_size(os.path.join(self.cache_dir, path))}
+        self._used[key] = time.time()
+        self._stored.add(key)
+        self.stats['stored'] += 1
+
+    def flush(self):
+        """
+        Merge this process' entries, recency updates and counters into the shared
+        index, then evict down to max_size
+        """
+        with _locked(self.cache_dir):
+            index = _load_index(self.cache_dir)
+            hashes = {**index.pop('.hashes', {}), **self.hashes.known}
+            totals = index.pop('.stats', {'hits': 0, 'misses': 0})
+            totals = {k: totals.get(k, 0) + self.stats[k] - self._flushed[k] for k in ['hits', 'misses']}
+
+            for key, last_used in self._used.items():
+                # Entries evicted by another process meanwhile stay evicted
+                if key in index or key in self._stored:
+                    index[key] = {**self.index[key], 'last_used': last_used}
+
+            if self.max_size is not None:
+                total = sum(e['size'] for e in index.values())
+                for key in sorted(index, key=lambda k: index[k].get('last_used', 0)):
+                    if total <= self.max_size:
+                        break
+                    shutil.rmtree(os.path.join(self.cache_dir, index[key]['path']), ignore_errors=True)
+                    total -= index[key]['size']
+                    del index[key]
+
+            # Forget hashes of input files that are gone, once they clearly outnumber the entries
+            if len(hashes) > 2 * len(index) + 1000:
+                hashes = {path: h for path, h in hashes.items() if os.path.exists(path)}
+
+            self.index = index
+            self.totals = totals
+            self._used = {}
+            self._stored = set()
+            self._flushed = dict(self.stats)
+            _save_index(self.cache_dir, {**index, '.hashes': hashes, '.stats': totals})
+
+    def clear(self):
+        with _locked(self.cache_dir):
+            shutil.rmtree(os.path.join(self.cache_dir, 'entries'), ignore_errors=True)
+            index = _load_index(self.cache_dir)
+            _save_index(self.cache_dir, {'.hashes': index.get('.hashes', {}), '.stats': index.get('.stats', {})})
+        self.index = {}
+
+    def size(self):
+        return sum(e['size'] for e in self.index.values())
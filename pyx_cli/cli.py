@@ -5,37 +5,13 @@ import argparse
 import os
 import sys
 import json
-import inquirer
 
 from pyx_cli.misc import __PYX_PROJECT_TEMPLATE__, __PYX_CONFIG__
 from pyx_cli.misc import _save_config, _get_category_choices, _get_template_path
 from pyx_cli.misc import ensure_pyx_project, ensure_have_permissions, with_pyx_config
-
-
-class UploadInChunks(object):
-    """
-    Upload in chunks for showing progress / use stream.
-    """
-    def __init__(self, filename, chunksize=1 << 13):
-        self.filename = filename
-        self.chunksize = chunksize
-        self.totalsize = os.path.getsize(filename)
-        self.readsofar = 0
-
-    def __iter__(self):
-        with open(self.filename, 'rb') as file:
-            while True:
-                data = file.read(self.chunksize)
-                if not data:
-                    sys.stderr.write("\n")
-                    break
-                self.readsofar += len(data)
-                percent = self.readsofar * 1e2 / self.totalsize
-                sys.stderr.write("\r{percent:3.0f}%".format(percent=percent))
-                yield data
-
-    def __len__(self):
-        return self.totalsize
+from pyx_cli.device import __CPU_PROFILES__
+from pyx_cli.compression import __CODECS__
+from pyx_cli import telemetry
 
 
 def _add_framework(category_id, framework, **kwargs):
@@ -79,15 +55,9 @@ def auth(args, pyx_config, **kwargs):
     """
     pyx_config['user_token'] = args.user_token
 
-    import requests
-    from urllib.parse import urljoin
-    headers = {'user-token': pyx_config["user_token"]}
+    from pyx_cli.client import get_client
 
-    r = requests.get(
-        urljoin(__PYX_CONFIG__["api_url"], 'auth/check'),
-        params={},
-        headers=headers
-    )
+    r = get_client(pyx_config).get('auth/check', params={})
 
     if r.status_code == 200:
         print('Authorized.')
@@ -101,6 +71,7 @@ def create(args, **kwargs):
     Create new project
     """
     import os
+    import inquirer
 
     project_name = os.path.basename(os.getcwd())
 
@@ -171,6 +142,7 @@ def configure(args, pyx_project, **kwargs):
     """
     Configure project
     """
+    import inquirer
 
     questions = [
         inquirer.Text('name',
@@ -199,6 +171,7 @@ def attach(args, **kwargs):
     """
     Add another framework to a project
     """
+    import inquirer
     questions = [
         inquirer.List('category',
                       message="What is the category of your project?",
@@ -234,86 +207,373 @@ def attach(args, **kwargs):
 
 
 @ensure_pyx_project
-def test(*args, pyx_project, **kwargs):
+def test(args, pyx_project, **kwargs):
     """
     Test model / models inside the project
     """
-    import os
-    import time
-    import numpy as np
+    import traceback
+    from pyx_cli.endpoints import ModelEndpoints
+    from pyx_cli.bench import Benchmark, print_report, save_report, compare_reports
 
     print('Testing project ...')
 
     pyx_project['meta'] = {}
+    execution = _apply_execution(args)
+    benchmark = Benchmark('./pyx-testing-data', execution['device'],
+                          warmup=getattr(args, 'warmup', None), iterations=getattr(args, 'iterations', None))
 
+    endpoints = ModelEndpoints('.', threads=_library_threads(execution))
     try:
-        import sys
-        import tempfile
-        sys.path.append('.')
-        from pyx_endpoints import get_weight_paths, predict
-
         print('Testing model ...')
         print('Initializing model ...')
-        weight_paths = {i: k for i, k in get_weight_paths().items()}
-        print('weight_paths: ', weight_paths)
-
-        time_measures = []
-        for i in range(10):
-            with tempfile.TemporaryDirectory() as tmpdirname:
-                start = time.time()
-                predict('./pyx-testing-data', tmpdirname, weight_paths, 'cuda')
-                end = time.time()
-                time_measures.append(end - start)
-                print('Inference time: ', end - start)
-
-        print('Mean inference time:', np.mean(time_measures))
+        with telemetry.span('load', device=benchmark.device):
+            benchmark.load(lambda: endpoints.load(benchmark.device))
+        print('weight_paths: ', endpoints.weight_paths)
+
+        on_output = None
+        if getattr(args, 'cache_results', False):
+            on_output = _seed_result_cache(endpoints, benchmark.input_dir)
+
+        with telemetry.span('predict', device=benchmark.device) as attributes:
+            benchmark.run(endpoints.predict, on_sample=lambda elapsed: print('Inference time: ', elapsed / 1e9),
+                          on_output=on_output)
+            report = {**benchmark.report(), 'execution': execution}
+            attributes.update({'calls': report['warmup'] + report['iterations'],
+                               'latency_ms': report['latency_ms']})
+        print_report(report)
 
         pyx_project['meta'] = {
-            'weight_paths': get_weight_paths(),
-            'mean_inference_time': np.mean(time_measures),
+            'weight_paths': endpoints.weight_paths,
+            'mean_inference_time': report['latency_ms']['mean'] / 1e3,
+            'load_time': report['load_ms'] / 1e3,
+            'benchmark': {k: report[k] for k in ['warmup', 'iterations', 'latency_ms', 'peak_rss_mb',
+                                                 'tracemalloc_peak_mb', 'memory_after_load_mb']},
+            'execution': execution,
         }
 
+        if getattr(args, 'report', None):
+            save_report(report, args.report)
+            print('Benchmark report saved to ' + args.report)
+
+        passed = True
+        if getattr(args, 'baseline', None):
+            passed = compare_reports(report, args.baseline, args.regression_threshold)
+
         print('....')
-        print('PASSED')
+        print('PASSED' if passed else 'FAILED: slower than the baseline')
+    except Exception:
+        traceback.print_exc()
+        print('....')
+        print('An error occurred.')
+        return False
+    finally:
+        endpoints.unload()
+
+    return passed
+
+
+def _apply_execution(args):
+    """
+    Pick the device and apply the CPU profile from the command line, before pyx_endpoints.py is imported
+    """
+    from pyx_cli.device import apply_profile
+
+    execution = apply_profile(getattr(args, 'device', None), getattr(args, 'profile', None))
+    if execution['profile'] is None:
+        print('Device: {0}'.format(execution['device']))
+    else:
+        print('Device: {0}, profile {1}: {2} intra-op / {3} inter-op threads on {4} cores'.format(
+            execution['device'], execution['profile'], execution['intra_op_threads'],
+            execution['inter_op_threads'], execution['cores']))
+    return execution
+
+
+def _library_threads(execution):
+    """
+    ModelEndpoints threads of the execution settings, applied before the model is built
+    """
+    if execution.get('intra_op_threads'):
+        return execution['intra_op_threads'], execution['inter_op_threads']
+    return None
+
+
+def _open_result_cache():
+    from pyx_cli.misc import _load_config
+    from pyx_cli.cache import ResultCache
+
+    return ResultCache(max_size=_load_config()['result_cache_max_size'])
+
+
+def _print_result_cache_stats(result_cache):
+    print('Result cache: {0} hits, {1} misses, {2} stored ({3:.1f} MB cached)'.format(
+        result_cache.stats['hits'], result_cache.stats['misses'], result_cache.stats['stored'],
+        result_cache.size() / 1024 / 1024))
+
+
+def _seed_result_cache(endpoints, input_dir):
+    """
+    pyx test keeps calling predict so timings stay real; its outputs are stored
+    in the result cache for later pyx run calls on the same samples
+    """
+    import os
+    from pyx_cli.runner import list_inputs
+    from pyx_cli.incremental import store_results
+
+    result_cache = _open_result_cache()
+    fingerprint = endpoints.fingerprint(result_cache.hashes)
+    keys = {f: result_cache.key(result_cache.hashes.sha256(os.path.join(input_dir, f)), fingerprint)
+            for f in list_inputs(input_dir)}
+    cached = [f for f, key in keys.items() if result_cache.lookup(key) is not None]
+    print('Result cache: {0} of {1} testing inputs already cached'.format(len(cached), len(keys)))
+
+    def on_output(output_dir):
+        if not store_results(result_cache, {f: k for f, k in keys.items() if f not in cached},
+                             output_dir, list(keys)):
+            print('Some outputs belong to several inputs, results are not cached')
+        result_cache.flush()
+
+    return on_output
+
+
+def _subset_predict(args, endpoints, execution):
+    """
+    Load the model and return predict(input_dir, files, output_dir) running it
+    over some of the input files, in this process or on args.workers processes
+    """
+    from pyx_cli.incremental import predict_in_process
+    from pyx_cli.runner import run_sharded
+    from pyx_cli.device import limit_threads
+
+    if args.workers > 1:
+        # Workers build their own models, here only the weight paths are needed
+        endpoints.load(execution['device'], handle=False)
+
+        def predict(input_dir, files, output_dir):
+            run_sharded('.', input_dir, output_dir, execution['device'], args.workers,
+                        threads=args.threads_per_worker, files=files)
+        return predict
+
+    if args.threads_per_worker:
+        limit_threads(args.threads_per_worker)
+        execution = {**execution, 'intra_op_threads': args.threads_per_worker, 'inter_op_threads': None}
+    endpoints.threads = _library_threads(execution)
+    print('Initializing model ...')
+    with telemetry.span('load', device=execution['device']):
+        endpoints.load(execution['device'])
+    return predict_in_process(endpoints)
+
+
+def _run_cached(args, execution):
+    import time
+    import traceback
+    from pyx_cli.endpoints import ModelEndpoints
+    from pyx_cli.incremental import with_result_cache
+    from pyx_cli.runner import list_inputs
+
+    endpoints = ModelEndpoints('.')
+    result_cache = _open_result_cache()
+    try:
+        predict = with_result_cache(_subset_predict(args, endpoints, execution), result_cache,
+                                    endpoints.fingerprint(result_cache.hashes))
+
+        start = time.time()
+        files = list_inputs(args.input_dir)
+        with telemetry.span('predict', inputs=len(files)) as attributes:
+            predict(args.input_dir, files, args.output_dir)
+            attributes.update(result_cache.stats)
+        print('Inference time: ', time.time() - start)
+        _print_result_cache_stats(result_cache)
+    except Exception:
+        traceback.print_exc()
+        print('....')
+        print('An error occurred.')
+        return False
+    finally:
+        endpoints.unload()
+
+    print('....')
+    print('PASSED')
 
-        del get_weight_paths, predict
-        del sys.modules["pyx_endpoints"]
 
-        from gc import collect
-        collect()
+def _profiled_predict(endpoints, input_dir, output_dirs):
+    # Root frame of the profiled stacks
+    for output_dir in output_dirs:
+        if endpoints.predict(input_dir, output_dir) is False:
+            raise AssertionError('predict returned False')
 
-        sys.path.pop()
-    except Exception as e:
-        print(e.with_traceback())
+
+@ensure_pyx_project
+def profile(args, pyx_project, **kwargs):
+    """
+    Profile predict on the testing data and write flamegraph stacks
+    """
+    import time
+    import tempfile
+    import traceback
+    from pyx_cli.endpoints import ModelEndpoints
+    from pyx_cli.profiling import SamplingProfiler, DeterministicProfiler, reset_stages, stage_stats
+    from pyx_cli.profiling import write_collapsed, print_hotspots, print_stages
+
+    input_dir = args.input_dir or './pyx-testing-data'
+    execution = _apply_execution(args)
+    endpoints = ModelEndpoints('.', threads=_library_threads(execution))
+    try:
+        print('Initializing model ...')
+        endpoints.load(execution['device'])
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            output_dirs = [os.path.join(tmpdirname, str(i)) for i in range(args.warmup + args.iterations)]
+            for output_dir in output_dirs:
+                os.makedirs(output_dir)
+
+            _profiled_predict(endpoints, input_dir, output_dirs[:args.warmup])
+            reset_stages()
+
+            print('Profiling {0} predict calls ({1}) ...'.format(args.iterations, args.profiler))
+            if args.profiler == 'cprofile':
+                profiler = DeterministicProfiler()
+            else:
+                profiler = SamplingProfiler(args.interval, root=_profiled_predict.__code__)
+
+            start = time.perf_counter()
+            with profiler:
+                _profiled_predict(endpoints, input_dir, output_dirs[args.warmup:])
+            total_ms = (time.perf_counter() - start) * 1e3
+    except Exception:
+        traceback.print_exc()
+        print('....')
+        print('An error occurred.')
+        return False
+    finally:
+        endpoints.unload()
+
+    print('Total: {0:.1f} ms, {1:.1f} ms per call'.format(total_ms, total_ms / args.iterations))
+    print_hotspots(profiler.hotspots(), args.top, total_ms)
+    print_stages(stage_stats(), total_ms)
+
+    collapsed_path = args.output + '.collapsed'
+    write_collapsed(profiler.collapsed(), collapsed_path)
+    print('Flamegraph stacks written to {0} (flamegraph.pl or https://www.speedscope.app)'.format(collapsed_path))
+    if args.profiler == 'cprofile':
+        profiler.profile.dump_stats(args.output + '.prof')
+        print('cProfile data written to {0}.prof'.format(args.output))
+
+
+def _run_sharded(args, execution):
+    import time
+    import traceback
+    from pyx_cli.runner import run_sharded, print_worker_stats
+
+    print('Running on {0} workers ...'.format(args.workers))
+    start = time.time()
+    try:
+        with telemetry.span('predict', workers=args.workers):
+            stats = run_sharded('.', args.input_dir, args.output_dir, execution['device'], args.workers,
+                                threads=args.threads_per_worker)
+    except Exception:
+        traceback.print_exc()
         print('....')
         print('An error occurred.')
         return False
 
-    return True
+    print_worker_stats(stats, time.time() - start)
+    print('....')
+    print('PASSED')
+
+
+def _run_incremental(args, execution):
+    import time
+    import traceback
+    from pyx_cli.endpoints import ModelEndpoints
+    from pyx_cli.incremental import IncrementalRun, with_result_cache
+
+    endpoints = ModelEndpoints('.')
+    incremental = IncrementalRun('.', args.input_dir, args.output_dir)
+    result_cache = _open_result_cache() if args.cache_results else None
+    try:
+        predict = _subset_predict(args, endpoints, execution)
+
+        if args.watch:
+            print('Watching {0} for changes, press Ctrl+C to stop ...'.format(args.input_dir))
+
+        while True:
+            if args.watch and endpoints.changed():
+                print('pyx_endpoints.py changed, reloading ...')
+                # Sharded workers build their own models, as in _subset_predict
+                endpoints.reload(handle=args.workers <= 1)
+
+            start = time.time()
+            update_predict = predict
+            if result_cache is not None:
+                update_predict = with_result_cache(predict, result_cache, endpoints.fingerprint(result_cache.hashes))
+            # In watch mode, files still being written are left for the next pass
+            with telemetry.span('update') as attributes:
+                changed, deleted = incremental.update(update_predict, endpoints,
+                                                      min_age=1.0 if args.watch else 0.0)
+                attributes.update({'changed': len(changed), 'deleted': len(deleted)})
+            if changed or deleted:
+                print('Processed {0} new or changed inputs, pruned {1} deleted in {2:.2f} s'.format(
+                    len(changed), len(deleted), time.time() - start))
+                if result_cache is not None:
+                    _print_result_cache_stats(result_cache)
+            elif not args.watch:
+                print('Outputs are up to date')
+
+            if not args.watch:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        traceback.print_exc()
+        print('....')
+        print('An error occurred.')
+        return False
+    finally:
+        endpoints.unload()
+
+    print('....')
+    print('PASSED')
 
 
 @ensure_pyx_project
 def run_locally(args, pyx_project, extra_fields, **kwargs):
     import os
     import time
-    import sys
+    import traceback
+    from pyx_cli.endpoints import ModelEndpoints
 
     input_dir = args.input_dir
     output_dir = args.output_dir
 
     os.makedirs(output_dir, exist_ok=True)
 
-    try:
-        sys.path.append('.')
-        from pyx_endpoints import get_weight_paths, predict
+    execution = _apply_execution(args)
+    if args.incremental or args.watch:
+        return _run_incremental(args, execution)
+    if args.cache_results:
+        return _run_cached(args, execution)
+    if args.workers > 1:
+        return _run_sharded(args, execution)
 
+    if args.threads_per_worker:
+        from pyx_cli.device import limit_threads
+        limit_threads(args.threads_per_worker)
+        execution = {**execution, 'intra_op_threads': args.threads_per_worker, 'inter_op_threads': None}
+
+    endpoints = ModelEndpoints('.', threads=_library_threads(execution))
+    try:
         print('Testing model ...')
         print('Initializing model ...')
-        weight_paths = {i: k for i, k in get_weight_paths().items()}
-        print(weight_paths)
+        start = time.time()
+        with telemetry.span('load', device=execution['device']):
+            endpoints.load(execution['device'])
+        print(endpoints.weight_paths)
+        print('Load time: ', time.time() - start)
 
         start = time.time()
-        completed = predict(input_dir, output_dir, weight_paths, 'cuda')
+        with telemetry.span('predict', device=execution['device']):
+            completed = endpoints.predict(input_dir, output_dir)
         if not completed:
             raise AssertionError
 
@@ -322,19 +582,27 @@ def run_locally(args, pyx_project, extra_fields, **kwargs):
 
         print('....')
         print('PASSED')
-
-        del get_weight_paths, predict
-        del sys.modules["pyx_endpoints"]
-
-        from gc import collect
-        collect()
-
-        sys.path.pop()
-    except Exception as e:
-        print(e.with_traceback())
+    except Exception:
+        traceback.print_exc()
         print('....')
         print('An error occurred.')
         return False
+    finally:
+        endpoints.unload()
+
+
+@ensure_pyx_project
+def serve(args, pyx_project, **kwargs):
+    """
+    Keep the model loaded and answer predict requests locally
+    """
+    from pyx_cli.endpoints import ModelEndpoints
+    from pyx_cli.serve import serve as serve_endpoints
+
+    execution = _apply_execution(args)
+    endpoints = ModelEndpoints('.', threads=_library_threads(execution))
+    serve_endpoints(endpoints, execution['device'], host=args.host, port=args.port, socket_path=args.socket,
+                    queue_size=args.queue_size, watch=not args.no_reload)
 
 
 @with_pyx_config
@@ -343,8 +611,9 @@ def publish(args, pyx_project, pyx_config, **kwargs):
     """
     Publish new or update existing model
     """
-    import requests
-    from urllib.parse import urljoin
+    from pyx_cli.client import get_client
+
+    client = get_client(pyx_config)
 
     if os.path.exists('./pyx-web/description.md'):
         with open('./pyx-web/description.md', 'r') as f:
@@ -353,11 +622,9 @@ def publish(args, pyx_project, pyx_config, **kwargs):
 
     if 'id' in pyx_project:
         print('Updating project:')
-        headers = {'Content-type': 'application/json', 'user-token': pyx_config["user_token"]}
-        r = requests.put(urljoin(__PYX_CONFIG__["api_url"], 'models/' + str(pyx_project['id'])), headers=headers, json=pyx_project)
+        r = client.put('models/' + str(pyx_project['id']), json=pyx_project)
     else:
-        headers = {'Content-type': 'application/json', 'user-token': pyx_config["user_token"]}
-        r = requests.post(urljoin(__PYX_CONFIG__["api_url"], 'models'), headers=headers, json=pyx_project)
+        r = client.post('models', json=pyx_project)
 
     print('After verification you can call the following to make your listing available:')
     print('$ pyx publish --make-available true')
@@ -370,8 +637,7 @@ def publish(args, pyx_project, pyx_config, **kwargs):
         upload(args, pyx_project=pyx_project)
 
         if 'make_available' in kwargs['extra_fields']:
-            r = requests.put(urljoin(__PYX_CONFIG__["api_url"], 'models/' + str(pyx_project['id']) + '/publish'),
-                             headers=headers, json={})
+            r = client.put('models/' + str(pyx_project['id']) + '/publish', json={})
             print(r.status_code)
     except:
         pass
@@ -384,41 +650,145 @@ def upload(args, pyx_project, pyx_config, **kwargs):
     """
     Upload local data to PYX cloud.
     """
-    import requests
-    from urllib.parse import urljoin
-    import os
-    import tempfile
+    from pyx_cli.client import get_client
+    from pyx_cli.packing import TarStream, project_entries
+    from pyx_cli.compression import BlockCompressor, CompressedStream, negotiate_codec, server_capabilities
+    from pyx_cli.ignore import load_ignore_rules
+
+    client = get_client(pyx_config)
+    rules = load_ignore_rules('.')
+    entries = project_entries(pyx_project, '.', rules)
+    model_id = str(pyx_project['id'])
+    r = None
 
-    with tempfile.TemporaryDirectory() as tmpdirname:
+    try:
+        codec = negotiate_codec(client, getattr(args, 'compression', None) or pyx_config.get('compression'))
+    except ValueError as e:
+        print(e)
+        print('An error occurred.')
+        return False
+    compressor = BlockCompressor(codec)
+    if codec != 'none':
+        print('Compressing with {0} on {1} threads ...'.format(codec, compressor.workers))
+
+    # Hashing reads every file, only worth it when the server can take changed files alone
+    if not getattr(args, 'full', False) and server_capabilities(client).get('delta_uploads'):
+        from pyx_cli.manifest import build_manifest, delta_upload, public_manifest
+
+        print('Hashing project files ...')
+        with telemetry.span('hash') as attributes:
+            manifest = build_manifest(entries, pyx_project.get('manifest'), ignore=rules)
+            attributes['files'] = len(manifest)
+
+        print('Uploading changed files ...')
+        with telemetry.span('delta_upload', codec=codec) as attributes:
+            try:
+                r = delta_upload(client, model_id, manifest,
+                                 workers=getattr(args, 'upload_workers', None) or 4, compressor=compressor)
+            except IOError as e:
+                compressor.close()
+                print(e)
+                print('An error occurred.')
+                return False
+            if codec != 'none':
+                attributes.update({'bytes': compressor.bytes_out, 'raw_bytes': compressor.bytes_in})
+        if r is None:
+            print('Server does not support delta uploads, sending the whole project.')
+        elif r.status_code == 200:
+            pyx_project['manifest'] = public_manifest(manifest)
+
+    if r is None:
         print('Packing current project ...')
-        import tarfile
-        import os.path
+        fileobj_it = TarStream(entries, 1024 * 1024 * 16, ignore=rules)
 
-        def make_tarfile(output_filename, source_dir):
-            with tarfile.open(output_filename, "w") as tar:
-                for f in os.listdir():
-                    dir_name = f
-                    if f not in ['pyx-web', 'pyx-testing-data']:
-                        dir_name = 'models/' + pyx_project['framework'] + '/' + dir_name
-                    tar.add(os.path.join(source_dir, f), arcname=dir_name)
+        print('Uploading data ...')
+        # The archive is packed while it is sent, pack_seconds is the part of the span spent packing
+        # (multipart: packing and compressing, summed over the upload threads)
+        with telemetry.span('upload', multipart=getattr(args, 'multipart', False), codec=codec) as attributes:
+            if getattr(args, 'multipart', False):
+                from pyx_cli.multipart import MultipartUpload
+
+                uploader = MultipartUpload(client, model_id, fileobj_it,
+                                           part_size=args.part_size * 1024 * 1024 if args.part_size else None,
+                                           workers=args.upload_workers, compressor=compressor)
+                try:
+                    r = uploader.run()
+                except IOError as e:
+                    compressor.close()
+                    print(e)
+                    print('An error occurred.')
+                    return False
+                attributes.update({'bytes': uploader.bytes_sent, 'raw_bytes': uploader.sentsofar - uploader.resumed,
+                                   'pack_seconds': uploader.pack_seconds})
+            else:
+                headers = {'Content-Type': 'application/octet-stream'}
+                data = fileobj_it
+                if codec != 'none':
+                    headers['Content-Encoding'] = codec
+                    data = CompressedStream(fileobj_it, compressor)
+                r = client.post('models/' + model_id + '/upload', headers=headers, data=data)
+                attributes.update({'bytes': compressor.bytes_out if codec != 'none' else fileobj_it.readsofar,
+                                   'raw_bytes': fileobj_it.readsofar, 'pack_seconds': fileobj_it.pack_seconds})
+    compressor.close()
+
+    if codec != 'none' and compressor.bytes_in:
+        print('Compressed {0:.1f} MB to {1:.1f} MB'.format(compressor.bytes_in / 1024 / 1024,
+                                                        compressor.bytes_out / 1024 / 1024))
+    if r.status_code == 200:
+        print('Successfully uploaded.')
+    else:
+        print(r.status_code)
+        print('An error occurred.')
 
-        make_tarfile(os.path.join(tmpdirname, '_project.tar'), '.')
 
-        print('Uploading data ...')
-        model_id = str(pyx_project['id'])
-        headers = {'user-token':  pyx_config["user_token"],
-                   'Content-Type': 'application/octet-stream'}
+@ensure_pyx_project
+def upload_dry_run(args, pyx_project, **kwargs):
+    """
+    Show what `pyx upload` would send: the archive size per top-level entry and the largest files
+    """
+    from pyx_cli.packing import TarStream, project_entries
+    from pyx_cli.ignore import __PYXIGNORE__, load_ignore_rules
+
+    rules = load_ignore_rules('.')
+    stream = TarStream(project_entries(pyx_project, '.', rules), progress=False, ignore=rules)
+    sizes = stream.member_sizes()
+    total = stream.totalsize
+
+    if rules.skipped:
+        print('Left out by the default rules and .pyxignore:')
+        for relpath, is_dir in rules.skipped[:args.top]:
+            print('  ' + relpath + ('/' if is_dir else ''))
+        if len(rules.skipped) > args.top:
+            print('  ... and {0} more'.format(len(rules.skipped) - args.top))
+        print()
 
-        fileobj_it = UploadInChunks(os.path.join(tmpdirname, '_project.tar'), 1024 * 1024 * 16)
-        r = requests.post(urljoin(__PYX_CONFIG__["api_url"], 'models/' + model_id + '/upload'),
-                          headers=headers,
-                          data=fileobj_it)
+    entries = {}
+    for path, tarinfo, size in sizes:
+        parts = os.path.relpath(path, '.').split(os.sep)
+        entry = entries.setdefault(parts[0] + ('/' if len(parts) > 1 or tarinfo.isdir() else ''), [0, 0])
+        entry[0] += size
+        entry[1] += int(tarinfo.isreg())
+
+    print('{0:>10} {1:>6} {2:>7}  {3}'.format('MB', '%', 'files', 'entry'))
+    for name, (size, files) in sorted(entries.items(), key=lambda e: e[1][0], reverse=True):
+        print('{0:10.1f} {1:5.1f}% {2:7d}  {3}'.format(size / 1024 / 1024, size * 100.0 / total, files, name))
+    print('{0:10.1f} {1:5.1f}% {2:7d}  total archive size'.format(
+        total / 1024 / 1024, 100.0, sum(files for size, files in entries.values())))
+
+    print()
+    print('Largest files:')
+    largest = sorted((e for e in sizes if e[1].isreg()), key=lambda e: e[1].size, reverse=True)[:args.top]
+    for path, tarinfo, size in largest:
+        print('{0:10.1f} {1:5.1f}%  {2}'.format(tarinfo.size / 1024 / 1024, size * 100.0 / total,
+                                                os.path.relpath(path, '.')))
+    print()
+    print('Nothing was uploaded. Add patterns to {0} to leave files out.'.format(__PYXIGNORE__))
 
-        if r.status_code == 200:
-            print('Successfully uploaded.')
-        else:
-            print(r.status_code)
-            print('An error occurred.')
+
+def upload_command(args, **kwargs):
+    if args.dry_run:
+        return upload_dry_run(args, **kwargs)
+    return upload(args, **kwargs)
 
 
 @with_pyx_config
@@ -426,22 +796,47 @@ def download(args, pyx_config, **kwargs):
     """
     Get data from PYX cloud
     """
-    import requests
-    from urllib.parse import urljoin
-    import shutil
     import os
-    import tempfile
+    import shutil
+    import requests
+    from pyx_cli.client import get_client
+    from pyx_cli.packing import HashingReader, extract_stream
 
     version = 'latest'
     model_id = args.model_name
     if model_id.find(':') != -1:
         model_id, version = model_id.split(':')
 
+    artifact_cache, entry = None, None
+    if not getattr(args, 'no_cache', False):
+        from pyx_cli.cache import ArtifactCache
+        artifact_cache = ArtifactCache(max_size=pyx_config['cache_max_size'])
+        cache_key = ArtifactCache.key(model_id, version)
+        entry = artifact_cache.lookup(cache_key)
+
     print('Downloading data ...')
 
-    headers = {'user-token':  pyx_config["user_token"]}
-    r = requests.get(urljoin(__PYX_CONFIG__["api_url"], 'models/' + model_id + '/download/' + version),
-                     headers=headers, stream=True)
+    headers = {}
+    if entry is not None and entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+
+    try:
+        r = get_client(pyx_config).get('models/' + model_id + '/download/' + version,
+                                       headers=headers, stream=True)
+    except requests.ConnectionError:
+        if entry is None:
+            raise
+        print('Server is not reachable, using the cached copy ...')
+        r = None
+
+    if r is None or r.status_code == 304:
+        print('Cached copy is up to date ...')
+        telemetry.count('download_cache_hits')
+        with telemetry.span('materialize'):
+            artifact_cache.materialize(cache_key, args.project_name)
+        print('....')
+        print('DONE')
+        return
 
     if r.status_code == 200:
         print('Successfully pulled ...')
@@ -449,19 +844,65 @@ def download(args, pyx_config, **kwargs):
         print('An error occurred.')
         return
 
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        print('Unpacking current project ...')
-        with open(os.path.join(tmpdirname, '_project.tar'), 'wb') as out_file:
-            shutil.copyfileobj(r.raw, out_file)
+    print('Unpacking current project ...')
+    destination = artifact_cache.staging_dir() if artifact_cache is not None else args.project_name
+    os.makedirs(destination, exist_ok=True)
+
+    r.raw.decode_content = True
+    reader = HashingReader(r.raw)
+    # Extraction runs while the archive is received
+    with telemetry.span('download') as attributes:
+        extract_stream(reader, destination)
+        reader.drain()
+        attributes['bytes'] = reader.readsofar
+
+    checksum = r.headers.get('X-Checksum-Sha256')
+    if checksum and checksum != reader.hexdigest():
+        if artifact_cache is not None:
+            shutil.rmtree(destination, ignore_errors=True)
+        print('Checksum mismatch, the download is corrupted.')
+        print('An error occurred.')
+        return
 
-        os.makedirs(args.project_name, exist_ok=True)
-        import tarfile
-        tar = tarfile.open(os.path.join(tmpdirname, '_project.tar'))
-        tar.extractall(path=args.project_name)
-        tar.close()
+    if artifact_cache is not None:
+        artifact_cache.store(cache_key, destination, r.headers.get('ETag') or reader.hexdigest())
+        with telemetry.span('materialize'):
+            artifact_cache.materialize(cache_key, args.project_name)
 
-        print('....')
-        print('DONE')
+    print('....')
+    print('DONE')
+
+
+@with_pyx_config
+def cache(args, pyx_config, **kwargs):
+    """
+    Inspect or prune the local caches of downloaded projects and inference results
+    """
+    from pyx_cli.cache import ArtifactCache, ResultCache
+
+    artifact_cache = ArtifactCache(max_size=pyx_config['cache_max_size'])
+    max_size = args.max_size * 1024 * 1024 if args.max_size is not None else None
+    result_cache = ResultCache(max_size=max_size if max_size is not None else pyx_config['result_cache_max_size'])
+
+    if args.action == 'ls':
+        entries = artifact_cache.entries()
+        for key in sorted(entries, key=lambda k: entries[k]['last_used'], reverse=True):
+            print('* {0} {1:.1f} MB (etag: {2})'.format(key, entries[key]['size'] / 1024 / 1024, entries[key]['etag']))
+        print('Total: {0:.1f} MB'.format(sum(e['size'] for e in entries.values()) / 1024 / 1024))
+        print('Results: {0} cached, {1:.1f} MB, {2} hits / {3} misses so far'.format(
+            len(result_cache.index), result_cache.size() / 1024 / 1024,
+            result_cache.totals.get('hits', 0), result_cache.totals.get('misses', 0)))
+
+    elif args.action == 'prune':
+        for key in artifact_cache.prune(max_size=0 if args.all else max_size):
+            print('Evicted ' + key)
+
+        before = len(result_cache.index)
+        if args.all:
+            result_cache.clear()
+        else:
+            result_cache.flush()
+        print('Evicted {0} cached results'.format(before - len(result_cache.index)))
 
 
 @with_pyx_config
@@ -469,69 +910,114 @@ def cloud_run(args, extra_fields, pyx_config, **kwargs):
     """
     Send a request for testing to pyx cloud.
     """
-    import requests
-    from urllib.parse import urljoin
-    import shutil
-    import os
-    import tempfile
+    import time
+    from pyx_cli.client import get_client
+    from pyx_cli.tasks import TaskWaiter, enqueue, unpack_result
 
-    model_id, framework = args.model_name.split('/')
-    version = 'latest'
-    if framework.find(':') != -1:
-        framework, version = framework.split(':')
+    print('Packing current input directory ...')
+    print('Uploading data ...')
+    client = get_client(pyx_config)
 
-    def from_base64(base64_data, output_file):
-        import base64
-        with open(output_file, 'wb') as f:
-            f.write(base64.decodebytes(str.encode(base64_data)))
-            f.close()
+    try:
+        r = enqueue(client, args.model_name, args.input_dir,
+                    codec=args.compression or pyx_config.get('compression'))
+    except ValueError as e:
+        print(e)
+        print('An error occurred.')
+        return False
+
+    if r.status_code != 200:
+        print(r.json()['status_msg'])
+        print('An error occurred.')
+        return
 
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        print('Packing current input directory ...')
-        shutil.make_archive(os.path.join(tmpdirname, '_input_files'), 'zip', args.input_dir)
+    task_id = r.json()['task_id']
+    print('Assigned task id {0}...'.format(task_id))
+    print()
+    print('Polling for data to be processed...')
 
-        print('Uploading data ...')
-        headers = {'user-token': pyx_config["user_token"]}
+    waiter = TaskWaiter(client, timeout=args.poll_timeout, long_poll=args.long_poll)
+    started = time.monotonic()
+    try:
+        with telemetry.span('poll') as attributes:
+            r, res = waiter.wait(task_id, on_status=lambda res: print(
+                '\x1b[2K' + 'current status: ' + str(res['status_msg']), end='\r'))
+            attributes['polls'] = waiter.polls[task_id]
+    except TimeoutError as e:
+        print()
+        print(e)
+        print('An error occurred.')
+        return
 
-        fileobj_it = UploadInChunks(os.path.join(tmpdirname, '_input_files.zip'), 1024 * 1024 * 1)
-        r = requests.post(urljoin(__PYX_CONFIG__["api_url"], 'tasks/enqueue/' + model_id + '/' + framework + '/' + version),
-                          headers=headers,
-                          data=fileobj_it)
+    print()
+    print('Task finished after {0} polls in {1:.1f} s'.format(waiter.polls[task_id], time.monotonic() - started))
 
-        if r.status_code != 200:
-            print(r.json()['status_msg'])
-            print('An error occurred.')
-            return
+    if r.status_code == 200:
+        print('Successfully predicted.')
+        print('Unpacking results ...')
 
-        task_id = r.json()['task_id']
-        print('Assigned task id {0}...'.format(task_id))
-        print()
-        print('Polling for data to be processed...')
+        unpack_result(res, args.output_dir, client)
+    else:
+        print(r.content)
+        print('An error occurred.')
 
-        while True:
-            headers = {'user-token': pyx_config["user_token"]}
-            r = requests.get(
-                urljoin(__PYX_CONFIG__["api_url"], 'tasks/status/' + str(task_id)),
-                headers=headers)
-            res = r.json()
-            print('\x1b[2K' + 'current status: ' + str(res['status_msg']), end='\r')
-
-            if res['result'] or res['status'] != 0:
-                break
 
-        print()
+@with_pyx_config
+def cloud_run_batch(args, pyx_config, **kwargs):
+    """
+    Run a model in pyx cloud over many input directories.
+    """
+    import os
+    from pyx_cli.batch import BatchRun, collect_jobs
+    from pyx_cli.client import get_client
+
+    try:
+        jobs = collect_jobs(args.inputs, args.output_dir, args.manifest)
+    except ValueError as e:
+        print(e)
+        print('An error occurred.')
+        return False
+    if not jobs:
+        print('No input directories found.')
+        return False
 
-        if r.status_code == 200:
-            print('Successfully predicted.')
-            print('Unpacking results ...')
+    os.makedirs(args.output_dir, exist_ok=True)
 
-            from_base64(res['result']['output_dir'], os.path.join(tmpdirname, '_output_files.zip'))
-            shutil.unpack_archive(os.path.join(tmpdirname, '_output_files.zip'), args.output_dir)
-        else:
-            print(r.content)
-            print('An error occurred.')
+    batch = BatchRun(get_client(pyx_config), args.model_name, jobs,
+                     args.state or os.path.join(args.output_dir, '.pyx-batch.json'),
+                     max_in_flight=args.max_in_flight, codec=args.compression or pyx_config.get('compression'))
+    try:
+        return batch.run()
+    except ValueError as e:
+        print(e)
+        print('An error occurred.')
+        return False
 
-    pass
+
+@with_pyx_config
+def compression(args, pyx_config, **kwargs):
+    """
+    Show the archive codecs available here and on the server and compare their speed and ratio
+    """
+    from pyx_cli.client import get_client
+    from pyx_cli.compression import available_codecs, server_capabilities, negotiate_codec
+    from pyx_cli.compression import benchmark, print_benchmark
+
+    client = get_client(pyx_config)
+    print('Available here: ' + ', '.join(available_codecs()))
+    print('Accepted by the server: ' + ', '.join(server_capabilities(client)['codecs']))
+    print('Uploads use: ' + negotiate_codec(client, 'auto'))
+
+    paths = args.paths
+    if not paths:
+        if not os.path.exists('./pyx.json'):
+            print('Pass files or directories to compress, or run inside a PYX project.')
+            return False
+        paths = ['.']
+
+    print('Benchmarking ...')
+    print_benchmark(benchmark(paths, codecs=args.codecs, levels=args.levels, workers=args.workers,
+                              block_size=args.block_size * 1024 * 1024 if args.block_size else None))
 
 
 @with_pyx_config
@@ -539,11 +1025,9 @@ def quotas(args, pyx_config, **kwargs):
     """
     Get current user's quotas
     """
-    import requests
-    from urllib.parse import urljoin
+    from pyx_cli.client import get_client
 
-    headers = {'user-token': pyx_config["user_token"]}
-    r = requests.get(urljoin(__PYX_CONFIG__["api_url"], 'quotas/'), headers=headers)
+    r = get_client(pyx_config).get('quotas/')
 
     if r.status_code == 200:
         print('Requests left: ', r.json()['requests'])
@@ -557,11 +1041,9 @@ def users_remote_models(args, pyx_config, **kwargs):
     """
     Get available/uploaded models
     """
-    import requests
-    from urllib.parse import urljoin
+    from pyx_cli.client import get_client
 
-    headers = {'user-token': pyx_config["user_token"]}
-    r = requests.get(urljoin(__PYX_CONFIG__["api_url"], 'users/'), headers=headers)
+    r = get_client(pyx_config).get('users/')
 
     if r.status_code == 200:
         if len(r.json()['orders']) > 0:
@@ -580,6 +1062,13 @@ def users_remote_models(args, pyx_config, **kwargs):
 
 def main():
     parser = argparse.ArgumentParser(prog='pyx')
+    parser.add_argument('--http-stats', action='store_true', help='print per-endpoint HTTP latency and traffic')
+    parser.add_argument('--telemetry', type=str, default=os.environ.get('PYX_TELEMETRY'),
+                        help='record timings, traffic and counters of the command to this file '
+                             '(default: $PYX_TELEMETRY)')
+    parser.add_argument('--telemetry-format', type=str, default=None, choices=telemetry.__TELEMETRY_FORMATS__,
+                        help='JSON lines appended to the file or a Prometheus textfile '
+                             '(default: prometheus for *.prom, jsonl otherwise)')
 
     subparsers = parser.add_subparsers(dest='mode', help='sub-command help')
 
@@ -593,23 +1082,113 @@ def main():
     parser_download = subparsers.add_parser('download', help='Pull a published workspace')
     parser_download.add_argument('model_name', type=str, help='model id / framework from pyx.ai')
     parser_download.add_argument('project_name', type=str, help='destination project name')
+    parser_download.add_argument('--no-cache', action='store_true', help='do not use the local download cache')
+
+    parser_cache = subparsers.add_parser('cache', help='Manage the local caches of projects and results')
+    parser_cache.add_argument('action', type=str, choices=['ls', 'prune'], help='list or evict cached projects')
+    parser_cache.add_argument('--max-size', type=int, default=None, help='prune down to this size (MB)')
+    parser_cache.add_argument('--all', action='store_true', help='evict every cached project and result')
 
     parser_publish = subparsers.add_parser('publish', help='Publish a project to pyx.ai')
     parser_upload = subparsers.add_parser('upload', help='Upload current workspace to pyx.ai')
+    for p in [parser_publish, parser_upload]:
+        p.add_argument('--multipart', action='store_true', help='resumable upload in parallel parts')
+        p.add_argument('--part-size', type=int, default=None, help='multipart part size (MB)')
+        p.add_argument('--upload-workers', type=int, default=None, help='number of parts uploaded at once')
+        p.add_argument('--full', action='store_true', help='send the whole project instead of changed files only')
+        p.add_argument('--compression', type=str, default=None, choices=['auto'] + __CODECS__,
+                       help='archive codec, auto picks the best one the server accepts')
+    parser_upload.add_argument('--dry-run', action='store_true',
+                               help='only show the archive size per entry and the largest files')
+    parser_upload.add_argument('--top', type=int, default=10, help='number of largest files to show')
 
     parser_cloud_run = subparsers.add_parser('cloud-run', help='Run model using pyx.ai cloud')
     parser_cloud_run.add_argument('model_name', type=str, help='a model path from pyx.ai (model-id/framework:version)')
     parser_cloud_run.add_argument('input_dir', type=str, help='directory with input samples')
     parser_cloud_run.add_argument('output_dir', type=str, help='directory with results')
+    parser_cloud_run.add_argument('--poll-timeout', type=float, default=None, help='give up waiting after (s)')
+    parser_cloud_run.add_argument('--long-poll', type=float, default=None,
+                                  help='ask the server to hold status requests up to (s)')
+
+    parser_cloud_run_batch = subparsers.add_parser('cloud-run-batch', help='Run model over many input directories')
+    parser_cloud_run_batch.add_argument('model_name', type=str, help='a model path from pyx.ai (model-id/framework:version)')
+    parser_cloud_run_batch.add_argument('output_dir', type=str, help='directory for per-input results')
+    parser_cloud_run_batch.add_argument('inputs', type=str, nargs='*', help='input directories or glob patterns')
+    parser_cloud_run_batch.add_argument('--manifest', type=str, default=None,
+                                        help='file with one input directory (tab, output directory) per line')
+    parser_cloud_run_batch.add_argument('--max-in-flight', type=int, default=8, help='tasks processed at once')
+    parser_cloud_run_batch.add_argument('--state', type=str, default=None,
+                                        help='state file to resume an interrupted batch')
+    for p in [parser_cloud_run, parser_cloud_run_batch]:
+        p.add_argument('--compression', type=str, default=None, choices=['auto'] + __CODECS__,
+                       help='codec of the input archives, auto picks the best one the server accepts')
+
+    parser_compression = subparsers.add_parser('compression', help='Benchmark archive codecs on model files')
+    parser_compression.add_argument('paths', type=str, nargs='*', help='files or directories (default: the project)')
+    parser_compression.add_argument('--codecs', type=str, nargs='+', default=None, choices=__CODECS__,
+                                    help='codecs to compare (default: all available)')
+    parser_compression.add_argument('--levels', type=int, nargs='+', default=None,
+                                    help='compression levels to compare (default: the codec default)')
+    parser_compression.add_argument('--workers', type=int, default=None,
+                                    help='compression threads (default: cpu count)')
+    parser_compression.add_argument('--block-size', type=int, default=None, help='block size (MB)')
 
     parser_run = subparsers.add_parser('run', help='Perform inference locally')
     parser_run.add_argument('input_dir', type=str, help='directory with input samples')
     parser_run.add_argument('output_dir', type=str, help='directory with results')
+    parser_run.add_argument('--workers', type=int, default=1,
+                            help='split the inputs across this many processes, each loading the model once')
+    parser_run.add_argument('--threads-per-worker', type=int, default=None,
+                            help='intra-op threads per process (default: cpu count / workers)')
+    parser_run.add_argument('--incremental', action='store_true',
+                            help='only process inputs that are new or changed since the last run')
+    parser_run.add_argument('--watch', action='store_true',
+                            help='keep running and process inputs as they arrive (implies --incremental)')
+    parser_run.add_argument('--interval', type=float, default=2.0, help='seconds between checks with --watch')
+    parser_run.add_argument('--cache-results', action='store_true',
+                            help='reuse outputs of inputs already run through the same model and weights')
+    parser_run.add_argument('--device', type=str, default='auto', help='cpu, cuda, cuda:N, or auto to detect')
+    parser_run.add_argument('--profile', type=str, default=None, choices=sorted(__CPU_PROFILES__),
+                            help='CPU execution profile: threads and core affinity')
+
+    parser_profile = subparsers.add_parser('profile', help='Profile predict and write flamegraph stacks')
+    parser_profile.add_argument('--input-dir', type=str, default=None, help='inputs (default: pyx-testing-data)')
+    parser_profile.add_argument('--profiler', type=str, default='sample', choices=['sample', 'cprofile'],
+                                help='sampling (low overhead) or deterministic cProfile')
+    parser_profile.add_argument('--interval', type=float, default=None, help='sampling interval (ms)')
+    parser_profile.add_argument('--warmup', type=int, default=1, help='unprofiled predict calls first')
+    parser_profile.add_argument('--iterations', type=int, default=5, help='profiled predict calls')
+    parser_profile.add_argument('--top', type=int, default=None, help='rows in the hotspot table')
+    parser_profile.add_argument('--output', type=str, default='pyx-profile', help='output file prefix')
+    parser_profile.add_argument('--device', type=str, default='auto', help='cpu, cuda, cuda:N, or auto to detect')
+    parser_profile.add_argument('--profile', type=str, default=None, choices=sorted(__CPU_PROFILES__),
+                                help='CPU execution profile: threads and core affinity')
+
+    parser_serve = subparsers.add_parser('serve', help='Serve the model locally, keeping it loaded')
+    parser_serve.add_argument('--host', type=str, default='127.0.0.1')
+    parser_serve.add_argument('--port', type=int, default=8080)
+    parser_serve.add_argument('--socket', type=str, default=None, help='listen on a unix socket instead')
+    parser_serve.add_argument('--queue-size', type=int, default=64, help='requests waiting before 503')
+    parser_serve.add_argument('--no-reload', action='store_true', help='do not reload on pyx_endpoints.py changes')
+    parser_serve.add_argument('--device', type=str, default='auto', help='cpu, cuda, cuda:N, or auto to detect')
+    parser_serve.add_argument('--profile', type=str, default=None, choices=sorted(__CPU_PROFILES__),
+                              help='CPU execution profile: threads and core affinity')
 
     _ = subparsers.add_parser('quotas', help='Check pyx-cloud quotas')
     _ = subparsers.add_parser('my-remote-models', help='List available models from PYX')
 
-    _ = subparsers.add_parser('test', help='Run tests locally')
+    parser_test = subparsers.add_parser('test', help='Run tests locally')
+    parser_test.add_argument('--warmup', type=int, default=None, help='untimed predict calls before measuring')
+    parser_test.add_argument('--iterations', type=int, default=None, help='timed predict calls')
+    parser_test.add_argument('--cache-results', action='store_true',
+                             help='store the outputs in the result cache used by pyx run --cache-results')
+    parser_test.add_argument('--report', type=str, default=None, help='write a JSON benchmark report')
+    parser_test.add_argument('--baseline', type=str, default=None, help='compare against a previous JSON report')
+    parser_test.add_argument('--regression-threshold', type=float, default=None,
+                             help='allowed slowdown against the baseline (%%)')
+    parser_test.add_argument('--device', type=str, default='auto', help='cpu, cuda, cuda:N, or auto to detect')
+    parser_test.add_argument('--profile', type=str, default=None, choices=sorted(__CPU_PROFILES__),
+                             help='CPU execution profile: threads and core affinity')
 
     # print help
     if len(sys.argv) < 2:
@@ -636,12 +1215,30 @@ def main():
         'configure': configure,
         'test': test,
         'publish': publish,
-        'upload': upload,
+        'upload': upload_command,
         'download': download,
+        'cache': cache,
         'cloud-run': cloud_run,
+        'cloud-run-batch': cloud_run_batch,
+        'compression': compression,
         'run': run_locally,
+        'serve': serve,
+        'profile': profile,
         'quotas': quotas,
         'my-remote-models': users_remote_models,
     }
 
-    subprogs[params.mode](params, extra_fields=extra_params, unknown=unknown)
+    if params.telemetry:
+        telemetry.enable(params.telemetry, params.telemetry_format, command=params.mode)
+
+    from pyx_cli.client import all_clients
+    status = 'error'
+    try:
+        result = subprogs[params.mode](params, extra_fields=extra_params, unknown=unknown)
+        status = 'failed' if result is False else 'ok'
+    finally:
+        telemetry.finish(all_clients(), status)
+
+    if params.http_stats:
+        for client in all_clients():
+            client.print_stats()
@@ -0,0 +1,194 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+import re
+import time
+import random
+import threading
+from urllib.parse import urljoin, urlsplit
+
+
+__HTTP_DEFAULTS__ = {
+    'http_connect_timeout': 10.0,
+    'http_read_timeout': 300.0,
+    'http_retries': 3,
+    'http_backoff': 0.5,
+    'http_max_backoff': 30.0,
+    'http_pool_size': 16,
+}
+
+__IDEMPOTENT_METHODS__ = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+__RETRY_STATUSES__ = {429, 500, 502, 503, 504}
+
+
+def _endpoint(method, url):
+    # Collapse ids so counters are kept per endpoint, not per object
+    path = re.sub(r'/(\d+|[0-9a-f]{12,})(?=/|$)', '/:id', urlsplit(url).path)
+    return method + ' ' + path
+
+
+def _body_size(body):
+    from requests.utils import super_len
+
+    if body is None:
+        return 0
+    try:
+        return super_len(body)
+    except Exception:
+        return 0
+
+
+def _rewind(body):
+    """
+    Prepare a request body for another attempt. Returns False when it can't be replayed.
+    """
+    if body is None or isinstance(body, (bytes, str, dict, list, tuple)):
+        return True
+    if hasattr(body, 'seek') and hasattr(body, 'tell'):
+        body.seek(0)
+        return True
+    if hasattr(body, 'rewind'):
+        # Iterables producing their data again on every iteration
+        body.rewind()
+        return True
+    return False
+
+
+class PyxClient(object):
+    """
+    HTTP client shared by all commands.
+
+    Holds one pooled keep-alive session, applies connect/read timeouts and
+    retries idempotent requests on connection errors and 429/5xx responses
+    with jittered exponential backoff (honouring Retry-After, capped at
+    max_backoff seconds). Latency and transferred bytes are counted per
+    endpoint.
+    """
+    def __init__(self, api_url, user_token=None, connect_timeout=None, read_timeout=None,
+                 retries=None, backoff=None, pool_size=None, max_backoff=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.api_url = api_url
+        self.user_token = user_token
+        self.timeout = (connect_timeout or __HTTP_DEFAULTS__['http_connect_timeout'],
+                        read_timeout or __HTTP_DEFAULTS__['http_read_timeout'])
+        self.retries = retries if retries is not None else __HTTP_DEFAULTS__['http_retries']
+        self.backoff = backoff if backoff is not None else __HTTP_DEFAULTS__['http_backoff']
+        self.max_backoff = max_backoff if max_backoff is not None else __HTTP_DEFAULTS__['http_max_backoff']
+
+        pool_size = pool_size or __HTTP_DEFAULTS__['http_pool_size']
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def url(self, path):
+        return urljoin(self.api_url, path)
+
+    def _record(self, endpoint, seconds, sent, received, failed=False):
+        with self._lock:
+            stats = self.stats.setdefault(endpoint, {
+                'requests': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                'bytes_sent': 0, 'bytes_received': 0,
+            })
+            stats['requests'] += 1
+            stats['errors'] += int(failed)
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['bytes_sent'] += sent
+            stats['bytes_received'] += received
+
+    def request(self, method, path, retries=None, idempotent=None, **kwargs):
+        """
+        Send a request to path (relative to api_url). Extra arguments go to requests.
+        """
+        import requests
+
+        url = self.url(path)
+        endpoint = _endpoint(method, url)
+        headers = dict(kwargs.pop('headers', None) or {})
+        if self.user_token is not None:
+            headers.setdefault('user-token', self.user_token)
+        kwargs.setdefault('timeout', self.timeout)
+
+        retries = self.retries if retries is None else retries
+        if idempotent is None:
+            idempotent = method in __IDEMPOTENT_METHODS__
+        if not idempotent:
+            retries = 0
+
+        body = kwargs.get('data')
+        body_size = _body_size(body)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                r = self.session.request(method, url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(endpoint, time.perf_counter() - start, body_size, 0, failed=True)
+                if attempt >= retries or not _rewind(body):
+                    raise
+                delay = None
+            else:
+                received = int(r.headers.get('Content-Length') or 0)
+                if not received and not kwargs.get('stream'):
+                    received = len(r.content)
+                failed = r.status_code in __RETRY_STATUSES__
+                sent = getattr(body, 'bytes_sent', body_size) if body is not None else _body_size(r.request.body)
+                self._record(endpoint, time.perf_counter() - start, sent, received, failed)
+                if not failed or attempt >= retries or not _rewind(body):
+                    return r
+                delay = r.headers.get('Retry-After')
+                r.close()
+
+            attempt += 1
+            try:
+                delay = float(delay)
+            except (TypeError, ValueError):
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+            time.sleep(min(max(delay, 0), self.max_backoff))
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def print_stats(self):
+        for endpoint in sorted(self.stats):
+            s = self.stats[endpoint]
+            print('{0}: {1} requests ({2} failed), avg {3:.3f} s, max {4:.3f} s, sent {5} B, received {6} B'.format(
+                endpoint, s['requests'], s['errors'], s['seconds'] / s['requests'], s['max_seconds'],
+                s['bytes_sent'], s['bytes_received']))
+
+
+__CLIENTS__ = {}
+
+
+def get_client(pyx_config):
+    """
+    Process-wide client for the configured API url and user token
+    """
+    key = (pyx_config['api_url'], pyx_config.get('user_token'))
+    if key not in __CLIENTS__:
+        __CLIENTS__[key] = PyxClient(
+            pyx_config['api_url'], pyx_config.get('user_token'),
+            connect_timeout=pyx_config.get('http_connect_timeout'),
+            read_timeout=pyx_config.get('http_read_timeout'),
+            retries=pyx_config.get('http_retries'),
+            backoff=pyx_config.get('http_backoff'),
+            pool_size=pyx_config.get('http_pool_size'),
+            max_backoff=pyx_config.get('http_max_backoff'),
+        )
+    return __CLIENTS__[key]
+
+
+def all_clients():
+    return list(__CLIENTS__.values())
@@ -0,0 +1,351 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+"""
+Archive codecs with parallel block compression.
+
+Like pigz, the data is cut into blocks that are compressed independently on a
+thread pool: every gzip block becomes a gzip member and every zstd block a zstd
+frame. Concatenated members / frames are a valid stream for any decompressor,
+and zlib and zstandard release the GIL while they work, so all cores are used.
+
+The codec of an upload is negotiated with the server (GET compression); servers
+without that endpoint only get uncompressed archives.
+"""
+
+import os
+import time
+import threading
+
+
+# Preference order of 'auto'
+__CODECS__ = ['zstd', 'gzip', 'none']
+
+__COMPRESSION_DEFAULTS__ = {
+    'codec': 'auto',
+    'block_size': 1024 * 1024 * 4,
+    'levels': {'gzip': 6, 'zstd': 3},
+}
+
+# api_url -> {'codecs': [...], 'task_archives': [...], 'delta_uploads': bool}
+__SERVER_CAPABILITIES__ = {}
+
+
+def _zstandard():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def available_codecs():
+    """
+    Codecs this installation can write, zstd needs the zstandard package
+    """
+    return [codec for codec in __CODECS__ if codec != 'zstd' or _zstandard() is not None]
+
+
+def server_capabilities(client):
+    """
+    What the server accepts: {'codecs': [...], 'task_archives': [...], 'delta_uploads': bool}
+    """
+    if client.api_url not in __SERVER_CAPABILITIES__:
+        import requests
+
+        capabilities = {'codecs': ['none'], 'task_archives': ['zip'], 'delta_uploads': False}
+        try:
+            r = client.get('compression', retries=0)
+            if r.status_code == 200:
+                capabilities.update(r.json())
+        except (requests.RequestException, ValueError):
+            pass
+        __SERVER_CAPABILITIES__[client.api_url] = capabilities
+
+    return __SERVER_CAPABILITIES__[client.api_url]
+
+
+def negotiate_codec(client, requested=None):
+    """
+    The codec to send with: the requested one, or for 'auto' the first of
+    __CODECS__ both sides support. Raises ValueError when the requested one
+    can't be used.
+    """
+    requested = requested or __COMPRESSION_DEFAULTS__['codec']
+    accepted = server_capabilities(client)['codecs']
+    local = available_codecs()
+
+    if requested == 'auto':
+        return next(codec for codec in __CODECS__ if codec == 'none' or (codec in accepted and codec in local))
+    if requested == 'none':
+        return requested
+    if requested not in local:
+        raise ValueError('{0} compression is not available here, for zstd: pip install zstandard'.format(requested))
+    if requested not in accepted:
+        raise ValueError('The server does not accept {0} compression, it accepts: {1}'.format(
+            requested, ', '.join(accepted)))
+    return requested
+
+
+class BlockCompressor(object):
+    """
+    Compress blocks of block_size bytes independently on workers threads
+    """
+    def __init__(self, codec, level=None, block_size=None, workers=None):
+        if codec not in __CODECS__:
+            raise ValueError('Unknown codec {0}, choose from {1}'.format(codec, ', '.join(__CODECS__)))
+
+        self.codec = codec
+        self.level = level if level is not None else __COMPRESSION_DEFAULTS__['levels'].get(codec)
+        self.block_size = block_size or __COMPRESSION_DEFAULTS__['block_size']
+        self.workers = workers or os.cpu_count() or 1
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def compress_block(self, data):
+        if self.codec == 'gzip':
+            import gzip
+            return gzip.compress(data, self.level, mtime=0)
+        if self.codec == 'zstd':
+            # Compressor objects can't be shared between threads
+            if not hasattr(self._local, 'zstd'):
+                self._local.zstd = _zstandard().ZstdCompressor(level=self.level)
+            return self._local.zstd.compress(data)
+        return data
+
+    def _pool(self):
+        # One compressor is shared by concurrent uploads, only the first one may start the pool
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _blocks(self, chunks):
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= self.block_size:
+                yield bytes(buffer[:self.block_size])
+                del buffer[:self.block_size]
+        if buffer:
+            yield bytes(buffer)
+
+    def stream(self, chunks):
+        """
+        Compress an iterable of byte strings, yielding compressed blocks in
+        order. At most two blocks per worker are held in memory.
+        """
+        from collections import deque
+
+        if self.codec == 'none':
+            for chunk in chunks:
+                self._count(len(chunk), len(chunk))
+                yield chunk
+            return
+
+        pending = deque()
+        for block in self._blocks(chunks):
+            pending.append((len(block), self._pool().submit(self.compress_block, block)))
+            if len(pending) >= 2 * self.workers:
+                size, future = pending.popleft()
+                data = future.result()
+                self._count(size, len(data))
+                yield data
+
+        while pending:
+            size, future = pending.popleft()
+            data = future.result()
+            self._count(size, len(data))
+            yield data
+
+    def _count(self, size, compressed):
+        # One compressor may serve several uploads at once
+        with self._lock:
+            self.bytes_in += size
+            self.bytes_out += compressed
+
+    def compress(self, data):
+        return b''.join(self.stream([data]))
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+class CompressedStream(object):
+    """
+    Request body compressing an iterable of byte strings (a TarStream, file
+    chunks) while it is sent. Can be iterated again to retry a request.
+    """
+    def __init__(self, source, compressor):
+        self.source = source
+        self.compressor = compressor
+        # Compressed bytes produced by the last iteration, the size is not known up front
+        self.bytes_sent = 0
+
+    def __iter__(self):
+        self.bytes_sent = 0
+        for data in self.compressor.stream(iter(self.source)):
+            self.bytes_sent += len(data)
+            yield data
+
+    def rewind(self):
+        # Every iteration starts from the beginning of the source
+        pass
+
+
+class FileChunks(object):
+    """
+    The contents of a file as chunks, read again on every iteration
+    """
+    def __init__(self, path, chunksize=1 << 20):
+        self.path = path
+        self.chunksize = chunksize
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            for data in iter(lambda: f.read(self.chunksize), b''):
+                yield data
+
+
+class Decoder(object):
+    """
+    Incremental decoder of concatenated gzip members or zstd frames
+    """
+    def __init__(self, codec):
+        if codec not in __CODECS__:
+            raise ValueError('Unknown codec {0}'.format(codec))
+        if codec == 'zstd' and _zstandard() is None:
+            raise IOError('zstd compressed data, please install zstandard: pip install zstandard')
+
+        self.codec = codec
+        self._decompressor = self._new()
+
+    def _new(self):
+        import zlib
+
+        if self.codec == 'gzip':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self.codec == 'zstd':
+            return _zstandard().ZstdDecompressor().decompressobj()
+        return None
+
+    def decompress(self, data):
+        if self._decompressor is None:
+            return data
+
+        output = []
+        while data:
+            output.append(self._decompressor.decompress(data))
+            if not self._decompressor.eof:
+                break
+            # The next member / frame starts in the unused data
+            data = self._decompressor.unused_data
+            self._decompressor = self._new()
+        return b''.join(output)
+
+
+class DecodingReader(object):
+    """
+    File-like view of the decoded contents of a compressed file-like object
+    """
+    def __init__(self, fileobj, codec, chunksize=1 << 20):
+        self.fileobj = fileobj
+        self.decoder = Decoder(codec)
+        self.chunksize = chunksize
+        self._buffer = b''
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            data = self.fileobj.read(self.chunksize)
+            if not data:
+                self._eof = True
+                break
+            self._buffer += self.decoder.decompress(data)
+
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def decode_chunks(codec, chunks):
+    decoder = Decoder(codec)
+    for chunk in chunks:
+        data = decoder.decompress(chunk)
+        if data:
+            yield data
+
+
+def benchmark(paths, codecs=None, levels=None, workers=None, block_size=None):
+    """
+    Compress and decompress the files under paths with every codec and level.
+    Returns [{'codec', 'level', 'workers', 'size', 'compressed', 'ratio',
+    'compress_mb_s', 'decompress_mb_s'}].
+    """
+    import tempfile
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names))
+        else:
+            files.append(path)
+
+    def source():
+        for path in files:
+            for data in FileChunks(path):
+                yield data
+
+    results = []
+    for codec in codecs or available_codecs():
+        for level in (levels or [None]) if codec != 'none' else [None]:
+            compressor = BlockCompressor(codec, level, block_size, workers)
+            with tempfile.TemporaryFile() as compressed:
+                start = time.perf_counter()
+                for data in compressor.stream(source()):
+                    compressed.write(data)
+                compress_seconds = time.perf_counter() - start
+                compressor.close()
+
+                compressed.seek(0)
+                decoded = 0
+                start = time.perf_counter()
+                for data in decode_chunks(codec, iter(lambda: compressed.read(1 << 20), b'')):
+                    decoded += len(data)
+                decompress_seconds = time.perf_counter() - start
+
+            if decoded != compressor.bytes_in:
+                raise IOError('{0} round trip lost data: {1} of {2} bytes'.format(codec, decoded, compressor.bytes_in))
+
+            mb = compressor.bytes_in / 1024 / 1024
+            results.append({
+                'codec': codec,
+                'level': compressor.level,
+                'workers': compressor.workers,
+                'size': compressor.bytes_in,
+                'compressed': compressor.bytes_out,
+                'ratio': compressor.bytes_in / compressor.bytes_out if compressor.bytes_out else 1.0,
+                'compress_mb_s': mb / compress_seconds if compress_seconds else 0.0,
+                'decompress_mb_s': mb / decompress_seconds if decompress_seconds else 0.0,
+            })
+    return results
+
+
+def print_benchmark(results):
+    print('{0:<6} {1:>5} {2:>7} {3:>12} {4:>12} {5:>7} {6:>14} {7:>16}'.format(
+        'codec', 'level', 'workers', 'size MB', 'packed MB', 'ratio', 'compress MB/s', 'decompress MB/s'))
+    for r in results:
+        print('{0:<6} {1:>5} {2:>7} {3:12.1f} {4:12.1f} {5:7.2f} {6:14.1f} {7:16.1f}'.format(
+            r['codec'], r['level'] if r['level'] is not None else '-', r['workers'], r['size'] / 1024 / 1024,
+            r['compressed'] / 1024 / 1024, r['ratio'], r['compress_mb_s'], r['decompress_mb_s']))
@@ -0,0 +1,140 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+import os
+import sys
+
+
+# Thread pools read these when the numeric libraries are imported,
+# so they have to be set before pyx_endpoints.py is loaded
+__THREAD_ENV_VARS__ = [
+    'OMP_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+]
+
+# Named CPU execution profiles. Thread counts are fractions of the cores this
+# process may run on; the cores are pinned when the platform allows it.
+#   all         every core for one predict call at a time, lowest latency
+#   half        half of the cores, leaving the rest to other processes
+#   single      one pinned core, the most reproducible timings
+#   throughput  single threaded operators, independent branches run in parallel
+__CPU_PROFILES__ = {
+    'all': {'intra_op': 1.0, 'inter_op': 1, 'cores': 1.0, 'env': {'OMP_PROC_BIND': 'close', 'OMP_PLACES': 'cores'}},
+    'half': {'intra_op': 0.5, 'inter_op': 1, 'cores': 0.5, 'env': {'OMP_PROC_BIND': 'close', 'OMP_PLACES': 'cores'}},
+    'single': {'intra_op': 1, 'inter_op': 1, 'cores': 1, 'env': {'OMP_PROC_BIND': 'true'}},
+    'throughput': {'intra_op': 1, 'inter_op': 1.0, 'cores': 1.0, 'env': {'OMP_PROC_BIND': 'false'}},
+}
+
+
+def limit_threads(threads):
+    for name in __THREAD_ENV_VARS__:
+        os.environ[name] = str(threads)
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _cpu_model():
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+
+    import platform
+    return platform.processor() or None
+
+
+def detect_device():
+    """
+    'cuda' when an NVIDIA GPU is usable, 'cpu' otherwise.
+    Checked without importing a framework, which would defeat the thread settings.
+    """
+    import shutil
+
+    if os.environ.get('CUDA_VISIBLE_DEVICES', None) in ('', '-1'):
+        return 'cpu'
+    if os.path.isdir('/proc/driver/nvidia/gpus') and os.listdir('/proc/driver/nvidia/gpus'):
+        return 'cuda'
+    if sys.platform != 'darwin' and shutil.which('nvidia-smi'):
+        return 'cuda'
+    return 'cpu'
+
+
+def _count(value, total):
+    # Fractions are relative to total, integers are absolute
+    if isinstance(value, float):
+        return max(1, int(total * value))
+    return min(value, total)
+
+
+def apply_profile(device=None, profile=None):
+    """
+    Resolve device ('auto' or None detects it) and apply the named CPU profile
+    to this process: thread environment variables and core affinity.
+    Has to run before pyx_endpoints.py is imported.
+
+    Returns a description of the execution settings, for the project meta.
+    """
+    if device in (None, 'auto'):
+        device = detect_device()
+
+    cores = available_cores()
+    execution = {
+        'device': device,
+        'profile': profile,
+        'cpu': _cpu_model(),
+        'cpu_count': len(cores),
+    }
+    if profile is None:
+        return execution
+    if profile not in __CPU_PROFILES__:
+        raise ValueError('Unknown profile {0}, choose from {1}'.format(profile, ', '.join(__CPU_PROFILES__)))
+
+    settings = __CPU_PROFILES__[profile]
+    pinned = cores[:_count(settings['cores'], len(cores))]
+    intra_op = _count(settings['intra_op'], len(pinned))
+    inter_op = _count(settings['inter_op'], len(pinned))
+
+    limit_threads(intra_op)
+    os.environ['MKL_DYNAMIC'] = 'FALSE'
+    os.environ.update(settings['env'])
+    # For endpoints configuring their runtime themselves (onnxruntime session options, ...)
+    os.environ['PYX_INTRA_OP_THREADS'] = str(intra_op)
+    os.environ['PYX_INTER_OP_THREADS'] = str(inter_op)
+
+    if hasattr(os, 'sched_setaffinity') and len(pinned) < len(cores):
+        os.sched_setaffinity(0, pinned)
+
+    execution.update({
+        'intra_op_threads': intra_op,
+        'inter_op_threads': inter_op,
+        'cores': len(pinned),
+    })
+    return execution
+
+
+def set_library_threads(intra_op, inter_op=None):
+    """
+    Thread counts for frameworks that don't read the environment,
+    if pyx_endpoints.py imported them. Prints a warning for settings
+    the framework refuses.
+    """
+    if 'torch' in sys.modules:
+        torch = sys.modules['torch']
+        torch.set_num_threads(intra_op)
+        if inter_op and torch.get_num_interop_threads() != inter_op:
+            try:
+                torch.set_num_interop_threads(inter_op)
+            except RuntimeError as e:
+                # Only allowed before the first parallel work
+                print('Warning: could not set torch inter-op threads to {0}, keeping {1}: {2}'.format(
+                    inter_op, torch.get_num_interop_threads(), e))
@@ -0,0 +1,420 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+"""
+Local stand-in for the pyx.ai API.
+
+Implements the subset of endpoints used by the CLI and keeps everything in a
+local directory, so uploads and other transfers can be tried without pyx.ai:
+
+    $ python -m pyx_cli.devserver --root /tmp/pyx-server --port 8000
+
+and set "api_url": "http://127.0.0.1:8000/api/" in ~/.pyx/pyx.json.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import base64
+import random
+import shutil
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+__CATEGORIES__ = [
+    {'id': 1, 'parent_id': None, 'name': 'General', 'url': 'general'},
+    {'id': 2, 'parent_id': 1, 'name': 'Other', 'url': 'other'},
+]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Request handler. Routes are (method, path regex, handler name) triples.
+    """
+    routes = [
+        ('GET', r'auth/check', 'auth_check'),
+        ('GET', r'categories', 'categories'),
+        ('GET', r'compression', 'compression'),
+        ('POST', r'models', 'create_model'),
+        ('PUT', r'models/(?P<model_id>\w+)', 'update_model'),
+        ('POST', r'models/(?P<model_id>\w+)/upload', 'upload'),
+        ('POST', r'models/(?P<model_id>\w+)/multipart', 'multipart_start'),
+        ('PUT', r'models/(?P<model_id>\w+)/multipart/(?P<upload_id>\w+)/(?P<number>\d+)', 'multipart_part'),
+        ('POST', r'models/(?P<model_id>\w+)/multipart/(?P<upload_id>\w+)/commit', 'multipart_commit'),
+        ('POST', r'models/(?P<model_id>\w+)/blobs/missing', 'blobs_missing'),
+        ('PUT', r'models/(?P<model_id>\w+)/blobs/(?P<sha256>[0-9a-f]{64})', 'blob'),
+        ('PUT', r'models/(?P<model_id>\w+)/manifest', 'manifest'),
+        ('GET', r'models/(?P<model_id>\w+)(/(?P<framework>\w+))?/download/(?P<version>[\w.]+)', 'download'),
+        ('GET', r'quotas', 'quotas'),
+        ('POST', r'tasks/enqueue/(?P<model_id>\w+)/(?P<framework>\w+)/(?P<version>[\w.]+)', 'enqueue'),
+        ('GET', r'tasks/status/(?P<task_id>\w+)', 'task_status'),
+        ('GET', r'tasks/result/(?P<task_id>\w+)', 'task_result'),
+    ]
+
+    root = '.'
+    fail_rate = 0.0
+    task_duration = 3.0
+    quota = 1000
+
+    tasks = {}
+    tasks_lock = threading.Lock()
+
+    def _query(self):
+        from urllib.parse import parse_qs
+
+        query = self.path.split('?', 1)[1] if '?' in self.path else ''
+        return {k: v[-1] for k, v in parse_qs(query).items()}
+
+    def _dispatch(self, method):
+        path = self.path.split('?', 1)[0]
+        if not path.startswith('/api/'):
+            return self._reply(404, {'status_msg': 'Not found'})
+        path = path[len('/api/'):].rstrip('/')
+
+        for route_method, pattern, name in self.routes:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                return getattr(self, name)(**match.groupdict())
+
+        self._reply(404, {'status_msg': 'Not found'})
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def _reply(self, status, body=None, headers=None):
+        data = json.dumps(body if body is not None else {}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body_chunks(self, chunksize=1 << 20):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().strip().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+
+        left = int(self.headers.get('Content-Length', 0))
+        while left > 0:
+            data = self.rfile.read(min(chunksize, left))
+            if not data:
+                return
+            left -= len(data)
+            yield data
+
+    def _encoding(self):
+        """
+        Codec of the request body, None when it is not supported
+        """
+        from pyx_cli.compression import available_codecs
+
+        codec = self.headers.get('Content-Encoding', 'none').lower()
+        return codec if codec in available_codecs() else None
+
+    def _json_body(self):
+        data = b''.join(self._body_chunks())
+        return json.loads(data.decode()) if data else {}
+
+    def _save_body(self, path):
+        """
+        Store the request body decoded according to its Content-Encoding, returns its sha256
+        """
+        from pyx_cli.compression import decode_chunks
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = hashlib.sha256()
+        tmp_path = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as f:
+            for data in decode_chunks(self._encoding(), self._body_chunks()):
+                digest.update(data)
+                f.write(data)
+        os.replace(tmp_path, path)
+        return digest.hexdigest()
+
+    def _unsupported_encoding(self):
+        for _ in self._body_chunks():
+            pass
+        self._reply(415, {'status_msg': 'Unsupported Content-Encoding ' + self.headers.get('Content-Encoding')})
+
+    def _model_dir(self, model_id, *parts):
+        return os.path.join(self.root, 'models', model_id, *parts)
+
+    def _blob_path(self, sha256):
+        return os.path.join(self.root, 'blobs', sha256[:2], sha256)
+
+    def _should_fail(self):
+        return self.fail_rate and random.random() < self.fail_rate
+
+    def auth_check(self):
+        self._reply(200, {})
+
+    def categories(self):
+        etag = '"{0}"'.format(hashlib.sha256(json.dumps(__CATEGORIES__).encode()).hexdigest()[:16])
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self._reply(200, {'categories': __CATEGORIES__}, {'ETag': etag})
+
+    def create_model(self):
+        model = self._json_body()
+        model['id'] = uuid.uuid4().int % 100000
+        os.makedirs(self._model_dir(str(model['id'])), exist_ok=True)
+        self._reply(200, model)
+
+    def update_model(self, model_id):
+        model = self._json_body()
+        self._reply(200, {**model, 'id': int(model_id) if model_id.isdigit() else model_id})
+
+    def compression(self):
+        from pyx_cli.compression import available_codecs
+
+        self._reply(200, {'codecs': available_codecs(), 'task_archives': ['tar', 'zip'], 'delta_uploads': True})
+
+    def upload(self, model_id):
+        if self._encoding() is None:
+            return self._unsupported_encoding()
+        self._save_body(self._model_dir(model_id, 'project.tar'))
+        self._reply(200, {})
+
+    def multipart_start(self, model_id):
+        request = self._json_body()
+        from pyx_cli.compression import available_codecs
+
+        codec = request.get('codec', 'none')
+        if codec not in available_codecs():
+            return self._reply(415, {'status_msg': 'Unsupported codec ' + codec})
+
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._model_dir(model_id, 'multipart', upload_id), exist_ok=True)
+        # Parts are stored as sent and decoded together on commit
+        with open(self._model_dir(model_id, 'multipart', upload_id, 'codec'), 'w') as f:
+            f.write(codec)
+        self._reply(200, {'upload_id': upload_id, 'part_size': request.get('part_size')})
+
+    def multipart_part(self, model_id, upload_id, number):
+        if not os.path.isdir(self._model_dir(model_id, 'multipart', upload_id)):
+            for _ in self._body_chunks():
+                pass
+            return self._reply(404, {'status_msg': 'Unknown upload'})
+        if self._should_fail():
+            # Drain the body so the connection stays usable, then fail the part
+            for _ in self._body_chunks():
+                pass
+            return self._reply(503, {'status_msg': 'Injected failure'})
+
+        etag = self._save_body(self._model_dir(model_id, 'multipart', upload_id, '{0:08d}'.format(int(number))))
+        self._reply(200, {'etag': etag})
+
+    def multipart_commit(self, model_id, upload_id):
+        from pyx_cli.compression import Decoder
+
+        request = self._json_body()
+        parts_dir = self._model_dir(model_id, 'multipart', upload_id)
+        if not os.path.isdir(parts_dir):
+            return self._reply(404, {'status_msg': 'Unknown upload'})
+        with open(os.path.join(parts_dir, 'codec'), 'r') as f:
+            decoder = Decoder(f.read())
+
+        with open(self._model_dir(model_id, 'project.tar'), 'wb') as out_file:
+            for part in sorted(request['parts'], key=lambda p: p['number']):
+                with open(os.path.join(parts_dir, '{0:08d}'.format(part['number'])), 'rb') as in_file:
+                    for data in iter(lambda: in_file.read(1 << 20), b''):
+                        out_file.write(decoder.decompress(data))
+
+        shutil.rmtree(parts_dir)
+        self._reply(200, {})
+
+    def blobs_missing(self, model_id):
+        request = self._json_body()
+        missing = [h for h in request['hashes'] if not os.path.exists(self._blob_path(h))]
+        self._reply(200, {'missing': missing})
+
+    def blob(self, model_id, sha256):
+        if self._encoding() is None:
+            return self._unsupported_encoding()
+        path = self._blob_path(sha256)
+        if self._save_body(path) != sha256:
+            os.remove(path)
+            return self._reply(400, {'status_msg': 'Blob does not match its hash'})
+        self._reply(200, {})
+
+    def manifest(self, model_id):
+        import tarfile
+
+        files = self._json_body()['files']
+        missing = [f['sha256'] for f in files.values()
+                   if f['type'] == 'file' and not os.path.exists(self._blob_path(f['sha256']))]
+        if missing:
+            return self._reply(409, {'status_msg': 'Missing blobs', 'missing': missing})
+
+        # Assemble the same project archive a full upload would have produced
+        os.makedirs(self._model_dir(model_id), exist_ok=True)
+        with tarfile.open(self._model_dir(model_id, 'project.tar'), 'w') as tar:
+            for arcname in sorted(files):
+                item = files[arcname]
+                tarinfo = tarfile.TarInfo(arcname)
+                tarinfo.mtime = int(item.get('mtime', 0))
+                if item['type'] == 'dir':
+                    tarinfo.type = tarfile.DIRTYPE
+                    tarinfo.mode = item['mode']
+                    tar.addfile(tarinfo)
+                elif item['type'] == 'link':
+                    tarinfo.type = tarfile.SYMTYPE
+                    tarinfo.linkname = item['target']
+                    tar.addfile(tarinfo)
+                else:
+                    tarinfo.size = item['size']
+                    tarinfo.mode = item['mode']
+                    with open(self._blob_path(item['sha256']), 'rb') as f:
+                        tar.addfile(tarinfo, f)
+
+        with open(self._model_dir(model_id, 'manifest.json'), 'w') as f:
+            f.write(json.dumps(files, indent=4))
+        self._reply(200, {})
+
+    def download(self, model_id, framework, version):
+        path = self._model_dir(model_id, 'project.tar')
+        if not os.path.exists(path):
+            return self._reply(404, {'status_msg': 'Model not found'})
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(1 << 20), b''):
+                digest.update(data)
+
+        etag = '"{0}"'.format(digest.hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-tar')
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.send_header('ETag', etag)
+        self.send_header('X-Checksum-Sha256', digest.hexdigest())
+        self.end_headers()
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def quotas(self):
+        self._reply(200, {'requests': StandInHandler.quota})
+
+    def enqueue(self, model_id, framework, version):
+        """
+        Tasks are not executed: after task_duration seconds the input archive is returned as the result.
+        Tar inputs are converted to zip, the format of task results.
+        """
+        if self._encoding() is None:
+            return self._unsupported_encoding()
+
+        with self.tasks_lock:
+            if StandInHandler.quota <= 0:
+                return self._reply(403, {'status_msg': 'Quota exceeded'})
+            StandInHandler.quota -= 1
+            task_id = uuid.uuid4().hex[:12]
+
+        task_dir = os.path.join(self.root, 'tasks', task_id)
+        if self.headers.get('Content-Type') == 'application/x-tar':
+            from pyx_cli.packing import extract_stream
+            from pyx_cli.tasks import _zip_directory
+
+            self._save_body(os.path.join(task_dir, 'input.tar'))
+            with open(os.path.join(task_dir, 'input.tar'), 'rb') as f:
+                extract_stream(f, os.path.join(task_dir, 'input'))
+            _zip_directory(os.path.join(task_dir, 'input'), os.path.join(task_dir, 'input.zip'))
+            shutil.rmtree(os.path.join(task_dir, 'input'))
+            os.remove(os.path.join(task_dir, 'input.tar'))
+        else:
+            self._save_body(os.path.join(task_dir, 'input.zip'))
+        with self.tasks_lock:
+            self.tasks[task_id] = {'ready_at': time.time() + self.task_duration}
+        self._reply(200, {'task_id': task_id})
+
+    def _task_state(self, task_id):
+        task = self.tasks[task_id]
+        if time.time() < task['ready_at']:
+            return {'status': 0, 'status_msg': 'processing', 'result': None}
+
+        if self._query().get('result_format') == 'url':
+            return {'status': 0, 'status_msg': 'done', 'result': {'output_url': 'tasks/result/' + task_id}}
+
+        with open(os.path.join(self.root, 'tasks', task_id, 'input.zip'), 'rb') as f:
+            output = base64.encodebytes(f.read()).decode()
+        return {'status': 0, 'status_msg': 'done', 'result': {'output_dir': output}}
+
+    def task_status(self, task_id):
+        if task_id not in self.tasks:
+            return self._reply(404, {'status': 1, 'status_msg': 'Unknown task', 'result': None})
+
+        wait = float(self._query().get('wait', 0))
+        deadline = time.time() + wait
+        while time.time() < deadline and time.time() < self.tasks[task_id]['ready_at']:
+            time.sleep(0.05)
+
+        state = self._task_state(task_id)
+        headers = {}
+        if not state['result'] and not wait:
+            headers['Retry-After'] = '{0:.0f}'.format(max(1, self.tasks[task_id]['ready_at'] - time.time()))
+        self._reply(200, state, headers)
+
+    def task_result(self, task_id):
+        path = os.path.join(self.root, 'tasks', task_id, 'input.zip')
+        if task_id not in self.tasks or time.time() < self.tasks[task_id]['ready_at']:
+            return self._reply(404, {'status_msg': 'Result is not ready'})
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='pyx-devserver')
+    parser.add_argument('--root', type=str, default='./pyx-server', help='directory to keep uploaded data')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of part uploads to reject with 503')
+    parser.add_argument('--task-duration', type=float, default=3.0, help='seconds until an enqueued task is done')
+    parser.add_argument('--quota', type=int, default=1000, help='number of tasks the user may enqueue')
+    args = parser.parse_args()
+
+    StandInHandler.root = os.path.abspath(args.root)
+    StandInHandler.fail_rate = args.fail_rate
+    StandInHandler.task_duration = args.task_duration
+    StandInHandler.quota = args.quota
+    os.makedirs(StandInHandler.root, exist_ok=True)
+
+    server = ThreadingHTTPServer((args.host, args.port), StandInHandler)
+    print('Serving pyx API stand-in on http://{0}:{1}/api/'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+import os
+import sys
+
+
+class ModelEndpoints(object):
+    """
+    The pyx_endpoints.py of a project, imported once and kept in memory.
+
+    Endpoints may define an optional load(weight_paths, device) returning a
+    model handle. predict() then receives that handle in place of the weight
+    paths, so the model is built once instead of on every call. Endpoints
+    without load() get the weight paths, as before.
+
+    threads, an (intra_op, inter_op) pair, is applied to the frameworks
+    pyx_endpoints.py imports before the model is built.
+    """
+    def __init__(self, project_dir='.', threads=None):
+        self.project_dir = os.path.abspath(project_dir)
+        self.threads = threads
+        self.path = os.path.join(self.project_dir, 'pyx_endpoints.py')
+        self.module = None
+        self.weight_paths = None
+        self.handle = None
+        self.device = None
+        self.mtime = None
+
+    def load(self, device=None, handle=True):
+        """
+        Import pyx_endpoints.py and build the model. With handle=False only the
+        weight paths are resolved, for processes that don't run predict themselves.
+        """
+        import importlib.util
+        from pyx_cli.device import set_library_threads
+
+        if device is not None:
+            self.device = device
+        if self.project_dir not in sys.path:
+            sys.path.append(self.project_dir)
+
+        self.mtime = os.path.getmtime(self.path)
+        spec = importlib.util.spec_from_file_location('pyx_endpoints', self.path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['pyx_endpoints'] = module
+        try:
+            spec.loader.exec_module(module)
+            weight_paths = {i: k for i, k in module.get_weight_paths().items()}
+            if self.threads:
+                # torch only takes the inter-op thread count before its first parallel work
+                set_library_threads(*self.threads)
+            handle = module.load(weight_paths, self.device) if handle and hasattr(module, 'load') else weight_paths
+            if self.threads:
+                # Frameworks imported by load() itself
+                set_library_threads(*self.threads)
+        except Exception:
+            del sys.modules['pyx_endpoints']
+            raise
+
+        self.module, self.weight_paths, self.handle = module, weight_paths, handle
+        return self
+
+    def unload(self):
+        from gc import collect
+
+        self.module = None
+        self.weight_paths = None
+        self.handle = None
+        sys.modules.pop('pyx_endpoints', None)
+        if self.project_dir in sys.path:
+            sys.path.remove(self.project_dir)
+        collect()
+
+    def changed(self):
+        """
+        True when pyx_endpoints.py was modified since it was loaded
+        """
+        try:
+            return os.path.getmtime(self.path) != self.mtime
+        except OSError:
+            return False
+
+    def reload(self, handle=True):
+        """
+        Import pyx_endpoints.py again, handle as in load(). On failure the
+        previously loaded version stays active.
+        """
+        module, weight_paths, previous = self.module, self.weight_paths, self.handle
+        try:
+            return self.load(handle=handle)
+        except Exception:
+            self.module, self.weight_paths, self.handle = module, weight_paths, previous
+            sys.modules['pyx_endpoints'] = module
+            raise
+
+    def fingerprint(self, hashes, device=None):
+        """
+        Hash of pyx_endpoints.py, the weight files and the device: results of
+        predict can be reused for as long as it stays the same.
+        hashes is a FileHashes memo, so unchanged weights are not re-read.
+        """
+        import json
+        import hashlib
+
+        weights = {}
+        for name, path in sorted(self.weight_paths.items()):
+            path = os.path.join(self.project_dir, path)
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    for f in sorted(files):
+                        weights[name + '/' + os.path.relpath(os.path.join(root, f), path)] = \
+                            hashes.sha256(os.path.join(root, f))
+            elif os.path.exists(path):
+                weights[name] = hashes.sha256(path)
+
+        digest = hashlib.sha256()
+        digest.update(hashes.sha256(self.path).encode())
+        digest.update(json.dumps(weights, sort_keys=True).encode())
+        digest.update(str(device or self.device).encode())
+        return digest.hexdigest()
+
+    def predict(self, input_dir, output_dir, device=None):
+        return self.module.predict(input_dir, output_dir, self.handle, device or self.device)
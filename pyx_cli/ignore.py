@@ -0,0 +1,183 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+"""
+gitignore-style exclusion of project files from uploads.
+
+Rules are read from .pyxignore in the project root, after the defaults below,
+so a '!pattern' there can bring back something the defaults leave out:
+
+    # comments, blank lines
+    *.ckpt          any file or directory named like this, at any depth
+    /data           only at the project root
+    logs/           directories only
+    **/tmp/*.npy    ** matches any number of directories
+    !keep.ckpt      include again
+
+Ignored directories are pruned: they are not walked at all, so their contents
+can't be re-included (the same as git). Directories holding a virtualenv or a
+conda environment are left out unless a rule includes them explicitly.
+"""
+
+import os
+import re
+
+
+__PYXIGNORE__ = '.pyxignore'
+
+__DEFAULT_IGNORE__ = [
+    '.git/',
+    '.hg/',
+    '.svn/',
+    '__pycache__/',
+    '*.py[cod]',
+    '.ipynb_checkpoints/',
+    '.DS_Store',
+    # pyx working files and caches derived from the weights on this machine
+    '.pyx-run.json',
+    '.pyx-batch.json',
+    '.pyx-shard-*/',
+    '.pyx-incremental-*/',
+    'pyx-profile.*',
+    '.*.optimized.onnx',
+    '.*.torchscript.pt',
+    '.*.sha256',
+]
+
+# A directory holding one of these is a Python environment
+__ENVIRONMENT_MARKERS__ = ['pyvenv.cfg', 'conda-meta']
+
+
+def _translate(pattern):
+    """
+    Regex for one pattern, matched against '/' separated paths relative to the root
+    """
+    # A slash anywhere but at the end ties the pattern to the root
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**', i) and (i == 0 or pattern[i - 1] == '/'):
+            if pattern.startswith('**/', i):
+                out.append('(?:.*/)?')
+                i += 3
+                continue
+            if i + 2 == n:
+                out.append('.*')
+                i += 2
+                continue
+
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[' and pattern.find(']', i + 2) != -1:
+            j = pattern.find(']', i + 2)
+            chars = pattern[i + 1:j]
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            out.append('[' + chars.replace('\\', '\\\\') + ']')
+            i = j
+        elif c == '\\' and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 1
+        else:
+            out.append(re.escape(c))
+        i += 1
+
+    return ('' if anchored else '(?:.*/)?') + ''.join(out)
+
+
+def _parse(line):
+    """
+    (negate, directories only, regex) of a .pyxignore line, None for comments and blank lines
+    """
+    line = line.rstrip('\n')
+    if not line.endswith('\\ '):
+        line = line.rstrip()
+    if not line or line.startswith('#'):
+        return None
+
+    negate = line.startswith('!')
+    if negate or line.startswith('\\!') or line.startswith('\\#'):
+        line = line[1:]
+
+    directories_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    return negate, directories_only, _translate(line)
+
+
+class IgnoreRules(object):
+    """
+    Compiled rules. Consecutive rules of the same kind share one regex, and
+    groups are tried from the last one, so the last matching rule decides
+    with a handful of regex matches per path whatever the number of rules.
+    """
+    def __init__(self, patterns=(), root='.'):
+        self.root = root
+        self._prefix = os.path.join(root, '')
+        # Paths left out while walking, for `pyx upload --dry-run`
+        self.skipped = []
+
+        groups = []
+        for line in patterns:
+            rule = _parse(line)
+            if rule is None:
+                continue
+            negate, directories_only, regex = rule
+            if groups and groups[-1][:2] == (negate, directories_only):
+                groups[-1][2].append(regex)
+            else:
+                groups.append((negate, directories_only, [regex]))
+
+        self._groups = [(negate, directories_only, re.compile('(?:{0})$'.format('|'.join(regexes))))
+                        for negate, directories_only, regexes in reversed(groups)]
+
+    def match(self, relpath, is_dir=False):
+        """
+        True when the last matching rule excludes relpath, False when it
+        includes it again, None when no rule matches
+        """
+        for negate, directories_only, regex in self._groups:
+            if directories_only and not is_dir:
+                continue
+            if regex.match(relpath):
+                return not negate
+        return None
+
+    def ignored(self, path, is_dir=False):
+        """
+        Whether a path below root (as joined from root) is left out
+        """
+        if path.startswith(self._prefix):
+            relpath = path[len(self._prefix):]
+        else:
+            relpath = os.path.relpath(path, self.root)
+        if os.sep != '/':
+            relpath = relpath.replace(os.sep, '/')
+
+        ignored = self.match(relpath, is_dir)
+        if ignored is None and is_dir:
+            ignored = any(os.path.exists(os.path.join(path, marker)) for marker in __ENVIRONMENT_MARKERS__)
+        if ignored:
+            self.skipped.append((relpath, is_dir))
+        return bool(ignored)
+
+
+def load_ignore_rules(root='.'):
+    """
+    The default rules followed by the ones in root/.pyxignore
+    """
+    patterns = list(__DEFAULT_IGNORE__)
+    path = os.path.join(root, __PYXIGNORE__)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            patterns += f.read().splitlines()
+            f.close()
+
+    return IgnoreRules(patterns, root)
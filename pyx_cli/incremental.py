@@ -0,0 +1,276 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+import os
+import json
+import time
+
+from pyx_cli.manifest import FileHashes
+from pyx_cli.runner import list_inputs, link_inputs, merge_outputs
+
+
+__INCREMENTAL_STATE__ = '.pyx-run.json'
+
+
+def _stem(path):
+    # 'a/img1.tar.gz' -> 'a/img1'
+    head, tail = os.path.split(path)
+    return os.path.join(head, tail.split('.', 1)[0])
+
+
+def owners_of(output, stems):
+    """
+    Inputs an output file was produced from, judged by name: 'img1.png' owns
+    'img1.json' and 'img1_mask.png'. stems maps input stems to inputs.
+    Outputs matching no input belong to all of them.
+    """
+    stem = _stem(output)
+    # Candidate input stems are prefixes of the output stem ending at a separator, longest first
+    for end in range(len(stem), 0, -1):
+        if end == len(stem) or stem[end] in '._-/':
+            if stem[:end] in stems:
+                return stems[stem[:end]]
+    return sorted(i for inputs in stems.values() for i in inputs)
+
+
+class IncrementalRun(object):
+    """
+    Runs predict only on inputs that are new or changed since the previous run.
+
+    A state file in output_dir records the content hash of every input, which
+    outputs each input produced, and the model fingerprint (pyx_endpoints.py,
+    weights and device). A different fingerprint reprocesses everything.
+    Outputs whose inputs were deleted, or that a changed input no longer
+    produces, are removed. Files in output_dir that pyx did not write are left alone.
+    """
+    def __init__(self, project_dir, input_dir, output_dir, state_path=None):
+        self.project_dir = os.path.abspath(project_dir)
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.state_path = state_path or os.path.join(output_dir, __INCREMENTAL_STATE__)
+        self.state = self._load_state()
+        self.hashes = FileHashes(self.state.setdefault('hashes', {}))
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'fingerprint': None, 'hashes': {}, 'inputs': {}, 'outputs': {}}
+
+    def _save_state(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(self.state, indent=4))
+        os.replace(tmp_path, self.state_path)
+
+    def scan(self, min_age=0.0):
+        """
+        Hash the current inputs. Files modified less than min_age seconds ago may
+        still be written to, so they keep their previous state or wait for the next scan.
+        """
+        previous = self.state['inputs']
+        now = time.time()
+        inputs = {}
+        for f in list_inputs(self.input_dir):
+            path = os.path.join(self.input_dir, f)
+            try:
+                # Follows symlinks: a linked input is hashed by the contents it points to
+                st = os.stat(path)
+                if min_age and now - st.st_mtime < min_age:
+                    if f in previous:
+                        inputs[f] = previous[f]
+                    continue
+                inputs[f] = {'sha256': self.hashes.sha256(path), 'size': st.st_size, 'mtime': st.st_mtime}
+            except FileNotFoundError:
+                # Deleted meanwhile, or a dangling symlink
+                continue
+        return inputs
+
+    def plan(self, inputs, fingerprint):
+        previous = self.state['inputs']
+        if fingerprint != self.state['fingerprint']:
+            changed = sorted(inputs)
+        else:
+            changed = sorted(f for f, item in inputs.items() if previous.get(f, {}).get('sha256') != item['sha256'])
+        deleted = sorted(set(previous) - set(inputs))
+        return changed, deleted
+
+    def update(self, predict, endpoints, min_age=0.0):
+        """
+        Bring output_dir up to date with input_dir. predict(input_dir, files, output_dir)
+        runs the model loaded in endpoints over files of input_dir.
+
+        Outputs shared by several inputs (a summary over all of them, say) can't
+        be updated from the changed inputs alone: when one would be, all inputs
+        are processed again.
+        Returns (changed, deleted) inputs.
+        """
+        import shutil
+        import tempfile
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        fingerprint = endpoints.fingerprint(self.hashes)
+        inputs = self.scan(min_age)
+        changed, deleted = self.plan(inputs, fingerprint)
+        if not changed and not deleted:
+            return changed, deleted
+
+        stems = {}
+        for f in inputs:
+            stems.setdefault(_stem(f), []).append(f)
+
+        def partial(owners_by_output, stale):
+            # Some output depends on both stale inputs and inputs that are not reprocessed
+            return any(not set(owners) <= stale for owners in owners_by_output.values()
+                       if set(owners) & stale)
+
+        full = set(changed) == set(inputs)
+        if not full and partial(self.state['outputs'], set(changed) | set(deleted)):
+            print('Some outputs belong to several inputs, processing all inputs again')
+            changed, full = sorted(inputs), True
+
+        produced = {}
+        if changed:
+            staging = tempfile.mkdtemp(prefix='.pyx-incremental-', dir=self.output_dir)
+            try:
+                staged_output = os.path.join(staging, 'output')
+                os.makedirs(staged_output)
+                predict(self.input_dir, changed, staged_output)
+                produced = {output: owners_of(output, stems) for output in list_inputs(staged_output)}
+
+                if not full and partial(produced, set(changed)):
+                    print('Some outputs belong to several inputs, processing all inputs again')
+                    shutil.rmtree(staged_output)
+                    os.makedirs(staged_output)
+                    changed = sorted(inputs)
+                    predict(self.input_dir, changed, staged_output)
+                    produced = {output: owners_of(output, stems) for output in list_inputs(staged_output)}
+
+                merge_outputs(staged_output, self.output_dir)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+
+        stale = set(changed) | set(deleted)
+        outputs = {}
+        for output, owners in self.state['outputs'].items():
+            if output in produced:
+                continue
+            remaining = [i for i in owners if i not in stale]
+            if remaining:
+                outputs[output] = remaining
+            else:
+                self._remove_output(output)
+        outputs.update(produced)
+
+        self.state.update({'fingerprint': fingerprint, 'inputs': inputs, 'outputs': outputs})
+        self._save_state()
+        return changed, deleted
+
+    def _remove_output(self, output):
+        path = os.path.join(self.output_dir, output)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+
+        # Drop directories left empty, up to output_dir
+        directory = os.path.dirname(path)
+        while os.path.abspath(directory) != os.path.abspath(self.output_dir):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+
+def predict_in_process(endpoints):
+    """
+    Adapter running an already loaded ModelEndpoints over a subset of the inputs
+    """
+    def predict(input_dir, files, output_dir):
+        import shutil
+        import tempfile
+
+        staged_input = tempfile.mkdtemp(prefix='.pyx-input-', dir=os.path.dirname(os.path.abspath(output_dir)))
+        try:
+            link_inputs(input_dir, files, staged_input)
+            if endpoints.predict(staged_input, output_dir) is False:
+                raise AssertionError('predict returned False')
+        finally:
+            shutil.rmtree(staged_input, ignore_errors=True)
+
+    return predict
+
+
+def store_results(result_cache, keys, output_dir, files=None):
+    """
+    Store the outputs in output_dir as the results of the inputs in keys
+    (input -> cache key), matched by file name like in IncrementalRun against
+    all inputs in files (defaults to keys). Outputs of inputs outside keys
+    are left alone.
+
+    When some output can't be attributed to a single input (a summary over
+    the whole batch, say) nothing is stored and False is returned, since
+    restoring part of the batch would be wrong.
+    """
+    stems = {}
+    for f in files if files is not None else keys:
+        stems.setdefault(_stem(f), []).append(f)
+
+    produced = {f: [] for f in keys}
+    for output in list_inputs(output_dir):
+        owners = owners_of(output, stems)
+        if len(owners) != 1:
+            return False
+        if owners[0] in produced:
+            produced[owners[0]].append(output)
+
+    for f, key in keys.items():
+        result_cache.store(key, output_dir, produced[f])
+    return True
+
+
+def with_result_cache(predict, result_cache, fingerprint):
+    """
+    Wrap predict(input_dir, files, output_dir) so that inputs with a cached
+    result are restored from result_cache and only the rest reach the model.
+    If the model writes outputs shared by several inputs, the whole batch runs
+    through the model and nothing is restored or stored.
+    """
+    def cached_predict(input_dir, files, output_dir):
+        import shutil
+        import tempfile
+
+        keys = {f: result_cache.key(result_cache.hashes.sha256(os.path.join(input_dir, f)), fingerprint)
+                for f in files}
+        staging = tempfile.mkdtemp(prefix='.pyx-results-', dir=output_dir)
+        restored = os.path.join(staging, 'restored')
+        computed = os.path.join(staging, 'computed')
+        try:
+            misses = []
+            for f in files:
+                if result_cache.lookup(keys[f]) is not None:
+                    result_cache.restore(keys[f], restored)
+                else:
+                    misses.append(f)
+
+            if misses:
+                os.makedirs(computed)
+                predict(input_dir, misses, computed)
+                if not store_results(result_cache, {f: keys[f] for f in misses}, computed, files):
+                    print('Some outputs belong to several inputs, results of this batch are not cached')
+                    if len(misses) < len(files):
+                        shutil.rmtree(restored, ignore_errors=True)
+                        shutil.rmtree(computed)
+                        os.makedirs(computed)
+                        predict(input_dir, files, computed)
+
+            merge_outputs(restored, output_dir)
+            merge_outputs(computed, output_dir)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        result_cache.flush()
+
+    return cached_predict
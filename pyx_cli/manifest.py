@@ -0,0 +1,131 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+import os
+import stat
+import hashlib
+
+
+def _file_sha256(path, chunksize=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunksize)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class FileHashes(object):
+    """
+    Content hashes of files by absolute path, recomputed only when size or
+    modification time change. known is the dict kept between runs.
+    """
+    def __init__(self, known=None):
+        self.known = known if known is not None else {}
+
+    def sha256(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        entry = self.known.get(path)
+        if entry is None or entry['size'] != st.st_size or entry['mtime'] != st.st_mtime:
+            entry = {'sha256': _file_sha256(path), 'size': st.st_size, 'mtime': st.st_mtime}
+            self.known[path] = entry
+        return entry['sha256']
+
+
+def build_manifest(entries, previous=None, ignore=None):
+    """
+    Content hash manifest of the project archive, keyed by arcname.
+
+    Hashes from a previous manifest are reused for files whose size and
+    modification time did not change, so only edited files are re-read.
+    Paths ignore (IgnoreRules) excludes are left out.
+    """
+    previous = previous or {}
+    manifest = {}
+
+    def add(path, arcname):
+        st = os.lstat(path)
+        if ignore is not None and ignore.ignored(path, stat.S_ISDIR(st.st_mode)):
+            return
+
+        if stat.S_ISDIR(st.st_mode):
+            manifest[arcname] = {'type': 'dir', 'mode': stat.S_IMODE(st.st_mode)}
+            for f in sorted(os.listdir(path)):
+                add(os.path.join(path, f), arcname + '/' + f)
+        elif stat.S_ISLNK(st.st_mode):
+            manifest[arcname] = {'type': 'link', 'target': os.readlink(path)}
+        elif stat.S_ISREG(st.st_mode):
+            known = previous.get(arcname, {})
+            if known.get('size') == st.st_size and known.get('mtime') == st.st_mtime and 'sha256' in known:
+                sha256 = known['sha256']
+            else:
+                sha256 = _file_sha256(path)
+            manifest[arcname] = {'type': 'file', 'sha256': sha256, 'size': st.st_size,
+                                 'mtime': st.st_mtime, 'mode': stat.S_IMODE(st.st_mode),
+                                 'path': path}
+
+    for path, arcname in entries:
+        add(path, arcname)
+
+    return manifest
+
+
+def public_manifest(manifest):
+    # Local paths are needed to send blobs but are not part of the stored manifest
+    return {k: {f: v for f, v in item.items() if f != 'path'} for k, item in manifest.items()}
+
+
+def delta_upload(client, model_id, manifest, workers=4, compressor=None):
+    """
+    Send only the blobs the server is missing, then the new manifest.
+    Blobs are compressed with compressor (a BlockCompressor) when given.
+
+    Returns the final response, or None when the server does not support
+    delta uploads and the caller should fall back to a full upload. Raises
+    IOError when the server rejects a request.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    model_path = 'models/' + str(model_id) + '/'
+    blobs = {item['sha256']: item for item in manifest.values() if item['type'] == 'file'}
+
+    r = client.post(model_path + 'blobs/missing', json={'hashes': sorted(blobs)}, idempotent=True)
+    if r.status_code == 404:
+        return None
+    if r.status_code != 200:
+        raise IOError('Could not list missing files: HTTP {0}'.format(r.status_code))
+
+    missing = r.json()['missing']
+    total = sum(blobs[sha256]['size'] for sha256 in missing)
+    print('Sending {0} of {1} files ({2:.1f} MB) ...'.format(len(missing), len(blobs), total / 1024 / 1024))
+
+    def send(sha256):
+        headers = {'Content-Type': 'application/octet-stream'}
+        if compressor is not None and compressor.codec != 'none':
+            from pyx_cli.compression import CompressedStream, FileChunks
+
+            headers['Content-Encoding'] = compressor.codec
+            r = client.put(model_path + 'blobs/' + sha256, headers=headers,
+                           data=CompressedStream(FileChunks(blobs[sha256]['path']), compressor))
+        else:
+            with open(blobs[sha256]['path'], 'rb') as f:
+                r = client.put(model_path + 'blobs/' + sha256, headers=headers, data=f)
+        if r.status_code != 200:
+            raise IOError('Could not send {0}: HTTP {1}'.format(blobs[sha256]['path'], r.status_code))
+        return sha256
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(send, sha256) for sha256 in missing]
+        try:
+            for future in as_completed(futures):
+                print('* ' + future.result()[:12])
+        except IOError:
+            # Blobs not started yet are dropped, the server keeps the ones already sent
+            for future in futures:
+                future.cancel()
+            raise
+
+    return client.put(model_path + 'manifest', json={'files': public_manifest(manifest)})
@@ -4,15 +4,18 @@
 import os
 import json
 from datetime import datetime
-import requests
-from urllib.parse import urljoin
 
 
 __PYX_CONFIG__ = {
     'api_url': 'https://beta.pyx.ai/api/',
     'frameworks': ['pytorch', 'onnx', 'tensorflow', 'gluon'],
     'required_fields': ['name', 'paper_url', 'dataset', 'license', 'description_short', 'description_full', 'price'],
-    'last_meta_update': 0.0,
+    'cache_max_size': 10 * 1024 * 1024 * 1024,
+    'result_cache_max_size': 2 * 1024 * 1024 * 1024,
+    'http_connect_timeout': 10.0,
+    'http_read_timeout': 300.0,
+    'http_retries': 3,
+    'compression': 'auto',
 }
 
 
@@ -34,6 +37,19 @@ __PYX_MODULE_TEMPLATE__ = {
     'model_id': '',
 }
 
+# In-process copy of ~/.pyx/pyx.json and its last saved contents
+__CONFIG_STATE__ = {
+    'config': None,
+    'saved': None,
+}
+
+# Categories are cached in ~/.pyx/categories.json and served stale while a refresh runs
+__CATEGORIES_TTL__ = 60 * 60
+__CATEGORIES_STATE__ = {
+    'cache': None,
+    'refresh': None,
+}
+
 
 def ensure_pyx_project(func):
     def wrapper_fn(*args, **kwargs):
@@ -46,11 +62,15 @@ def ensure_pyx_project(func):
             with open(os.path.join('pyx.json'), 'r') as f:
                 pyx_project = json.load(f)
                 f.close()
+            loaded = json.dumps(pyx_project, indent=4)
             func_output = func(*args, **{**kwargs, 'pyx_project': pyx_project})
 
-            with open(os.path.join('pyx.json'), 'w') as f:
-                f.write(json.dumps(pyx_project, indent=4))
-                f.close()
+            # pyx.json is packed into uploads, rewriting it unchanged would stop them from resuming
+            project_json = json.dumps(pyx_project, indent=4)
+            if project_json != loaded:
+                with open(os.path.join('pyx.json'), 'w') as f:
+                    f.write(project_json)
+                    f.close()
 
         else:
             func_output = func(*args, **{**kwargs})
@@ -99,7 +119,6 @@ def ensure_have_permissions(func):
 def with_pyx_config(func):
     def wrapper_fn(*args, **kwargs):
         pyx_config = _load_config()
-        _sync_meta(pyx_config)
 
         func_output = func(*args, **{**kwargs, 'pyx_config': pyx_config})
 
@@ -109,28 +128,108 @@ def with_pyx_config(func):
     return wrapper_fn
 
 
-def _sync_meta(pyx_config):
-    if 'categories' in pyx_config:
-        if 'last_meta_update' in pyx_config:
-            if datetime.timestamp(datetime.now()) - pyx_config['last_meta_update'] < 60 * 60:
-                # Cache for 1 hour
-                return
+def _categories_path():
+    return os.path.join(os.path.expanduser('~'), '.pyx', 'categories.json')
 
-    print('Updating meta information...')
-    r = requests.get(urljoin(pyx_config["api_url"], 'categories'))
-    if r.status_code == 200:
-        categories_json = r.json()['categories']
-        pyx_config['last_meta_update'] = datetime.timestamp(datetime.now())
-        pyx_config['categories'] = categories_json
-        _save_config(pyx_config)
+
+def _save_categories(cache):
+    os.makedirs(os.path.dirname(_categories_path()), exist_ok=True)
+    with open(_categories_path() + '.tmp', 'w') as f:
+        f.write(json.dumps(cache, indent=4))
+        f.close()
+    os.replace(_categories_path() + '.tmp', _categories_path())
+
+
+def _load_categories(pyx_config):
+    if __CATEGORIES_STATE__['cache'] is not None:
+        return __CATEGORIES_STATE__['cache']
+
+    cache = None
+    if os.path.exists(_categories_path()):
+        with open(_categories_path(), 'r') as f:
+            try:
+                cache = json.load(f)
+            except ValueError:
+                cache = None
+            f.close()
+
+    elif 'categories' in pyx_config:
+        # Categories used to be kept in the user config, move them out
+        cache = {'categories': pyx_config.pop('categories'),
+                 'fetched_at': pyx_config.pop('last_meta_update', 0.0)}
+        _save_categories(cache)
+
+    __CATEGORIES_STATE__['cache'] = cache
+    return cache
+
+
+def _sync_meta(pyx_config, cache=None):
+    """
+    Fetch categories, revalidating the cached copy with ETag / If-Modified-Since.
+    Returns the new cache entry, or None if the request failed.
+    """
+    from pyx_cli.client import get_client
+
+    headers = {}
+    if cache is not None and cache.get('etag'):
+        headers['If-None-Match'] = cache['etag']
+    if cache is not None and cache.get('last_modified'):
+        headers['If-Modified-Since'] = cache['last_modified']
+
+    try:
+        r = get_client(pyx_config).get('categories', headers=headers)
+    except IOError:
+        return None
+
+    if r.status_code == 304 and cache is not None:
+        cache = {**cache, 'fetched_at': datetime.timestamp(datetime.now())}
+    elif r.status_code == 200:
+        cache = {
+            'categories': r.json()['categories'],
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'fetched_at': datetime.timestamp(datetime.now()),
+        }
     else:
-        print('An error occurred. Please, check your connection and try again later.')
+        return None
+
+    _save_categories(cache)
+    __CATEGORIES_STATE__['cache'] = cache
+    return cache
+
+
+def _get_categories(pyx_config):
+    """
+    Categories for the project wizards.
+
+    The cached copy is returned at once. When it is older than an hour it is
+    refreshed in a background thread; only a missing cache is fetched inline.
+    """
+    cache = _load_categories(pyx_config)
+
+    if cache is None:
+        print('Updating meta information...')
+        cache = _sync_meta(pyx_config)
+        if cache is None:
+            print('An error occurred. Please, check your connection and try again later.')
+            return []
+
+    elif datetime.timestamp(datetime.now()) - cache.get('fetched_at', 0.0) > __CATEGORIES_TTL__:
+        if __CATEGORIES_STATE__['refresh'] is None:
+            import threading
+
+            __CATEGORIES_STATE__['refresh'] = threading.Thread(
+                target=_sync_meta, args=(pyx_config, cache), daemon=True)
+            __CATEGORIES_STATE__['refresh'].start()
+
+    return cache['categories']
 
 
 @with_pyx_config
 def _get_template_path(subcategory_id, pyx_config):
-    subcategory_obj = next(obj for obj in pyx_config['categories'] if obj['id'] == subcategory_id)
-    category_obj = next(obj for obj in pyx_config['categories'] if obj['id'] == subcategory_obj['parent_id'])
+    categories = _get_categories(pyx_config)
+    subcategory_obj = next(obj for obj in categories if obj['id'] == subcategory_id)
+    category_obj = next(obj for obj in categories if obj['id'] == subcategory_obj['parent_id'])
 
     return '{}/{}'.format(category_obj['url'], subcategory_obj['url'])
 
@@ -140,30 +239,37 @@ def _get_category_choices(answers, pyx_config):
     root_id = None
     if 'category' in answers:
         root_id = answers['category']
-    return [(i['name'], i['id']) for i in pyx_config['categories'] if i['parent_id'] == root_id]
+    return [(i['name'], i['id']) for i in _get_categories(pyx_config) if i['parent_id'] == root_id]
 
 
 def _load_config():
     """
     Load JSON config from ~/.pyx/pyx.json
+
+    The config is read once per process, later calls return the same object.
     """
     import json
 
+    if __CONFIG_STATE__['config'] is not None:
+        return __CONFIG_STATE__['config']
+
     config_path_dir = os.path.join(os.path.expanduser('~'), '.pyx')
     config_path = os.path.join(config_path_dir, 'pyx.json')
 
-    pyx_config = __PYX_CONFIG__
+    pyx_config = dict(__PYX_CONFIG__)
     if os.path.exists(config_path):
         with open(config_path, 'r') as f:
-            pyx_config = {**pyx_config, **json.load(f)}
+            __CONFIG_STATE__['saved'] = f.read()
+            pyx_config = {**pyx_config, **json.loads(__CONFIG_STATE__['saved'])}
             f.close()
 
+    __CONFIG_STATE__['config'] = pyx_config
     return pyx_config
 
 
 def _save_config(pyx_config):
     """
-    Save JSON config to ~/.pyx/pyx.json
+    Save JSON config to ~/.pyx/pyx.json if it has changed
     """
     import os
     import json
@@ -171,7 +277,13 @@ def _save_config(pyx_config):
     config_path_dir = os.path.join(os.path.expanduser('~'), '.pyx')
     config_path = os.path.join(config_path_dir, 'pyx.json')
 
+    config_json = json.dumps(pyx_config, indent=4)
+    if config_json == __CONFIG_STATE__['saved']:
+        return
+
     os.makedirs(config_path_dir, exist_ok=True)
     with open(config_path, 'w') as f:
-        f.write(json.dumps(pyx_config, indent=4))
+        f.write(config_json)
         f.close()
+
+    __CONFIG_STATE__['saved'] = config_json
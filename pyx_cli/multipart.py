@@ -0,0 +1,228 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+import os
+import sys
+import json
+import time
+import random
+import threading
+
+
+__MULTIPART_DEFAULTS__ = {
+    'part_size': 1024 * 1024 * 32,
+    'workers': 4,
+    'retries': 5,
+    'backoff': 0.5,
+}
+
+
+def _journal_path(model_id, fingerprint):
+    journal_dir = os.path.join(os.path.expanduser('~'), '.pyx', 'uploads')
+    os.makedirs(journal_dir, exist_ok=True)
+    return os.path.join(journal_dir, '{0}-{1}.json'.format(model_id, fingerprint[:32]))
+
+
+def _load_journal(path):
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as f:
+        try:
+            return json.load(f)
+        except ValueError:
+            return None
+
+
+def _save_journal(path, journal):
+    # Write-then-rename so an interrupted save never leaves a broken journal
+    with open(path + '.tmp', 'w') as f:
+        f.write(json.dumps(journal, indent=4))
+        f.close()
+    os.replace(path + '.tmp', path)
+
+
+class UploadExpired(IOError):
+    """
+    The server no longer knows the upload id (404 / 410)
+    """
+
+
+class MultipartUpload(object):
+    """
+    Upload a TarStream as fixed-size parts from a bounded thread pool.
+
+    Finished parts are recorded in a journal under ~/.pyx/uploads keyed by
+    model id and archive fingerprint, so an interrupted upload of the same
+    archive only sends the parts that are still missing.
+
+    With a compressor (a BlockCompressor) every part is compressed on its
+    own; the server decodes the concatenated parts with the codec announced
+    when the upload is started.
+    """
+    def __init__(self, client, model_id, stream,
+                 part_size=None, workers=None, retries=None, backoff=None, compressor=None):
+        self.client = client
+        self.model_id = str(model_id)
+        self.stream = stream
+        self.compressor = compressor
+        self.codec = compressor.codec if compressor is not None else 'none'
+        self.part_size = part_size or __MULTIPART_DEFAULTS__['part_size']
+        self.workers = workers or __MULTIPART_DEFAULTS__['workers']
+        self.retries = retries if retries is not None else __MULTIPART_DEFAULTS__['retries']
+        self.backoff = backoff if backoff is not None else __MULTIPART_DEFAULTS__['backoff']
+
+        self.fingerprint = stream.fingerprint()
+        self.journal_path = _journal_path(self.model_id, self.fingerprint)
+        # Bytes on the wire, after compression
+        self.bytes_sent = 0
+        self.sentsofar = 0
+        self.resumed = 0
+        self.pack_seconds = 0.0
+        self._lock = threading.Lock()
+        # Set on the first failed part, so the parts in flight stop retrying
+        self._failed = threading.Event()
+
+    def _path(self, *parts):
+        return '/'.join(['models', self.model_id, 'multipart'] + [str(p) for p in parts])
+
+    def _start(self):
+        journal = _load_journal(self.journal_path)
+        if journal is not None and journal.get('size') == len(self.stream) and \
+                journal.get('codec', 'none') == self.codec:
+            print('Resuming upload {0} ({1} parts done) ...'.format(journal['upload_id'], len(journal['parts'])))
+            self.part_size = journal['part_size']
+            return journal
+
+        r = self.client.post(self._path(),
+                             json={'size': len(self.stream), 'sha': self.fingerprint, 'part_size': self.part_size,
+                                   'codec': self.codec})
+        r.raise_for_status()
+        answer = r.json()
+
+        journal = {
+            'upload_id': answer['upload_id'],
+            'part_size': answer.get('part_size', self.part_size),
+            'size': len(self.stream),
+            'codec': self.codec,
+            'parts': {},
+        }
+        self.part_size = journal['part_size']
+        _save_journal(self.journal_path, journal)
+        return journal
+
+    def _report(self, size):
+        with self._lock:
+            self.sentsofar += size
+            percent = self.sentsofar * 1e2 / len(self.stream)
+            sys.stderr.write("\r{percent:3.0f}%".format(percent=percent))
+
+    def _send_part(self, upload_id, number):
+        import requests
+
+        start = number * self.part_size
+        end = min(start + self.part_size, len(self.stream))
+
+        attempt = 0
+        while True:
+            try:
+                packing = time.perf_counter()
+                data = b''.join(self.stream.iter_range(start, end))
+                if self.codec != 'none':
+                    data = self.compressor.compress(data)
+                with self._lock:
+                    self.pack_seconds += time.perf_counter() - packing
+                # Retries are done here, so a retried part is re-read from the project files
+                r = self.client.put(self._path(upload_id, number),
+                                    headers={'Content-Type': 'application/octet-stream'},
+                                    data=data, retries=0)
+                if r.status_code == 200:
+                    with self._lock:
+                        self.bytes_sent += len(data)
+                    self._report(end - start)
+                    return r.json()['etag']
+                if r.status_code in (404, 410):
+                    raise UploadExpired('Upload {0} is unknown to the server: HTTP {1}'.format(
+                        upload_id, r.status_code))
+                if r.status_code < 500 and r.status_code != 429:
+                    raise IOError('Part {0} was rejected: HTTP {1}'.format(number, r.status_code))
+                error = 'HTTP {0}'.format(r.status_code)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+
+            attempt += 1
+            if self._failed.is_set():
+                raise IOError('Part {0} cancelled: {1}'.format(number, error))
+            if attempt > self.retries:
+                raise IOError('Part {0} failed after {1} attempts: {2}'.format(number, attempt, error))
+
+            # Exponential backoff with full jitter
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def run(self):
+        """
+        Upload the missing parts and commit. A journaled upload the server has
+        expired meanwhile is dropped and started over once.
+        """
+        try:
+            return self._run()
+        except UploadExpired as e:
+            os.remove(self.journal_path)
+            print('{0}, starting a new upload ...'.format(e))
+
+        self._failed.clear()
+        try:
+            return self._run()
+        except UploadExpired:
+            os.remove(self.journal_path)
+            raise
+
+    def _run(self):
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        journal = self._start()
+        upload_id = journal['upload_id']
+        total_parts = max(1, (len(self.stream) + self.part_size - 1) // self.part_size)
+
+        pending = [n for n in range(total_parts) if str(n) not in journal['parts']]
+        self.sentsofar = sum(min(self.part_size, len(self.stream) - int(n) * self.part_size)
+                             for n in journal['parts'])
+        self.resumed = self.sentsofar
+
+        error = None
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._send_part, upload_id, n): n for n in pending}
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                try:
+                    etag = future.result()
+                except IOError as e:
+                    if error is None:
+                        # Parts not started yet are dropped, the ones in flight finish and are journaled
+                        error = e
+                        self._failed.set()
+                        for other in futures:
+                            other.cancel()
+                    continue
+                with self._lock:
+                    journal['parts'][str(futures[future])] = etag
+                    _save_journal(self.journal_path, journal)
+
+        sys.stderr.write("\n")
+        if isinstance(error, UploadExpired):
+            raise error
+        if error is not None:
+            raise IOError('{0} ({1} of {2} parts uploaded, run pyx upload --multipart again to resume)'.format(
+                error, len(journal['parts']), total_parts))
+
+        parts = [{'number': n, 'etag': journal['parts'][str(n)]} for n in range(total_parts)]
+        r = self.client.post(self._path(upload_id, 'commit'),
+                             json={'parts': parts, 'sha': self.fingerprint}, idempotent=True)
+        if r.status_code in (404, 410):
+            raise UploadExpired('Upload {0} is unknown to the server: HTTP {1}'.format(upload_id, r.status_code))
+
+        if r.status_code == 200:
+            os.remove(self.journal_path)
+
+        return r
@@ -0,0 +1,300 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+import io
+import os
+import sys
+import time
+import tarfile
+
+
+def project_entries(pyx_project, source_dir='.', ignore=None):
+    """
+    List top-level project entries with their arcnames inside the project archive,
+    leaving out the ones ignore (IgnoreRules) excludes
+    """
+    entries = []
+    for f in sorted(os.listdir(source_dir)):
+        path = os.path.join(source_dir, f)
+        if ignore is not None and ignore.ignored(path, os.path.isdir(path) and not os.path.islink(path)):
+            continue
+
+        arcname = f
+        if f not in ['pyx-web', 'pyx-testing-data']:
+            arcname = 'models/' + pyx_project['framework'] + '/' + f
+        entries.append((path, arcname))
+
+    return entries
+
+
+def _padding(size):
+    remainder = size % tarfile.BLOCKSIZE
+    return tarfile.BLOCKSIZE - remainder if remainder else 0
+
+
+class TarStream(object):
+    """
+    Tar archive produced block by block while it is being sent.
+
+    Member headers are prepared up front, so the exact archive size is known
+    before the first byte is read and no temporary archive is written to disk.
+    Paths ignore (IgnoreRules) excludes are skipped, directories without
+    being listed.
+    """
+    def __init__(self, entries, chunksize=1 << 20, progress=True, ignore=None):
+        self.chunksize = chunksize
+        self.progress = progress
+        self.ignore = ignore
+        self.members = []
+        self.readsofar = 0
+        # Time spent producing archive bytes while iterating, as opposed to waiting for the consumer
+        self.pack_seconds = 0.0
+
+        # TarFile instance is only used to build TarInfo objects and headers
+        self._tar = tarfile.open(fileobj=io.BytesIO(), mode='w')
+        for path, arcname in entries:
+            self._collect(path, arcname)
+
+        # Archive layout as (offset, length, header bytes or file path) segments,
+        # so any byte range can be produced again without packing the whole archive
+        self._segments = []
+        offset = 0
+        for tarinfo, path, header in self.members:
+            self._segments.append((offset, len(header), header))
+            offset += len(header)
+            if tarinfo.isreg():
+                self._segments.append((offset, tarinfo.size, path))
+                offset += tarinfo.size + _padding(tarinfo.size)
+
+        # End-of-archive marker, padded to a full record like tarfile does
+        offset += 2 * tarfile.BLOCKSIZE
+        remainder = offset % tarfile.RECORDSIZE
+        self.totalsize = offset + (tarfile.RECORDSIZE - remainder if remainder else 0)
+
+    def _collect(self, path, arcname):
+        tarinfo = self._tar.gettarinfo(path, arcname)
+        if tarinfo is None:
+            # Sockets, devices etc. are skipped the same way tarfile.add does
+            return
+        if self.ignore is not None and self.ignore.ignored(path, tarinfo.isdir()):
+            return
+
+        header = tarinfo.tobuf(self._tar.format, self._tar.encoding, self._tar.errors)
+        self.members.append((tarinfo, path, header))
+
+        if tarinfo.isdir():
+            for f in sorted(os.listdir(path)):
+                self._collect(os.path.join(path, f), arcname + '/' + f)
+
+    def member_sizes(self):
+        """
+        [(path, tarinfo, bytes the member takes up in the archive)]
+        """
+        return [(path, tarinfo, len(header) + (tarinfo.size + _padding(tarinfo.size) if tarinfo.isreg() else 0))
+                for tarinfo, path, header in self.members]
+
+    def fingerprint(self):
+        """
+        Hash of the archive layout. Member headers carry names, sizes and
+        modification times, so it changes whenever the packed files do.
+        """
+        import hashlib
+
+        digest = hashlib.sha256()
+        for tarinfo, path, header in self.members:
+            digest.update(header)
+        digest.update(str(self.totalsize).encode())
+        return digest.hexdigest()
+
+    def iter_range(self, start, end):
+        """
+        Yield archive bytes in [start, end) without producing the rest of the archive
+        """
+        position = start
+        for offset, length, source in self._segments:
+            if offset + length <= position:
+                continue
+            if offset >= end:
+                break
+
+            if position < offset:
+                # Zero padding between segments
+                yield tarfile.NUL * (offset - position)
+                position = offset
+
+            stop = min(offset + length, end)
+            if isinstance(source, bytes):
+                yield source[position - offset:stop - offset]
+            else:
+                with open(source, 'rb') as file:
+                    file.seek(position - offset)
+                    left = stop - position
+                    while left > 0:
+                        data = file.read(min(self.chunksize, left))
+                        if not data:
+                            raise IOError('{0} was truncated while packing'.format(source))
+                        left -= len(data)
+                        yield data
+            position = stop
+
+        if position < end:
+            yield tarfile.NUL * (end - position)
+
+    def _blocks(self):
+        return self.iter_range(0, self.totalsize)
+
+    def __iter__(self):
+        buffer = bytearray()
+        start = time.perf_counter()
+        for block in self._blocks():
+            buffer += block
+            if len(buffer) >= self.chunksize:
+                self.pack_seconds += time.perf_counter() - start
+                yield self._report(bytes(buffer))
+                start = time.perf_counter()
+                buffer.clear()
+
+        self.pack_seconds += time.perf_counter() - start
+        if buffer:
+            yield self._report(bytes(buffer))
+        if self.progress:
+            sys.stderr.write("\n")
+
+    def _report(self, data):
+        self.readsofar += len(data)
+        if self.progress:
+            percent = self.readsofar * 1e2 / self.totalsize
+            sys.stderr.write("\r{percent:3.0f}%".format(percent=percent))
+        return data
+
+    def __len__(self):
+        return self.totalsize
+
+
+class UploadInChunks(object):
+    """
+    Upload in chunks for showing progress / use stream.
+    """
+    def __init__(self, filename, chunksize=1 << 13):
+        self.filename = filename
+        self.chunksize = chunksize
+        self.totalsize = os.path.getsize(filename)
+        self.readsofar = 0
+
+    def __iter__(self):
+        with open(self.filename, 'rb') as file:
+            while True:
+                data = file.read(self.chunksize)
+                if not data:
+                    sys.stderr.write("\n")
+                    break
+                self.readsofar += len(data)
+                percent = self.readsofar * 1e2 / self.totalsize
+                sys.stderr.write("\r{percent:3.0f}%".format(percent=percent))
+                yield data
+
+    def __len__(self):
+        return self.totalsize
+
+
+class HashingReader(object):
+    """
+    File-like wrapper hashing and counting the bytes read through it.
+    """
+    def __init__(self, fileobj):
+        import hashlib
+
+        self.fileobj = fileobj
+        self.digest = hashlib.sha256()
+        self.readsofar = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.digest.update(data)
+        self.readsofar += len(data)
+        return data
+
+    def drain(self, chunksize=1 << 20):
+        # tarfile stops at the end-of-archive marker, the rest still has to be hashed
+        while self.read(chunksize):
+            pass
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+class _PrefixedReader(object):
+    def __init__(self, prefix, fileobj):
+        self.prefix = prefix
+        self.fileobj = fileobj
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.fileobj.read(size)
+
+        if size < 0:
+            data, self.prefix = self.prefix + self.fileobj.read(), b''
+        else:
+            data, self.prefix = self.prefix[:size], self.prefix[size:]
+        return data
+
+
+__ZSTD_MAGIC__ = b'\x28\xb5\x2f\xfd'
+__GZIP_MAGIC__ = b'\x1f\x8b'
+
+
+def _decoded(fileobj):
+    """
+    Undo zstd and gzip compression on the fly, including the concatenated
+    members / frames of block compressed archives. bz2 and xz are detected by tarfile itself.
+    """
+    from pyx_cli.compression import DecodingReader
+
+    prefix = fileobj.read(len(__ZSTD_MAGIC__))
+    if prefix == __ZSTD_MAGIC__:
+        return DecodingReader(_PrefixedReader(prefix, fileobj), 'zstd')
+    if prefix.startswith(__GZIP_MAGIC__):
+        return DecodingReader(_PrefixedReader(prefix, fileobj), 'gzip')
+    return _PrefixedReader(prefix, fileobj)
+
+
+def _is_safe_member(member, destination):
+    if member.isdev() or member.isfifo():
+        return False
+
+    target = os.path.realpath(os.path.join(destination, member.name))
+    if os.path.commonpath([destination, target]) != destination:
+        return False
+
+    if member.issym() or member.islnk():
+        link_base = os.path.dirname(target) if member.issym() else destination
+        link_target = os.path.realpath(os.path.join(link_base, member.linkname))
+        if os.path.isabs(member.linkname) or os.path.commonpath([destination, link_target]) != destination:
+            return False
+
+    return True
+
+
+def extract_stream(fileobj, destination):
+    """
+    Extract a (possibly gzip/bz2/xz/zstd compressed) tar archive while it is being read.
+
+    Members that would land outside of the destination directory are skipped.
+    Returns the names of the extracted members.
+    """
+    destination = os.path.realpath(destination)
+    extracted = []
+
+    with tarfile.open(fileobj=_decoded(fileobj), mode='r|*') as tar:
+        for member in tar:
+            if not _is_safe_member(member, destination):
+                print('Skipping unsafe archive member: {0}'.format(member.name))
+                continue
+
+            if hasattr(tarfile, 'data_filter'):
+                tar.extract(member, destination, filter='data')
+            else:
+                tar.extract(member, destination)
+            extracted.append(member.name)
+
+    return extracted
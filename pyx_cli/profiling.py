@@ -0,0 +1,243 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+"""
+Profiling helpers for pyx_endpoints.py and `pyx profile`.
+
+Mark the stages of predict to get a per-stage breakdown:
+
+    from pyx_cli.profiling import stage
+
+    def predict(input_directory, output_directory, model, device):
+        with stage('preprocess'):
+            batch = ...
+        with stage('infer'):
+            outputs = model(batch)
+        with stage('postprocess'):
+            ...
+
+stage() only reads a clock and updates a counter, so it can stay in
+published endpoints. Stages can be nested and also work as decorators.
+"""
+
+import os
+import sys
+import time
+import threading
+import contextlib
+
+
+__PROFILE_DEFAULTS__ = {
+    'interval_ms': 1.0,
+    'top': 20,
+}
+
+# name -> [calls, total ns, max ns]
+__STAGES__ = {}
+# thread id -> names of the stages it is in, read by the sampling profiler
+__ACTIVE_STAGES__ = {}
+__STAGES_LOCK__ = threading.Lock()
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Time a block of code under name. Nested stages are recorded as 'outer/inner'.
+    """
+    active = __ACTIVE_STAGES__.setdefault(threading.get_ident(), [])
+    active.append(name)
+    path = '/'.join(active)
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter_ns() - start
+        active.pop()
+        with __STAGES_LOCK__:
+            record = __STAGES__.setdefault(path, [0, 0, 0])
+            record[0] += 1
+            record[1] += elapsed
+            record[2] = max(record[2], elapsed)
+
+
+def stage_stats():
+    with __STAGES_LOCK__:
+        return {name: {'calls': r[0], 'total_ms': r[1] / 1e6, 'max_ms': r[2] / 1e6} for name, r in __STAGES__.items()}
+
+
+def reset_stages():
+    with __STAGES_LOCK__:
+        __STAGES__.clear()
+
+
+def print_stages(stats, total_ms):
+    if not stats:
+        return
+
+    print('Stages:')
+    for name in sorted(stats):
+        s = stats[name]
+        print('  {0:<32} {1:6d} calls {2:10.1f} ms {3:6.1f}%   max {4:8.1f} ms'.format(
+            '  ' * name.count('/') + name.rsplit('/', 1)[-1], s['calls'], s['total_ms'],
+            s['total_ms'] * 100.0 / total_ms if total_ms else 0.0, s['max_ms']))
+
+
+def _label(code):
+    return '{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class SamplingProfiler(object):
+    """
+    Records the call stack of one thread every interval from a background
+    thread. The profiled code runs unmodified, so the overhead stays small and
+    does not depend on how many Python calls it makes. Active stage() names
+    become the root frames of the stacks; frames from root (a code object)
+    outwards are left out, as are samples taken outside of it.
+
+    Pure Python code only lets the sampler run at GIL switches, so the switch
+    interval is lowered while sampling and every sample is weighted by the
+    time since the previous one. Stack weights are in microseconds.
+    """
+    def __init__(self, interval_ms=None, thread_id=None, root=None):
+        self.interval = (interval_ms or __PROFILE_DEFAULTS__['interval_ms']) / 1e3
+        self.thread_id = thread_id or threading.get_ident()
+        self.root = root
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = int((now - last) * 1e6), now
+
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame.f_code is not self.root:
+                stack.append(_label(frame.f_code))
+                frame = frame.f_back
+            if not stack or (self.root is not None and frame is None):
+                continue
+            stack.reverse()
+
+            stages = ['[{0}]'.format(name) for name in __ACTIVE_STAGES__.get(self.thread_id, [])]
+            key = tuple(stages + stack)
+            self.stacks[key] = self.stacks.get(key, 0) + weight
+            self.samples += 1
+
+    def __enter__(self):
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.interval / 2))
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def collapsed(self):
+        """
+        {stack tuple, root first: microseconds}
+        """
+        return self.stacks
+
+    def hotspots(self):
+        """
+        [(function, self ms, total ms)]: self is time at the top of the stack, total anywhere in it
+        """
+        own, total = {}, {}
+        for stack, count in self.stacks.items():
+            functions = [f for f in stack if not f.startswith('[')]
+            if functions:
+                own[functions[-1]] = own.get(functions[-1], 0) + count
+            for f in set(functions):
+                total[f] = total.get(f, 0) + count
+
+        return [(f, own.get(f, 0) / 1e3, total[f] / 1e3) for f in total]
+
+
+class DeterministicProfiler(object):
+    """
+    cProfile: exact call counts and times of every Python function, at the
+    cost of overhead on every call. Stacks are rebuilt from caller/callee
+    pairs, splitting a function's time between its callers by the share of
+    its cumulative time each of them accounts for.
+    """
+    def __init__(self):
+        import cProfile
+
+        self.profile = cProfile.Profile()
+        self.stats = None
+
+    def __enter__(self):
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.disable()
+
+        import pstats
+        self.stats = pstats.Stats(self.profile).stats
+        # Leave out the profiler's own frames
+        self.stats = {func: value for func, value in self.stats.items()
+                      if func[0] != __file__ and func[2] != "<method 'disable' of '_lsprof.Profiler' objects>"}
+
+    @staticmethod
+    def _name(func):
+        filename, line, name = func
+        return '{0} ({1}:{2})'.format(name, os.path.basename(filename), line)
+
+    def collapsed(self, max_depth=64):
+        # Stats values: (primitive calls, calls, own time, cumulative time, callers)
+        callees = {}
+        for func, (_, _, _, _, callers) in self.stats.items():
+            for caller, edge in callers.items():
+                callees.setdefault(caller, []).append((func, edge[3]))
+
+        stacks = {}
+
+        def walk(func, stack, share):
+            _, _, tottime, cumtime, _ = self.stats[func]
+            stack = stack + (self._name(func),)
+            if tottime * share > 0:
+                stacks[stack] = stacks.get(stack, 0) + tottime * share * 1e3
+            if len(stack) >= max_depth:
+                return
+            for callee, edge_cumtime in callees.get(func, []):
+                if callee in self.stats and self._name(callee) not in stack and cumtime > 0:
+                    walk(callee, stack, share * min(1.0, edge_cumtime / self.stats[callee][3])
+                         if self.stats[callee][3] else 0.0)
+
+        roots = [func for func, value in self.stats.items() if not value[4]]
+        for root in roots:
+            walk(root, (), 1.0)
+        # Counts in microseconds, flamegraph tools expect integers
+        return {stack: int(ms * 1e3) for stack, ms in stacks.items() if int(ms * 1e3)}
+
+    def hotspots(self):
+        return [(self._name(func), value[2] * 1e3, value[3] * 1e3, value[1])
+                for func, value in self.stats.items()]
+
+
+def write_collapsed(stacks, path):
+    """
+    One 'root;...;leaf count' line per stack, the input of flamegraph.pl and speedscope
+    """
+    with open(path, 'w') as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(';'.join(frame.replace(';', ':') for frame in stack) + ' ' + str(count) + '\n')
+        f.close()
+
+
+def print_hotspots(hotspots, top=None, total_ms=None):
+    top = top or __PROFILE_DEFAULTS__['top']
+    print('{0:>10} {1:>7} {2:>10} {3:>7}  {4}'.format('self ms', 'self %', 'total ms', 'total %', 'function'))
+    for item in sorted(hotspots, key=lambda h: h[1], reverse=True)[:top]:
+        function, own, total = item[:3]
+        print('{0:10.1f} {1:6.1f}% {2:10.1f} {3:6.1f}%  {4}{5}'.format(
+            own, own * 100.0 / total_ms if total_ms else 0.0, total, total * 100.0 / total_ms if total_ms else 0.0,
+            function, '  [{0} calls]'.format(item[3]) if len(item) > 3 else ''))
@@ -0,0 +1,201 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+import os
+import time
+
+from pyx_cli.device import limit_threads
+
+
+__RUN_DEFAULTS__ = {
+    'shards_per_worker': 4,
+}
+
+
+def list_inputs(input_dir):
+    """
+    Relative paths of all files under input_dir, sorted
+    """
+    files = []
+    for root, dirs, filenames in os.walk(input_dir):
+        dirs.sort()
+        for filename in sorted(filenames):
+            files.append(os.path.relpath(os.path.join(root, filename), input_dir))
+    return files
+
+
+def make_shards(input_dir, files, count):
+    """
+    Split files into at most count shards of similar total size, largest files first
+    """
+    count = max(1, min(count, len(files)))
+    shards = [[] for _ in range(count)]
+    sizes = [0] * count
+
+    sized = sorted(((os.path.getsize(os.path.join(input_dir, f)), f) for f in files), reverse=True)
+    for size, f in sized:
+        i = sizes.index(min(sizes))
+        shards[i].append(f)
+        sizes[i] += size
+    return [sorted(s) for s in shards if s]
+
+
+def link_inputs(input_dir, files, destination):
+    """
+    Mirror files of input_dir into destination, as symlinks where possible
+    """
+    for f in files:
+        source = os.path.abspath(os.path.join(input_dir, f))
+        target = os.path.join(destination, f)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.symlink(source, target)
+        except OSError:
+            from shutil import copyfile
+            copyfile(source, target)
+
+
+def merge_outputs(source, destination):
+    """
+    Move everything under source into destination, keeping relative paths
+    """
+    moved = 0
+    for root, _, filenames in os.walk(source):
+        relative = os.path.relpath(root, source)
+        target_dir = os.path.normpath(os.path.join(destination, relative))
+        os.makedirs(target_dir, exist_ok=True)
+        for filename in filenames:
+            os.replace(os.path.join(root, filename), os.path.join(target_dir, filename))
+            moved += 1
+    return moved
+
+
+# Per worker process state, set up once by _init_worker
+__WORKER__ = {}
+
+
+def _init_worker(project_dir, device, threads):
+    if threads:
+        limit_threads(threads)
+
+    from pyx_cli.endpoints import ModelEndpoints
+
+    start = time.perf_counter()
+    try:
+        __WORKER__['endpoints'] = ModelEndpoints(project_dir, threads=(threads, None) if threads else None).load(device)
+        __WORKER__['error'] = None
+    except Exception as e:
+        __WORKER__['error'] = e
+    __WORKER__['load_seconds'] = time.perf_counter() - start
+
+
+def _run_shard(input_dir, files, output_dir):
+    import shutil
+    import tempfile
+
+    if __WORKER__['error'] is not None:
+        raise __WORKER__['error']
+
+    # Staged next to output_dir so merging is a rename
+    staging = tempfile.mkdtemp(prefix='.pyx-shard-', dir=output_dir)
+    try:
+        shard_input = os.path.join(staging, 'input')
+        shard_output = os.path.join(staging, 'output')
+        os.makedirs(shard_output)
+        link_inputs(input_dir, files, shard_input)
+
+        start = time.perf_counter()
+        completed = __WORKER__['endpoints'].predict(shard_input, shard_output)
+        seconds = time.perf_counter() - start
+        if completed is False:
+            raise AssertionError('predict returned False')
+        shutil.rmtree(shard_input)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    # Outputs stay staged until every shard is done and none of their names collide
+    return {
+        'pid': os.getpid(),
+        'files': len(files),
+        'bytes': sum(os.path.getsize(os.path.join(input_dir, f)) for f in files),
+        'seconds': seconds,
+        'load_seconds': __WORKER__['load_seconds'],
+        'staging': shard_output,
+        'outputs': list_inputs(shard_output),
+    }
+
+
+def run_sharded(project_dir, input_dir, output_dir, device, workers, threads=None, files=None):
+    """
+    Run predict over input_dir split across a pool of worker processes.
+
+    Every worker imports pyx_endpoints.py and loads the model once, then
+    takes shards from a shared queue; there are a few shards per worker so
+    faster workers pick up more. Each shard gets its own staging directories.
+    Once all shards are done their outputs are merged into output_dir, unless
+    several shards wrote an output of the same name (a summary over all
+    inputs, say): merging would keep only the last one, so ValueError is
+    raised and output_dir is left as it was.
+
+    Returns per worker statistics keyed by process id.
+    """
+    import multiprocessing
+
+    files = list_inputs(input_dir) if files is None else files
+    if not files:
+        return {}
+
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+    shards = make_shards(input_dir, files, workers * __RUN_DEFAULTS__['shards_per_worker'])
+
+    stats = {}
+    # spawn: the workers must not inherit CUDA or thread pool state from this process
+    context = multiprocessing.get_context('spawn')
+    try:
+        with context.Pool(workers, initializer=_init_worker,
+                          initargs=(os.path.abspath(project_dir), device, threads)) as pool:
+            results = [pool.apply_async(_run_shard, (os.path.abspath(input_dir), shard, os.path.abspath(output_dir)))
+                       for shard in shards]
+            results = [result.get() for result in results]
+
+        writers = {}
+        for r in results:
+            for output in r['outputs']:
+                writers[output] = writers.get(output, 0) + 1
+        collisions = sorted(output for output, count in writers.items() if count > 1)
+        if collisions:
+            raise ValueError('{0} shards wrote {1}{2}: the model writes outputs over all of its inputs, '
+                             'run it without --workers'.format(max(writers.values()), ', '.join(collisions[:5]),
+                                                               ' ...' if len(collisions) > 5 else ''))
+
+        for r in results:
+            merge_outputs(r['staging'], output_dir)
+            worker = stats.setdefault(r['pid'], {'shards': 0, 'files': 0, 'bytes': 0, 'seconds': 0.0,
+                                                 'load_seconds': r['load_seconds']})
+            worker['shards'] += 1
+            worker['files'] += r['files']
+            worker['bytes'] += r['bytes']
+            worker['seconds'] += r['seconds']
+    finally:
+        # Staged outputs, and staging directories of workers terminated on failure
+        import glob
+        import shutil
+        for staging in glob.glob(os.path.join(output_dir, '.pyx-shard-*')):
+            shutil.rmtree(staging, ignore_errors=True)
+
+    return stats
+
+
+def print_worker_stats(stats, elapsed):
+    total = 0
+    for i, pid in enumerate(sorted(stats)):
+        s = stats[pid]
+        total += s['files']
+        print('  worker {0} (pid {1}): {2} files in {3} shards, load {4:.2f} s, '
+              'predict {5:.2f} s, {6:.1f} files/s'.format(
+            i, pid, s['files'], s['shards'], s['load_seconds'], s['seconds'],
+            s['files'] / s['seconds'] if s['seconds'] else float('nan')))
+    print('Total: {0} files in {1:.2f} s, {2:.1f} files/s'.format(
+        total, elapsed, total / elapsed if elapsed else float('nan')))
@@ -0,0 +1,227 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+"""
+Local inference server keeping the model of a pyx project loaded.
+
+    POST /predict   {"input_dir": ..., "output_dir": ...} with local paths, or a zip
+                    archive of the inputs (Content-Type: application/zip) answered
+                    with a zip archive of the outputs
+    GET  /health    readiness and queue depth
+    GET  /metrics   Prometheus text format counters
+"""
+
+import os
+import json
+import time
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+
+class ModelWorker(object):
+    """
+    Runs predictions one at a time on a single thread, so endpoints never see
+    concurrent calls. Reloads of pyx_endpoints.py go through the same queue
+    and happen between predictions.
+    """
+    def __init__(self, endpoints, device, queue_size=64):
+        self.endpoints = endpoints
+        self.device = device
+        self.jobs = queue.Queue(maxsize=queue_size)
+
+        self.metrics = {
+            'requests_total': 0,
+            'errors_total': 0,
+            'rejected_total': 0,
+            'predict_seconds_sum': 0.0,
+            'reloads_total': 0,
+            'load_seconds': 0.0,
+        }
+        self._lock = threading.Lock()
+
+    def start(self):
+        start = time.perf_counter()
+        self.endpoints.load(self.device)
+        self.metrics['load_seconds'] = time.perf_counter() - start
+
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _loop(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job['kind'] == 'reload':
+                    start = time.perf_counter()
+                    self.endpoints.reload()
+                    with self._lock:
+                        self.metrics['reloads_total'] += 1
+                        self.metrics['load_seconds'] = time.perf_counter() - start
+                    print('Reloaded pyx_endpoints.py')
+                else:
+                    start = time.perf_counter()
+                    job['result'] = self.endpoints.predict(job['input_dir'], job['output_dir'], self.device)
+                    with self._lock:
+                        self.metrics['predict_seconds_sum'] += time.perf_counter() - start
+                        self.metrics['requests_total'] += 1
+            except Exception as e:
+                if job['kind'] == 'reload':
+                    print('Reload failed, keeping the previous version: {0}'.format(e))
+                job['error'] = e
+                with self._lock:
+                    self.metrics['errors_total'] += 1
+            finally:
+                job['done'].set()
+
+    def submit(self, kind, **kwargs):
+        job = {'kind': kind, 'done': threading.Event(), 'result': None, 'error': None, **kwargs}
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self.metrics['rejected_total'] += 1
+            return None
+        return job
+
+    def predict(self, input_dir, output_dir):
+        job = self.submit('predict', input_dir=input_dir, output_dir=output_dir)
+        if job is None:
+            return None
+        job['done'].wait()
+        return job
+
+    def watch(self, interval=1.0):
+        """
+        Reload the endpoints whenever pyx_endpoints.py changes
+        """
+        def loop():
+            while True:
+                time.sleep(interval)
+                if not self.endpoints.changed():
+                    continue
+                loaded, mtime = self.endpoints.mtime, os.path.getmtime(self.endpoints.path)
+                # A full queue rejects the reload, leave mtime alone so the next pass tries again
+                if self.submit('reload') is not None and self.endpoints.mtime == loaded:
+                    self.endpoints.mtime = mtime
+
+        threading.Thread(target=loop, daemon=True).start()
+
+
+class ServeHandler(BaseHTTPRequestHandler):
+    worker = None
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def _reply(self, status, body, content_type='application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, {'status': 'ok', 'queue': self.worker.jobs.qsize()})
+        elif self.path == '/metrics':
+            lines = []
+            metrics = {**self.worker.metrics, 'queue_depth': self.worker.jobs.qsize()}
+            for name, value in sorted(metrics.items()):
+                lines.append('pyx_serve_{0} {1}'.format(name, value))
+            self._reply(200, ('\n'.join(lines) + '\n').encode(), 'text/plain; version=0.0.4')
+        else:
+            self._reply(404, {'status_msg': 'Not found'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            return self._reply(404, {'status_msg': 'Not found'})
+
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        except ValueError:
+            return self._reply(400, {'status_msg': 'Invalid Content-Length'})
+        if self.headers.get('Content-Type', '').startswith('application/zip'):
+            return self._predict_archive(body)
+
+        try:
+            request = json.loads(body.decode() or '{}')
+        except ValueError:
+            return self._reply(400, {'status_msg': 'Body is not valid JSON'})
+        if not isinstance(request, dict) or not all(isinstance(request.get(k), str) and request[k]
+                                                    for k in ('input_dir', 'output_dir')):
+            return self._reply(400, {'status_msg': 'input_dir and output_dir are required'})
+        if not os.path.isdir(request['input_dir']):
+            return self._reply(400, {'status_msg': '{0} is not a directory'.format(request['input_dir'])})
+
+        os.makedirs(request['output_dir'], exist_ok=True)
+        job = self.worker.predict(request['input_dir'], request['output_dir'])
+        self._reply_job(job, lambda: {'status': 'ok', 'output_dir': request['output_dir']})
+
+    def _predict_archive(self, body):
+        import io
+        import zipfile
+        import tempfile
+        from pyx_cli.tasks import _zip_directory
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            input_dir = os.path.join(tmpdirname, 'input')
+            output_dir = os.path.join(tmpdirname, 'output')
+            os.makedirs(output_dir)
+            try:
+                with zipfile.ZipFile(io.BytesIO(body)) as zip_file:
+                    zip_file.extractall(input_dir)
+            except zipfile.BadZipFile:
+                return self._reply(400, {'status_msg': 'Body is not a valid zip archive'})
+
+            def archive():
+                # Requests are handled on several threads, make_archive would change their working directory
+                _zip_directory(output_dir, os.path.join(tmpdirname, 'output.zip'))
+                with open(os.path.join(tmpdirname, 'output.zip'), 'rb') as f:
+                    return f.read()
+
+            job = self.worker.predict(input_dir, output_dir)
+            self._reply_job(job, archive, 'application/zip')
+
+    def _reply_job(self, job, success, content_type='application/json'):
+        if job is None:
+            self._reply(503, {'status_msg': 'Queue is full'})
+        elif job['error'] is not None:
+            self._reply(500, {'status_msg': str(job['error'])})
+        elif job['result'] is False:
+            self._reply(500, {'status_msg': 'predict returned False'})
+        else:
+            self._reply(200, success(), content_type)
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(endpoints, device, host='127.0.0.1', port=8080, socket_path=None, queue_size=64, watch=True):
+    worker = ModelWorker(endpoints, device, queue_size)
+    print('Loading model ...')
+    worker.start()
+    print('Model loaded in {0:.2f} s'.format(worker.metrics['load_seconds']))
+    if watch:
+        worker.watch()
+
+    handler = type('Handler', (ServeHandler,), {'worker': worker})
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, handler)
+        print('Serving on unix socket {0}'.format(socket_path))
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        print('Serving on http://{0}:{1}/'.format(host, port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        endpoints.unload()
@@ -0,0 +1,279 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+import time
+import random
+
+
+__POLL_DEFAULTS__ = {
+    'initial_delay': 0.5,
+    'max_delay': 15.0,
+    'multiplier': 1.6,
+    'timeout': None,
+    'long_poll': None,
+}
+
+
+def parse_model_path(model_name):
+    """
+    Split model-id/framework[:version]
+    """
+    model_id, framework = model_name.split('/')
+    version = 'latest'
+    if framework.find(':') != -1:
+        framework, version = framework.split(':')
+
+    return model_id, framework, version
+
+
+def enqueue(client, model_name, input_dir, progress=True, codec=None, compressor=None):
+    """
+    Send input_dir to the task queue. Servers accepting tar inputs get a tar
+    stream, compressed with the negotiated codec (or by compressor, a
+    BlockCompressor shared between concurrent enqueues); others a zip archive.
+    """
+    import os
+    from pyx_cli import telemetry
+    from pyx_cli.compression import server_capabilities
+
+    model_id, framework, version = parse_model_path(model_name)
+    path = 'tasks/enqueue/' + model_id + '/' + framework + '/' + version
+
+    if 'tar' not in server_capabilities(client)['task_archives']:
+        return _enqueue_zip(client, path, input_dir, progress)
+
+    from pyx_cli.packing import TarStream
+    from pyx_cli.compression import BlockCompressor, CompressedStream, negotiate_codec
+
+    entries = [(os.path.join(input_dir, f), f) for f in sorted(os.listdir(input_dir))]
+    stream = TarStream(entries, 1024 * 1024 * 1, progress=progress)
+    owned = compressor is None
+    if owned:
+        compressor = BlockCompressor(negotiate_codec(client, codec))
+    headers = {'Content-Type': 'application/x-tar'}
+    data = stream
+    if compressor.codec != 'none':
+        headers['Content-Encoding'] = compressor.codec
+        data = CompressedStream(stream, compressor)
+
+    with telemetry.span('upload', codec=compressor.codec) as attributes:
+        try:
+            return client.post(path, headers=headers, data=data)
+        finally:
+            if owned:
+                compressor.close()
+            attributes.update({'bytes': data.bytes_sent if data is not stream else stream.readsofar,
+                               'raw_bytes': stream.readsofar, 'pack_seconds': stream.pack_seconds})
+
+
+def _zip_directory(input_dir, archive):
+    """
+    Zip the contents of input_dir like shutil.make_archive, without changing
+    the working directory (make_archive does before Python 3.10.6, which is
+    not safe from threads)
+    """
+    import os
+    import zipfile
+
+    input_dir = os.path.abspath(input_dir)
+    with zipfile.ZipFile(archive, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for root, dirs, files in os.walk(input_dir):
+            dirs.sort()
+            for name in dirs + sorted(files):
+                path = os.path.join(root, name)
+                arcname = os.path.relpath(path, input_dir)
+                if os.path.isdir(path):
+                    zip_file.write(path, arcname + '/')
+                elif os.path.isfile(path):
+                    zip_file.write(path, arcname)
+
+
+def _enqueue_zip(client, path, input_dir, progress):
+    import os
+    import tempfile
+    from pyx_cli import telemetry
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        archive = os.path.join(tmpdirname, '_input_files.zip')
+        with telemetry.span('zip') as attributes:
+            _zip_directory(input_dir, archive)
+            attributes['bytes'] = os.path.getsize(archive)
+
+        with telemetry.span('upload', bytes=os.path.getsize(archive)):
+            if progress:
+                from pyx_cli.packing import UploadInChunks
+
+                return client.post(path, data=UploadInChunks(archive, 1024 * 1024 * 1))
+
+            with open(archive, 'rb') as f:
+                return client.post(path, data=f)
+
+
+def _decode_base64_to(base64_data, out_file, chunksize=1 << 22):
+    """
+    Decode base64 text slice by slice, so only one slice is held decoded at a time
+    """
+    import binascii
+
+    carry = ''
+    for start in range(0, len(base64_data), chunksize):
+        chunk = carry + ''.join(base64_data[start:start + chunksize].split())
+        aligned = len(chunk) - len(chunk) % 4
+        out_file.write(binascii.a2b_base64(chunk[:aligned]))
+        carry = chunk[aligned:]
+
+    if carry:
+        out_file.write(binascii.a2b_base64(carry))
+
+
+def unpack_result(res, output_dir, client=None):
+    """
+    Write the result of a finished task into output_dir.
+
+    Binary results (output_url) are streamed to disk, inline base64 results are
+    decoded incrementally. The archive is then extracted member by member, so
+    memory use does not grow with the size of the result.
+    """
+    import os
+    import shutil
+    import zipfile
+    import tempfile
+    from pyx_cli import telemetry
+
+    with tempfile.TemporaryFile() as archive:
+        with telemetry.span('download', inline='output_url' not in res['result']) as attributes:
+            if 'output_url' in res['result']:
+                r = client.get(res['result']['output_url'], stream=True)
+                r.raise_for_status()
+                r.raw.decode_content = True
+                shutil.copyfileobj(r.raw, archive, 1 << 20)
+            else:
+                _decode_base64_to(res['result']['output_dir'], archive)
+            attributes['bytes'] = archive.tell()
+
+        archive.seek(0)
+        os.makedirs(output_dir, exist_ok=True)
+        with telemetry.span('unzip', bytes=attributes['bytes']):
+            with zipfile.ZipFile(archive) as zip_file:
+                zip_file.extractall(output_dir)
+
+
+def is_finished(res):
+    return bool(res['result']) or res['status'] != 0
+
+
+def is_retryable(r):
+    """
+    Whether a status poll should simply be repeated: connection errors (r is
+    None), throttling and server errors
+    """
+    return r is None or r.status_code == 429 or r.status_code >= 500
+
+
+def _retry_after(r):
+    if r is None:
+        return None
+    value = r.headers.get('Retry-After')
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+
+
+class TaskWaiter(object):
+    """
+    Poll tasks/status/<id> until the task is finished.
+
+    The delay between polls grows exponentially (with jitter) while the status
+    does not change and is reset when it does. A Retry-After header from the
+    server overrides the computed delay. With long_poll set, the server is asked
+    to hold the request for up to that many seconds waiting for a change.
+    All polls go through the shared keep-alive client.
+    """
+    def __init__(self, client, initial_delay=None, max_delay=None,
+                 multiplier=None, timeout=None, long_poll=None):
+        self.client = client
+        self.initial_delay = initial_delay or __POLL_DEFAULTS__['initial_delay']
+        self.max_delay = max_delay or __POLL_DEFAULTS__['max_delay']
+        self.multiplier = multiplier or __POLL_DEFAULTS__['multiplier']
+        self.timeout = timeout or __POLL_DEFAULTS__['timeout']
+        self.long_poll = long_poll or __POLL_DEFAULTS__['long_poll']
+
+        self.polls = {}
+
+    def poll(self, task_id):
+        """
+        Single status request. Returns the response and the decoded status.
+        On connection errors and 2xx answers that are not JSON the response is
+        None; the status always has a status_msg.
+        """
+        import requests
+
+        # Servers that can serve results as a separate download return output_url instead of inline base64
+        params = {'result_format': 'url'}
+        if self.long_poll:
+            params['wait'] = self.long_poll
+        kwargs = {}
+        if self.long_poll:
+            # The server may hold the request, so it must not hit the read timeout
+            kwargs['timeout'] = (self.client.timeout[0], self.client.timeout[1] + self.long_poll)
+        self.polls[task_id] = self.polls.get(task_id, 0) + 1
+        try:
+            r = self.client.get('tasks/status/' + str(task_id), params=params, retries=0, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            return None, {'status_msg': 'Status request failed: {0}'.format(e)}
+
+        try:
+            res = r.json()
+        except ValueError:
+            res = None
+        if 200 <= r.status_code < 300:
+            if not isinstance(res, dict):
+                return None, {'status_msg': 'Status is not JSON'}
+            return r, res
+
+        # Error answers may be HTML pages (a proxy's 502 / 504)
+        message = res.get('status_msg') if isinstance(res, dict) else None
+        return r, {'status_msg': message or 'HTTP {0}'.format(r.status_code)}
+
+    def next_delay(self, delay, r):
+        hint = _retry_after(r)
+        if hint is not None:
+            return hint, delay
+
+        # Equal jitter keeps polls of concurrent clients from lining up
+        sleep = delay / 2 + random.uniform(0, delay / 2)
+        return sleep, min(delay * self.multiplier, self.max_delay)
+
+    def wait(self, task_id, on_status=None):
+        """
+        Block until the task is finished. Raises TimeoutError when it takes
+        longer than timeout seconds.
+        """
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        delay = self.initial_delay
+        last_status = None
+
+        while True:
+            r, res = self.poll(task_id)
+            if on_status is not None:
+                on_status(res)
+
+            if r is not None and r.status_code == 200 and is_finished(res):
+                return r, res
+            if r is not None and r.status_code != 200 and not is_retryable(r):
+                return r, res
+
+            if res.get('status_msg') != last_status:
+                last_status = res.get('status_msg')
+                delay = self.initial_delay
+
+            sleep, delay = self.next_delay(delay, r)
+            if deadline is not None:
+                if time.monotonic() + sleep > deadline:
+                    raise TimeoutError('Task {0} is not finished after {1} s'.format(task_id, self.timeout))
+            time.sleep(sleep)
@@ -0,0 +1,201 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+"""
+Opt-in performance telemetry of CLI commands.
+
+Commands mark their phases with span() and counters with count():
+
+    from pyx_cli import telemetry
+
+    with telemetry.span('pack') as attributes:
+        ...
+        attributes['bytes'] = size
+
+Both do nothing until enable() is called (`pyx --telemetry PATH ...`). When the
+command finishes, finish() writes its spans, counters and the per-endpoint
+HTTP statistics of the shared clients either as JSON lines appended to PATH or
+as a Prometheus textfile (node_exporter textfile collector) replaced atomically.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import contextlib
+
+
+__TELEMETRY_FORMATS__ = ['jsonl', 'prometheus']
+
+__RECORDER__ = None
+
+
+class Telemetry(object):
+    """
+    Spans and counters of one command
+    """
+    def __init__(self, path, fmt=None, command=None):
+        self.path = path
+        self.format = fmt or ('prometheus' if path.endswith('.prom') else 'jsonl')
+        self.command = command
+        self.started = time.time()
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, seconds, attributes, status):
+        record = {'span': name, 'start': start, 'seconds': seconds, 'status': status}
+        record.update(attributes)
+        if attributes.get('bytes') and seconds > 0:
+            record['bytes_per_second'] = attributes['bytes'] / seconds
+        with self._lock:
+            self.spans.append(record)
+
+    def count(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def _http_stats(self, clients):
+        stats = {}
+        for client in clients:
+            for endpoint, s in client.stats.items():
+                merged = stats.setdefault(endpoint, dict.fromkeys(s, 0))
+                for k, v in s.items():
+                    merged[k] = max(merged[k], v) if k == 'max_seconds' else merged[k] + v
+        return stats
+
+    def write(self, clients=(), status='ok'):
+        seconds = time.time() - self.started
+        http = self._http_stats(clients)
+        if self.format == 'prometheus':
+            self._write_prometheus(seconds, http, status)
+        else:
+            self._write_jsonl(seconds, http, status)
+
+    def _write_jsonl(self, seconds, http, status):
+        common = {'command': self.command, 'pid': os.getpid()}
+        records = [{'type': 'command', 'start': self.started, 'seconds': seconds, 'status': status}]
+        records += [{'type': 'span', **span} for span in self.spans]
+        records += [{'type': 'counter', 'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self.counters.items())]
+        records += [{'type': 'http', 'endpoint': endpoint, **s} for endpoint, s in sorted(http.items())]
+
+        # One write per command, so concurrent commands appending to the same file don't interleave lines
+        data = ''.join(json.dumps({**common, **record}) + '\n' for record in records)
+        with open(self.path, 'a') as f:
+            f.write(data)
+            f.close()
+
+    def _samples(self, seconds, http, status):
+        """
+        {metric name: [(labels, value)]}, every sample labelled with the command
+        """
+        command = {'command': self.command}
+        samples = {}
+
+        def add(name, value, **labels):
+            samples.setdefault('pyx_' + name, []).append(({**command, **labels}, value))
+
+        add('command_seconds', seconds)
+        add('command_success', int(status == 'ok'))
+        add('command_last_run_timestamp_seconds', self.started)
+
+        # Spans of the same name are summed, numeric attributes become metrics of their own
+        spans = {}
+        for span in self.spans:
+            total = spans.setdefault(span['span'], {'count': 0})
+            total['count'] += 1
+            for k, v in span.items():
+                if k not in ('start', 'bytes_per_second') and isinstance(v, (int, float)) and not isinstance(v, bool):
+                    total[k] = total.get(k, 0) + v
+        for name, total in sorted(spans.items()):
+            for k, v in sorted(total.items()):
+                add('span_' + k, v, span=name)
+            if total.get('bytes') and total['seconds'] > 0:
+                add('span_bytes_per_second', total['bytes'] / total['seconds'], span=name)
+
+        for (name, labels), value in sorted(self.counters.items()):
+            add(re.sub(r'[^a-zA-Z0-9_]', '_', name), value, **dict(labels))
+
+        for endpoint, s in sorted(http.items()):
+            add('http_requests', s['requests'], endpoint=endpoint)
+            add('http_errors', s['errors'], endpoint=endpoint)
+            add('http_seconds', s['seconds'], endpoint=endpoint)
+            add('http_max_seconds', s['max_seconds'], endpoint=endpoint)
+            add('http_bytes_sent', s['bytes_sent'], endpoint=endpoint)
+            add('http_bytes_received', s['bytes_received'], endpoint=endpoint)
+        return samples
+
+    def _write_prometheus(self, seconds, http, status):
+        """
+        The file holds the last run of every command: samples of other commands are kept
+        """
+        samples = self._samples(seconds, http, status)
+
+        own = 'command="{0}"'.format(self.command)
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    match = re.match(r'^(\w+)\{(.*)\} (\S+)$', line.strip())
+                    if match is None or own in match.group(2).split(','):
+                        continue
+                    labels = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group(2)))
+                    samples.setdefault(match.group(1), []).append((labels, float(match.group(3))))
+        except OSError:
+            pass
+
+        lines = []
+        for name in sorted(samples):
+            lines.append('# TYPE {0} gauge'.format(name))
+            for labels, value in samples[name]:
+                lines.append('{0}{{{1}}} {2}'.format(name, ','.join(
+                    '{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                    for k, v in sorted(labels.items())), repr(float(value))))
+
+        tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+            f.close()
+        os.replace(tmp_path, self.path)
+
+
+def enable(path, fmt=None, command=None):
+    global __RECORDER__
+    __RECORDER__ = Telemetry(path, fmt, command)
+    return __RECORDER__
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """
+    Time a phase of the command. Yields the attributes, which the block can add to;
+    'bytes' also gives the throughput.
+    """
+    if __RECORDER__ is None:
+        yield attributes
+        return
+
+    start = time.time()
+    started = time.perf_counter()
+    status = 'error'
+    try:
+        yield attributes
+        status = 'ok'
+    finally:
+        __RECORDER__.add_span(name, start, time.perf_counter() - started, attributes, status)
+
+
+def count(name, value=1, **labels):
+    if __RECORDER__ is not None:
+        __RECORDER__.count(name, value, labels)
+
+
+def finish(clients=(), status='ok'):
+    global __RECORDER__
+    if __RECORDER__ is None:
+        return
+
+    recorder, __RECORDER__ = __RECORDER__, None
+    recorder.write(clients, status)
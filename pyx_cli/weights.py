@@ -0,0 +1,105 @@
+# Copyright 2020 by PYX.AI
+# All rights reserved.
+
+"""
+Memory-mapped weights for pyx_endpoints.py.
+
+A .pyxt file holds named arrays in a layout NumPy maps directly:
+
+    8 bytes   magic b'PYXTNSR1'
+    8 bytes   header length, little endian
+    header    JSON {name: {"dtype": "<f4", "shape": [...], "offset": ...}}
+    data      raw C-ordered arrays, each starting on a 64 byte boundary,
+              offsets relative to the first one
+
+load_tensors() returns read-only views of one shared mapping instead of
+copies, so loading takes about the same time whatever the file size, and
+processes loading the same file share its pages through the page cache.
+
+    from pyx_cli.weights import save_tensors, load_tensors
+
+    save_tensors('weights.pyxt', {'fc.weight': w, 'fc.bias': b})
+    tensors = load_tensors('weights.pyxt')
+
+Frameworks can wrap the arrays without copying, e.g. torch.from_numpy()
+(which warns that they are read-only) or onnxruntime OrtValue.
+"""
+
+import os
+import json
+import struct
+
+import numpy as np
+
+
+__MAGIC__ = b'PYXTNSR1'
+__ALIGNMENT__ = 64
+
+
+def _aligned(offset):
+    return (offset + __ALIGNMENT__ - 1) // __ALIGNMENT__ * __ALIGNMENT__
+
+
+def save_tensors(path, tensors):
+    """
+    Write a dict of arrays to a .pyxt file, replacing it atomically
+    """
+    header = {}
+    arrays = []
+    end = 0
+    for name, array in tensors.items():
+        array = np.ascontiguousarray(array)
+        if array.dtype.hasobject:
+            raise ValueError('{0}: object arrays can not be memory-mapped'.format(name))
+
+        header[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': end}
+        arrays.append((end, array))
+        end = _aligned(end + array.nbytes)
+
+    encoded = json.dumps(header).encode()
+    data_start = _aligned(len(__MAGIC__) + 8 + len(encoded))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(__MAGIC__)
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(encoded)
+        for offset, array in arrays:
+            f.seek(data_start + offset)
+            f.write(array.data)
+        # Trailing padding, so the last array's view never reaches past the end
+        f.truncate(data_start + end)
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(__MAGIC__)) != __MAGIC__:
+            raise ValueError('{0} is not a pyx tensor file'.format(path))
+        length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length).decode())
+
+    return header, _aligned(len(__MAGIC__) + 8 + length)
+
+
+def load_tensors(path, names=None):
+    """
+    Map a .pyxt file and return {name: read-only array}. The mapping stays
+    alive for as long as any of the arrays is referenced.
+    """
+    import mmap
+
+    header, data_start = read_header(path)
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    tensors = {}
+    for name, item in header.items():
+        if names is not None and name not in names:
+            continue
+
+        dtype = np.dtype(item['dtype'])
+        count = int(np.prod(item['shape'], dtype=np.int64))
+        tensors[name] = np.frombuffer(mapping, dtype=dtype, count=count,
+                                      offset=data_start + item['offset']).reshape(item['shape'])
+    return tensors